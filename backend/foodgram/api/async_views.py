@@ -0,0 +1,98 @@
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework.response import Response
+
+ASYNC_METHODS = ('get', 'head')
+
+
+class AsyncReadViewSetMixin:
+    """Асинхронная обработка GET-запросов при работе через ASGI.
+
+    GET и HEAD для действия, у которого есть асинхронный вариант
+    a<действие> (alist, aretrieve, asubscriptions), обрабатываются
+    без отдельного потока на весь запрос: запросы к БД идут через
+    асинхронный ORM, в поток уходят только проверка токена, фильтры
+    и сериализация. Остальные методы выполняются синхронными действиями.
+    Включается настройкой ASYNC_VIEWS, иначе представление остаётся
+    обычным синхронным.
+    """
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_VIEWS:
+            return view
+        async_actions = {
+            method: action for method, action in actions.items()
+            if method in ASYNC_METHODS and hasattr(cls, f'a{action}')
+        }
+        if not async_actions:
+            return view
+        if 'get' in async_actions:
+            async_actions.setdefault('head', async_actions['get'])
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            if request.method.lower() not in async_actions:
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = {**actions, **async_actions}
+            for method, action in self.action_map.items():
+                setattr(self, method, getattr(self, action))
+            self.request = request
+            return await self.adispatch(request, *args, **kwargs)
+
+        return update_wrapper(async_view, view)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """Асинхронный вариант APIView.dispatch"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            if 'HTTP_AUTHORIZATION' in request.META:
+                # Проверка токена читает его из БД
+                await sync_to_async(lambda: request.user)()
+            self.initial(request, *args, **kwargs)
+            response = await getattr(self, f'a{self.action}')(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def afilter_queryset(self, queryset):
+        # Фильтры по связанным объектам проверяют значения запросами к БД
+        return await sync_to_async(self.filter_queryset)(queryset)
+
+    async def aget_object(self):
+        """Асинхронный вариант get_object"""
+        queryset = await self.afilter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    async def aserialize(self, serializer):
+        """Данные сериализатора; вложенные объекты могут догружаться из БД"""
+        return await sync_to_async(lambda: serializer.data)()
+
+    async def alist_response(self, queryset):
+        """Асинхронный вариант ListModelMixin.list для готового queryset"""
+        if self.paginator is None:
+            items = [item async for item in queryset]
+            return Response(await self.aserialize(self.get_serializer(items, many=True)))
+        page = await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+        return self.get_paginated_response(
+            await self.aserialize(self.get_serializer(page, many=True))
+        )
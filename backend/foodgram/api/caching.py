@@ -0,0 +1,116 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from .metrics import count_cache_lookup
+
+from recipes.catalog import CATALOG_VERSION_KEY
+from recipes.versions import (
+    AUTHOR_VERSION_KEY, RECIPE_VERSION_KEY, RECIPES_VERSION_KEY, get_versions
+)
+
+RECIPE_FRAGMENT_KEY = 'recipe_fragment:{base_url}:{recipe_id}:{versions}'
+ANONYMOUS_RESPONSE_KEY = 'anonymous_response:{url}:{versions}'
+
+
+def get_fragment_keys(recipes, base_url):
+    """Ключи фрагментов рецептов с учётом версий рецепта и автора"""
+    version_keys = {CATALOG_VERSION_KEY}
+    for recipe in recipes:
+        version_keys.add(RECIPE_VERSION_KEY.format(recipe.pk))
+        version_keys.add(AUTHOR_VERSION_KEY.format(recipe.creator_id))
+    versions = get_versions(list(version_keys))
+    return {
+        recipe.pk: RECIPE_FRAGMENT_KEY.format(
+            base_url=base_url,
+            recipe_id=recipe.pk,
+            versions='.'.join(str(versions[key]) for key in (
+                RECIPE_VERSION_KEY.format(recipe.pk),
+                AUTHOR_VERSION_KEY.format(recipe.creator_id),
+                CATALOG_VERSION_KEY,
+            ))
+        )
+        for recipe in recipes
+    }
+
+
+def get_recipe_fragments(recipes, base_url, render):
+    """Общие для всех пользователей представления рецептов.
+
+    Отсутствующие в кеше фрагменты строятся одним вызовом render для
+    списка таких рецептов и сохраняются одним обращением к кешу.
+    """
+    keys = get_fragment_keys(recipes, base_url)
+    cached = cache.get_many(keys.values())
+    missing = [recipe for recipe in recipes if keys[recipe.pk] not in cached]
+    rendered = {
+        keys[recipe.pk]: fragment
+        for recipe, fragment in zip(missing, render(missing) if missing else [])
+    }
+    count_cache_lookup(
+        'recipe_fragment', hits=len(recipes) - len(missing), misses=len(missing)
+    )
+    if rendered:
+        cache.set_many(rendered, settings.RECIPE_CACHE_TIMEOUT)
+    return {
+        recipe.pk: cached.get(keys[recipe.pk]) or rendered[keys[recipe.pk]]
+        for recipe in recipes
+    }
+
+
+def get_anonymous_response_key(request):
+    versions = get_versions([RECIPES_VERSION_KEY, CATALOG_VERSION_KEY])
+    return ANONYMOUS_RESPONSE_KEY.format(
+        url=hashlib.md5(request.build_absolute_uri().encode()).hexdigest(),
+        versions='.'.join(str(versions[key]) for key in (
+            RECIPES_VERSION_KEY, CATALOG_VERSION_KEY
+        ))
+    )
+
+
+def get_anonymous_response(request):
+    """Ключ кеша и сохранённые данные ответа или None"""
+    key = get_anonymous_response_key(request)
+    data = cache.get(key)
+    count_cache_lookup(
+        'anonymous_response', hits=int(data is not None), misses=int(data is None)
+    )
+    return key, data
+
+
+def cached_anonymous_response(view_method):
+    """Кеширует ответы анонимным пользователям до изменения рецептов"""
+
+    if iscoroutinefunction(view_method):
+
+        @wraps(view_method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            if request.user.is_authenticated:
+                return await view_method(self, request, *args, **kwargs)
+            key, data = await sync_to_async(get_anonymous_response)(request)
+            if data is not None:
+                return Response(data)
+            response = await view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                await cache.aset(key, response.data, settings.RECIPE_CACHE_TIMEOUT)
+            return response
+
+        return async_wrapper
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        key, data = get_anonymous_response(request)
+        if data is not None:
+            return Response(data)
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RECIPE_CACHE_TIMEOUT)
+        return response
+
+    return wrapper
@@ -0,0 +1,166 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from recipes.catalog import CATALOG_VERSION_KEY
+from recipes.models import CookingRecipe
+from recipes.versions import (
+    AUTHOR_VERSION_KEY, RECIPE_VERSION_KEY, RECIPES_VERSION_KEY,
+    USERS_VERSION_KEY, VIEWER_VERSION_KEY, get_versions
+)
+
+from .metrics import count_cache_lookup
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+def recipes_version_keys(view, request, *args, **kwargs):
+    return [RECIPES_VERSION_KEY, CATALOG_VERSION_KEY]
+
+
+def recipe_version_keys(view, request, pk=None, *args, **kwargs):
+    """Версии рецепта и его автора и время изменения рецепта в БД.
+
+    id автора и время изменения читаются одним запросом по первичному ключу.
+    """
+    row = (
+        CookingRecipe.objects.filter(pk=pk)
+        .values_list('creator_id', 'updated_at')
+        .first()
+    ) if str(pk).isdigit() else None
+    if row is None:
+        return None
+    creator_id, updated_at = row
+    return [
+        RECIPE_VERSION_KEY.format(pk),
+        AUTHOR_VERSION_KEY.format(creator_id),
+        CATALOG_VERSION_KEY,
+    ], updated_at
+
+
+def catalog_version_keys(view, request, *args, **kwargs):
+    return [CATALOG_VERSION_KEY]
+
+
+def users_version_keys(view, request, *args, **kwargs):
+    return [USERS_VERSION_KEY]
+
+
+def user_version_keys(view, request, id=None, *args, **kwargs):
+    if not str(id).isdigit():
+        return None
+    return [AUTHOR_VERSION_KEY.format(id)]
+
+
+def current_user_version_keys(view, request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+    return [AUTHOR_VERSION_KEY.format(request.user.pk)]
+
+
+def subscriptions_version_keys(view, request, *args, **kwargs):
+    return [USERS_VERSION_KEY, RECIPES_VERSION_KEY]
+
+
+def get_validators(request, keys, salt='', updated_at=None):
+    """ETag и время изменения ответа по версиям данных в кеше.
+
+    Версии — отметки времени в наносекундах, поэтому самая свежая из них
+    служит временем последнего изменения. Для авторизованных
+    пользователей учитывается версия их избранного, корзины и подписок.
+    updated_at — время изменения объекта в БД: оно меняет валидаторы,
+    даже если версия в кеше потерялась или не была обновлена.
+    """
+    viewer_id = request.user.pk if request.user.is_authenticated else None
+    if viewer_id is not None:
+        keys = [*keys, VIEWER_VERSION_KEY.format(viewer_id)]
+    versions = get_versions(keys)
+    stamp = '|'.join(f'{key}={versions[key]}' for key in keys)
+    last_modified = max(versions.values()) // 10 ** 9
+    if updated_at is not None:
+        stamp += f'|updated_at={updated_at.isoformat()}'
+        last_modified = max(last_modified, int(updated_at.timestamp()))
+    etag = hashlib.md5(f'{viewer_id}|{salt}|{stamp}'.encode()).hexdigest()
+    return quote_etag(etag), last_modified
+
+
+def conditional_by_versions(get_version_keys, salt=None):
+    """Отвечает 304 на условные GET-запросы без выполнения действия.
+
+    get_version_keys возвращает ключи версий данных, от которых зависит
+    ответ, пару (ключи, время изменения объекта в БД) или None, если
+    проверка невозможна. salt — функция,
+    добавляющая к ETag то, что меняется без смены версий.
+    Подходит и для асинхронных действий.
+    """
+
+    def check(view, request, args, kwargs):
+        """Валидаторы ответа и готовый ответ 304 или None"""
+        keys = get_version_keys(view, request, *args, **kwargs)
+        if keys is None:
+            return None
+        updated_at = None
+        if isinstance(keys, tuple):
+            keys, updated_at = keys
+        etag, last_modified = get_validators(
+            request, keys, salt() if salt else '', updated_at
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        count_cache_lookup(
+            'conditional', hits=int(response is not None),
+            misses=int(response is None)
+        )
+        return etag, last_modified, response
+
+    def add_validators(response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response.headers['ETag'] = etag
+            response.headers['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def decorator(view_method):
+
+        if iscoroutinefunction(view_method):
+
+            @wraps(view_method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                if request.method not in CONDITIONAL_METHODS:
+                    return await view_method(self, request, *args, **kwargs)
+                validators = await sync_to_async(check)(self, request, args, kwargs)
+                if validators is None:
+                    return await view_method(self, request, *args, **kwargs)
+                etag, last_modified, response = validators
+                if response is None:
+                    response = await view_method(self, request, *args, **kwargs)
+                return add_validators(response, etag, last_modified)
+
+            return async_wrapper
+
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in CONDITIONAL_METHODS:
+                return view_method(self, request, *args, **kwargs)
+            validators = check(self, request, args, kwargs)
+            if validators is None:
+                return view_method(self, request, *args, **kwargs)
+            etag, last_modified, response = validators
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+            return add_validators(response, etag, last_modified)
+
+        return wrapper
+
+    return decorator
+
+
+def catalog_rating_period():
+    """Рейтинг продуктов в справочнике обновляется раз в INGREDIENT_CATALOG_TTL"""
+    return str(int(time.time() // settings.INGREDIENT_CATALOG_TTL))
@@ -0,0 +1,109 @@
+import csv
+from datetime import datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import CookingRecipe, ShoppingListItem
+from recipes.shopping_list import get_shopping_list_version
+
+from .metrics import count_cache_lookup
+
+SHOPPING_LIST_CACHE_KEY = 'shopping_list:{user_id}:{version}:{format}:{date}'
+# Число частей документа, готовящихся за один переход в поток
+ASYNC_EXPORT_BATCH = 500
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def get_shopping_list_items(user):
+    return (
+        ShoppingListItem.objects
+        .filter(user=user)
+        .values_list('component__title', 'quantity', 'component__unit_type')
+        .order_by('component__title')
+        .iterator()
+    )
+
+
+def get_cart_recipes(user):
+    return (
+        CookingRecipe.objects
+        .filter(shopping_items__user=user)
+        .values_list(
+            'title', 'creator__first_name', 'creator__last_name', 'creator__username'
+        )
+        .iterator()
+    )
+
+
+def render_txt(user, date):
+    yield f'Список покупок на {date}\n\nПРОДУКТЫ:\n'
+    for index, (title, quantity, unit_type) in enumerate(
+        get_shopping_list_items(user), 1
+    ):
+        yield f'{index}. {title.capitalize()} - {quantity} {unit_type}\n'
+    yield '\nРЕЦЕПТЫ:\n'
+    for title, first_name, last_name, username in get_cart_recipes(user):
+        yield f'• {title} (автор: {first_name} {last_name} @{username})\n'
+
+
+def render_csv(user, date):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Продукт', 'Количество', 'Единица измерения'))
+    for title, quantity, unit_type in get_shopping_list_items(user):
+        yield writer.writerow((title.capitalize(), quantity, unit_type))
+
+
+RENDERERS = {
+    'txt': render_txt,
+    'csv': render_csv,
+}
+
+
+def export_shopping_list(user, export_format):
+    """Список покупок в формате export_format по частям в байтах.
+
+    Готовый документ кешируется по версии списка покупок пользователя,
+    поэтому повторная выгрузка неизменной корзины не обращается к БД.
+    """
+    date = datetime.now().strftime('%d.%m.%Y')
+    cache_key = SHOPPING_LIST_CACHE_KEY.format(
+        user_id=user.pk,
+        version=get_shopping_list_version(user.pk),
+        format=export_format,
+        date=date,
+    )
+    content = cache.get(cache_key)
+    if content is not None:
+        count_cache_lookup('shopping_list', hits=1)
+        yield content
+        return
+    count_cache_lookup('shopping_list', misses=1)
+    chunks = []
+    for chunk in RENDERERS[export_format](user, date):
+        chunk = chunk.encode('utf-8')
+        chunks.append(chunk)
+        yield chunk
+    cache.set(
+        cache_key, b''.join(chunks), settings.SHOPPING_LIST_CACHE_TIMEOUT
+    )
+
+
+async def aexport_shopping_list(user, export_format):
+    """Асинхронный вариант export_shopping_list для работы через ASGI.
+
+    Части документа готовятся в потоке запроса пачками, поэтому ответ
+    передаётся по частям, а не собирается целиком в памяти.
+    """
+    chunks = export_shopping_list(user, export_format)
+    next_batch = sync_to_async(lambda: b''.join(islice(chunks, ASYNC_EXPORT_BATCH)))
+    while batch := await next_batch():
+        yield batch
@@ -0,0 +1,76 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+from recipes.images import DERIVATIVE_FORMATS, get_ready_derivatives
+
+
+class UploadImageField(Base64ImageField):
+    """Изображение строкой base64 или файлом из multipart/form-data.
+
+    Файл из multipart проверяется только по заголовку: формат
+    и размеры читаются без декодирования всего изображения.
+    """
+
+    default_error_messages = {
+        'too_large': 'Изображение больше {max_pixels} пикселей.',
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, UploadedFile):
+            return super().to_internal_value(data)
+        try:
+            with Image.open(data) as image:
+                image_format = (image.format or '').lower()
+                width, height = image.size
+        except (OSError, ValueError, Image.DecompressionBombError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        if image_format not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            self.fail('too_large', max_pixels=settings.IMAGE_MAX_PIXELS)
+        data.seek(0)
+        data.name = f'{uuid.uuid4()}.{image_format}'
+        return data
+
+
+class ImageSizesField(serializers.Field):
+    """Адреса уменьшенных копий изображения: {ширина: {формат: адрес}}.
+
+    Пока копии не построены, для всех размеров отдаётся оригинал.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        image = getattr(instance, self.image_field)
+        if not image:
+            return None
+        request = self.context.get('request')
+
+        def build_url(name):
+            url = image.storage.url(name)
+            return request.build_absolute_uri(url) if request else url
+
+        derivatives = get_ready_derivatives(instance, self.image_field)
+        if derivatives:
+            return {
+                width: {
+                    image_format: build_url(name)
+                    for image_format, name in formats.items()
+                }
+                for width, formats in derivatives.items()
+            }
+        original = build_url(image.name)
+        return {
+            str(width): dict.fromkeys(DERIVATIVE_FORMATS, original)
+            for width in sorted(settings.IMAGE_DERIVATIVE_WIDTHS)
+        }
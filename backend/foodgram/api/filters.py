@@ -1,5 +1,7 @@
 from recipes.models import CookingRecipe
+from recipes.search import search_recipes
 from django_filters import rest_framework as filters
+from rest_framework.filters import BaseFilterBackend
 
 
 class CookingRecipeFilter(filters.FilterSet):
@@ -20,3 +22,14 @@ class CookingRecipeFilter(filters.FilterSet):
         if value and self.request.user.is_authenticated:
             return queryset.filter(shopping_items__user=self.request.user)
         return queryset
+
+
+class CookingRecipeSearchFilter(BaseFilterBackend):
+    
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        search_term = request.query_params.get(self.search_param, '').strip()
+        if not search_term:
+            return queryset
+        return search_recipes(queryset, search_term)
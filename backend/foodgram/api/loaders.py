@@ -0,0 +1,62 @@
+from recipes.models import UserSubscription
+
+
+class SubscriptionLoader:
+    """Пакетная загрузка подписок текущего пользователя в рамках запроса"""
+
+    request_attr = '_subscription_loader'
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self._pending = set()
+        self._resolved = {}
+
+    @classmethod
+    def from_context(cls, context):
+        """Возвращает загрузчик, общий для всех сериализаторов запроса"""
+        request = context.get('request')
+        if request is None:
+            return cls(None)
+        loader = getattr(request, cls.request_attr, None)
+        if loader is None:
+            loader = cls(request.user)
+            setattr(request, cls.request_attr, loader)
+        return loader
+
+    @property
+    def is_active(self):
+        return bool(self.viewer and self.viewer.is_authenticated)
+
+    def prime(self, user_ids):
+        """Запоминает id авторов, чтобы загрузить их одним запросом"""
+        if self.is_active:
+            self._pending.update(
+                user_id for user_id in user_ids
+                if user_id not in self._resolved
+            )
+
+    def mark_subscribed(self, user_ids):
+        """Запоминает авторов, подписка на которых уже известна"""
+        if self.is_active:
+            self._resolved.update((user_id, True) for user_id in user_ids)
+
+    def load(self, user_id):
+        """Подписан ли текущий пользователь на пользователя user_id"""
+        if not self.is_active or user_id == self.viewer.pk:
+            return False
+        if user_id not in self._resolved:
+            self._pending.add(user_id)
+            self._flush()
+        return self._resolved[user_id]
+
+    def _flush(self):
+        pending = self._pending - self._resolved.keys()
+        self._pending = set()
+        subscribed = set(
+            UserSubscription.objects
+            .filter(subscriber=self.viewer, target_user_id__in=pending)
+            .values_list('target_user_id', flat=True)
+        )
+        self._resolved.update(
+            (user_id, user_id in subscribed) for user_id in pending
+        )
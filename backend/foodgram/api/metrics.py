@@ -0,0 +1,184 @@
+import os
+import time
+from collections import Counter as ResultCounter, defaultdict
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async
+)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+    multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .middleware import install_execute_wrapper
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds',
+    'Время обработки запроса по представлению и действию',
+    ['view', 'action', 'method', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_DB_QUERIES = Histogram(
+    'foodgram_request_db_queries',
+    'Число SQL-запросов при обработке одного запроса',
+    ['view', 'action'],
+    buckets=QUERY_COUNT_BUCKETS
+)
+DB_QUERY_DURATION = Counter(
+    'foodgram_db_query_seconds',
+    'Суммарное время SQL-запросов',
+    ['view', 'action']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'foodgram_requests_in_flight',
+    'Запросы, обрабатываемые в данный момент',
+    multiprocess_mode='livesum'
+)
+CACHE_LOOKUPS_NAME = 'foodgram_cache_lookups'
+CACHE_LOOKUPS = Counter(
+    CACHE_LOOKUPS_NAME,
+    'Обращения к кешам ответов и фрагментов',
+    ['cache', 'result']
+)
+
+
+def count_cache_lookup(cache_name, hits=0, misses=0):
+    """Учитывает попадания и промахи кеша, если метрики включены"""
+    if not settings.METRICS_ENABLED:
+        return
+    if hits:
+        CACHE_LOOKUPS.labels(cache_name, 'hit').inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache_name, 'miss').inc(misses)
+
+
+def get_view_labels(request):
+    """Имя представления и действие: CookingRecipeViewSet, list"""
+    method = request.method.lower()
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved', method
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.func.__name__, method
+    actions = getattr(match.func, 'actions', None) or {}
+    return view_class.__name__, actions.get(method, method)
+
+
+class CacheHitRatioCollector:
+    """Доля попаданий по каждому кешу, вычисляемая из счётчиков обращений"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def collect(self):
+        lookups = defaultdict(ResultCounter)
+        for metric in self.source.collect():
+            if metric.name != CACHE_LOOKUPS_NAME:
+                continue
+            for sample in metric.samples:
+                if sample.name.endswith('_total'):
+                    lookups[sample.labels['cache']][sample.labels['result']] += (
+                        sample.value
+                    )
+        ratio = GaugeMetricFamily(
+            'foodgram_cache_hit_ratio', 'Доля попаданий в кеш', labels=['cache']
+        )
+        for cache_name, results in sorted(lookups.items()):
+            total = results['hit'] + results['miss']
+            if total:
+                ratio.add_metric([cache_name], results['hit'] / total)
+        yield ratio
+
+
+def render_metrics():
+    """Метрики в текстовом формате Prometheus.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR, значения собираются из файлов
+    всех процессов gunicorn, иначе — только текущего процесса.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        source = CollectorRegistry()
+        multiprocess.MultiProcessCollector(source)
+    else:
+        source = REGISTRY
+    ratios = CollectorRegistry()
+    ratios.register(CacheHitRatioCollector(source))
+    return generate_latest(source) + generate_latest(ratios)
+
+
+class MetricsMiddleware:
+    """Собирает задержки, число SQL-запросов и запросы в обработке.
+
+    При METRICS_ENABLED = False не подключается к обработке запросов.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = []
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            with install_execute_wrapper(self.get_query_timer(queries)):
+                response = self.get_response(request)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        self.observe(request, response, started, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = []
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            instrumentation = await sync_to_async(install_execute_wrapper)(
+                self.get_query_timer(queries)
+            )
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(instrumentation.close)()
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        self.observe(request, response, started, queries)
+        return response
+
+    def get_query_timer(self, queries):
+        """Обёртка SQL-запросов, добавляющая их длительность в queries"""
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append(time.perf_counter() - started)
+
+        return count_query
+
+    def observe(self, request, response, started, queries):
+        view, action = get_view_labels(request)
+        REQUEST_DURATION.labels(
+            view, action, request.method, f'{response.status_code // 100}xx'
+        ).observe(time.perf_counter() - started)
+        REQUEST_DB_QUERIES.labels(view, action).observe(len(queries))
+        if queries:
+            DB_QUERY_DURATION.labels(view, action).inc(sum(queries))
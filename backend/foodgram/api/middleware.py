@@ -0,0 +1,333 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async
+)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer, Serializer
+
+from recipes.routers import (
+    ReplicaReads, current_reads, get_client_key, has_recent_write,
+    mark_recent_write
+)
+
+logger = logging.getLogger('foodgram.performance')
+
+current_metrics = ContextVar('current_metrics', default=None)
+SQL_LOG_LENGTH = 2000
+
+
+class RequestMetrics:
+    """Время этапов обработки одного запроса и выполненные SQL-запросы"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = self.view_finished = self.rendered = None
+        self.finished = None
+        self.serialize_time = 0.0
+        self.serializing = False
+        self.queries = []
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((
+                context['connection'].alias, sql, None if many else params,
+                time.perf_counter() - started
+            ))
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        if self.view_started is not None and self.view_finished is None:
+            self.view_finished = self.finished
+
+    def get_durations(self):
+        """Длительности этапов в миллисекундах"""
+        durations = {
+            'total': self.finished - self.started,
+            'db': sum(duration for *_query, duration in self.queries),
+            'serialize': self.serialize_time,
+        }
+        if self.view_started is not None:
+            durations['view'] = self.view_finished - self.view_started
+        if self.rendered is not None:
+            durations['render'] = self.rendered - self.view_finished
+        return {name: round(value * 1000, 3) for name, value in durations.items()}
+
+    def get_server_timing(self, durations):
+        return ', '.join(
+            f'{name};dur={duration}'
+            + (f';desc="{len(self.queries)} queries"' if name == 'db' else '')
+            for name, duration in durations.items()
+        )
+
+
+def timed_serializer_data(data_property):
+    """Свойство data сериализатора, учитывающее время во внешнем вызове"""
+
+    @wraps(data_property.fget)
+    def data(self):
+        metrics = current_metrics.get()
+        if metrics is None or metrics.serializing:
+            return data_property.fget(self)
+        metrics.serializing = True
+        started = time.perf_counter()
+        try:
+            return data_property.fget(self)
+        finally:
+            metrics.serialize_time += time.perf_counter() - started
+            metrics.serializing = False
+
+    return property(data)
+
+
+def install_serializer_timing():
+    for serializer_class in (Serializer, ListSerializer):
+        if not getattr(serializer_class.data.fget, '__wrapped__', None):
+            serializer_class.data = timed_serializer_data(serializer_class.data)
+
+
+def install_execute_wrapper(wrapper):
+    """Подключает обёртку SQL-запросов к соединениям текущего потока.
+
+    Соединения с БД у каждого потока свои, поэтому в асинхронном режиме
+    обёртка подключается через sync_to_async в потоке, где выполняются
+    запросы к БД этого HTTP-запроса.
+    """
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(wrapper))
+    return stack
+
+
+def explain(alias, sql, params):
+    """План выполнения SELECT-запроса или текст ошибки"""
+    connection = connections[alias]
+    try:
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(
+                ' '.join(str(value) for value in row) for row in cursor.fetchall()
+            )
+    except DatabaseError as error:
+        return str(error)
+
+
+class PerformanceMiddleware:
+    """Замеряет время обработки запроса, SQL-запросы и сериализацию.
+
+    Добавляет заголовок Server-Timing, пишет медленные запросы в журнал
+    foodgram.performance и сохраняет профили cProfile для доли запросов.
+    При работе через ASGI профилируется поток, в котором выполняются
+    запросы к БД и сериализация. При PERF_INSTRUMENTATION = False
+    не подключается к обработке запросов.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERF_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_serializer_timing()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Синхронные хуки Django при работе через ASGI вызывает в
+            # отдельном потоке, асинхронные — прямо в цикле событий
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        profiler = self.get_profiler()
+        token = current_metrics.set(metrics)
+        try:
+            with self.instrument(metrics, profiler):
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        durations = self.finish(response, metrics)
+        self.report(request, response, metrics, durations, profiler)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        profiler = self.get_profiler()
+        token = current_metrics.set(metrics)
+        try:
+            instrumentation = await sync_to_async(self.instrument)(metrics, profiler)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(instrumentation.close)()
+        finally:
+            current_metrics.reset(token)
+        durations = self.finish(response, metrics)
+        if profiler is not None or durations['total'] >= settings.PERF_SLOW_REQUEST_MS:
+            await sync_to_async(self.report)(
+                request, response, metrics, durations, profiler
+            )
+        return response
+
+    def get_profiler(self):
+        if random.random() < settings.PERF_PROFILE_SAMPLE_RATE:
+            return cProfile.Profile()
+        return None
+
+    def instrument(self, metrics, profiler):
+        """Учёт SQL-запросов и профилирование в текущем потоке"""
+        stack = install_execute_wrapper(metrics.record_query)
+        if profiler is not None:
+            profiler.enable()
+            stack.callback(profiler.disable)
+        return stack
+
+    def finish(self, response, metrics):
+        metrics.finish()
+        durations = metrics.get_durations()
+        response['Server-Timing'] = metrics.get_server_timing(durations)
+        return durations
+
+    def report(self, request, response, metrics, durations, profiler):
+        if durations['total'] >= settings.PERF_SLOW_REQUEST_MS:
+            self.log_slow_request(request, response, metrics, durations)
+        if profiler is not None:
+            self.dump_profile(request, profiler, durations['total'])
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.mark_view_started()
+
+    def process_template_response(self, request, response):
+        return self.mark_view_finished(response)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.mark_view_started()
+
+    async def aprocess_template_response(self, request, response):
+        return self.mark_view_finished(response)
+
+    def mark_view_started(self):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+
+    def mark_view_finished(self, response):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view_finished = time.perf_counter()
+
+            def rendered(response):
+                metrics.rendered = time.perf_counter()
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, response, metrics, durations):
+        repeated = Counter(sql for _alias, sql, *_rest in metrics.queries)
+        top_queries = sorted(
+            metrics.queries, key=lambda query: query[-1], reverse=True
+        )[:settings.PERF_SLOW_QUERIES_LOGGED]
+        record = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'user_id': getattr(getattr(request, 'user', None), 'pk', None),
+            'duration_ms': durations,
+            'queries': len(metrics.queries),
+            'repeated_queries': sum(
+                count - 1 for count in repeated.values() if count > 1
+            ),
+            'top_queries': [],
+        }
+        for alias, sql, params, duration in top_queries:
+            query = {
+                'alias': alias,
+                'sql': sql[:SQL_LOG_LENGTH],
+                'duration_ms': round(duration * 1000, 3),
+                'executions': repeated[sql],
+            }
+            if settings.PERF_EXPLAIN_SLOW_QUERIES and params is not None and (
+                sql.lstrip()[:6].upper() == 'SELECT'
+            ):
+                query['explain'] = explain(alias, sql, params)
+            record['top_queries'].append(query)
+        logger.warning(json.dumps(record, ensure_ascii=False, default=str))
+
+    def dump_profile(self, request, profiler, total):
+        os.makedirs(settings.PERF_PROFILE_DIR, exist_ok=True)
+        name = re.sub(r'[^\w-]+', '_', request.path).strip('_')[:80] or 'root'
+        profiler.dump_stats(os.path.join(
+            settings.PERF_PROFILE_DIR,
+            f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-{name}-'
+            f'{round(total)}ms-{os.getpid()}.prof'
+        ))
+
+
+class ReplicaRoutingMiddleware:
+    """Включает чтение из реплик БД для безопасных запросов.
+
+    После небезопасного запроса клиент (по заголовку Authorization)
+    DB_REPLICA_LAG_SECONDS секунд читает из основной БД и видит свои
+    изменения. Без реплик (DB_REPLICAS) не подключается к обработке запросов.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DB_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        client_key = get_client_key(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if client_key is not None:
+                mark_recent_write(client_key)
+            return response
+        if has_recent_write(client_key):
+            return self.get_response(request)
+        token = current_reads.set(ReplicaReads())
+        try:
+            return self.get_response(request)
+        finally:
+            current_reads.reset(token)
+
+    async def __acall__(self, request):
+        client_key = get_client_key(request)
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            if client_key is not None:
+                await sync_to_async(mark_recent_write)(client_key)
+            return response
+        if await sync_to_async(has_recent_write)(client_key):
+            return await self.get_response(request)
+        token = current_reads.set(ReplicaReads())
+        try:
+            return await self.get_response(request)
+        finally:
+            current_reads.reset(token)
@@ -0,0 +1,194 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import (
+    Cursor, CursorPagination, LimitOffsetPagination
+)
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Курсорная пагинация по набору ключей.
+
+    CursorPagination из DRF кладёт в курсор только первое поле сортировки,
+    а строки с одинаковым значением пропускает смещением. Здесь курсор
+    хранит значения всех полей сортировки, и страница выбирается условием
+    (date_created, id) < (...) без OFFSET. Последнее поле сортировки
+    должно быть уникальным.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None
+        if self.cursor is not None and self.cursor.position is not None:
+            position = self.decode_position(queryset.model, self.cursor.position)
+        ordering = self.ordering
+        if reverse:
+            ordering = [
+                name[1:] if name.startswith('-') else '-' + name
+                for name in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, position))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = bool(self.page), has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    @staticmethod
+    def get_keyset_filter(ordering, position):
+        """Условие «строка после позиции» для сортировки ordering:
+        (a, b) < (x, y) раскрывается в a <= x AND (a < x OR a = x AND b < y),
+        первое сравнение позволяет использовать индекс по диапазону"""
+        keys = [
+            (name.lstrip('-'), 'lt' if name.startswith('-') else 'gt', value)
+            for name, value in zip(ordering, position)
+        ]
+        condition = None
+        for name, lookup, value in reversed(keys):
+            strict = Q(**{f'{name}__{lookup}': value})
+            condition = (
+                strict if condition is None
+                else strict | Q(**{name: value}) & condition
+            )
+        name, lookup, value = keys[0]
+        return Q(**{f'{name}__{lookup}e': value}) & condition
+
+    def decode_position(self, model, encoded):
+        try:
+            values = json.loads(encoded)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self.ordering, values)
+            ]
+        except (FieldDoesNotExist, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_position(self, instance):
+        return json.dumps([
+            instance._meta.get_field(name.lstrip('-')).value_to_string(instance)
+            for name in self.ordering
+        ])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False,
+            position=self.encode_position(self.page[-1])
+        ))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=True,
+            position=self.encode_position(self.page[0])
+        ))
+
+
+class RecipeCursorPagination(KeysetCursorPagination):
+
+    ordering = ('-date_created', '-id')
+    page_size_query_param = 'limit'
+
+
+class UserCursorPagination(KeysetCursorPagination):
+
+    ordering = ('username',)
+    page_size_query_param = 'limit'
+
+
+class LimitOffsetOrCursorPagination(LimitOffsetPagination):
+    """Пагинация limit/offset, курсорная при наличии параметра cursor.
+
+    Курсорный режим включается запросом с ?cursor= и не зависит
+    от глубины страницы, ссылки next/previous содержат курсор. Курсор
+    задаёт свою сортировку, поэтому вместе с параметрами из
+    cursor_incompatible_params (например, поиском с ранжированием)
+    запрос отклоняется.
+    """
+
+    cursor_pagination_class = None
+    cursor_incompatible_params = ()
+    cursor_incompatible_message = (
+        'Параметр cursor нельзя сочетать с параметром {param}.'
+    )
+
+    def is_cursor_request(self, request):
+        if self.cursor_pagination_class.cursor_query_param not in request.query_params:
+            return False
+        for param in self.cursor_incompatible_params:
+            if request.query_params.get(param, '').strip():
+                raise ParseError(
+                    self.cursor_incompatible_message.format(param=param)
+                )
+        return True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.is_cursor_request(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Асинхронный вариант paginate_queryset: limit/offset через
+        асинхронный ORM, курсорный режим — в потоке"""
+        if self.is_cursor_request(request):
+            return await sync_to_async(self.paginate_queryset)(queryset, request, view)
+        self.cursor_paginator = None
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [item async for item in queryset[self.offset:self.offset + self.limit]]
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RecipePagination(LimitOffsetOrCursorPagination):
+
+    cursor_pagination_class = RecipeCursorPagination
+    cursor_incompatible_params = ('search',)
+
+
+class UserPagination(LimitOffsetOrCursorPagination):
+
+    cursor_pagination_class = UserCursorPagination
+
+
+class FeedPagination(LimitOffsetPagination):
+    """Пагинация ленты подписок: срез ленты читается по индексу,
+    поэтому курсорный режим не нужен"""
+
+
+class PantryPagination(LimitOffsetPagination):
+    """Пагинация подбора по запасам: рецепты ранжируются индексом
+    в памяти, поэтому курсорный режим не нужен"""
@@ -1,33 +1,65 @@
+import json
+
+from django.db import models, transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
-from drf_extra_fields.fields import Base64ImageField
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 
 from recipes.models import CookingRecipe, ProductComponent, RecipeComponent, FavoriteRecipe, ShoppingCart
-from recipes.models import User, UserSubscription
+from recipes.models import User
+from recipes.counters import increment
+from recipes.search import update_search_vectors
+from recipes.shopping_list import (
+    add_recipe_to_shopping_lists, remove_recipe_from_shopping_lists
+)
+from .caching import get_recipe_fragments
+from .fields import ImageSizesField, UploadImageField
+from .loaders import SubscriptionLoader
+
+
+class PrimingListSerializer(serializers.ListSerializer):
+    """Заранее передаёт загрузчику подписок всех авторов страницы"""
+
+    def get_author_ids(self, items):
+        return [item.pk for item in items]
+
+    def prime(self, data):
+        items = data.all() if isinstance(data, models.manager.BaseManager) else data
+        items = list(items)
+        SubscriptionLoader.from_context(self.context).prime(
+            self.get_author_ids(items)
+        )
+        return items
+
+    def to_representation(self, data):
+        return super().to_representation(self.prime(data))
+
+
+class CookingRecipeListSerializer(PrimingListSerializer):
+
+    def get_author_ids(self, recipes):
+        return [recipe.creator_id for recipe in recipes]
+
+    def to_representation(self, data):
+        return self.child.to_cached_representations(self.prime(data))
 
 
 class UserSerializer(DjoserUserSerializer):
 
     is_subscribed = serializers.SerializerMethodField(read_only=True)
-    avatar = Base64ImageField(required=False, allow_null=True)
+    avatar = UploadImageField(required=False, allow_null=True)
+    avatar_sizes = ImageSizesField('avatar')
 
     class Meta(DjoserUserSerializer.Meta):
         model = User
         fields = DjoserUserSerializer.Meta.fields + (
-            'is_subscribed', 'avatar'
+            'is_subscribed', 'avatar', 'avatar_sizes'
         )
         read_only_fields = fields
+        list_serializer_class = PrimingListSerializer
 
     def get_is_subscribed(self, user):
-        request = self.context.get('request')
-        return (
-            request and request.user.is_authenticated and 
-            user != request.user and
-            UserSubscription.objects.filter(
-                subscriber=request.user, 
-                target_user=user
-            ).exists()
-        )
+        return SubscriptionLoader.from_context(self.context).load(user.pk)
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -60,7 +92,8 @@ class ComponentOutputSerializer(serializers.ModelSerializer):
 class CookingRecipeSerializer(serializers.ModelSerializer):
     
     creator = UserSerializer(read_only=True)
-    picture = Base64ImageField(required=True)
+    picture = UploadImageField(required=True)
+    picture_sizes = ImageSizesField('picture')
     components = ComponentInputSerializer(many=True, write_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -69,31 +102,87 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = CookingRecipe
         fields = (
-            'id', 'creator', 'title', 'description', 'picture', 'cook_duration',
-            'components', 'is_favorited', 'is_in_shopping_cart'
+            'id', 'creator', 'title', 'description', 'picture', 'picture_sizes',
+            'cook_duration', 'components', 'is_favorited', 'is_in_shopping_cart'
         )
         read_only_fields = ('creator', 'is_favorited', 'is_in_shopping_cart')
+        list_serializer_class = CookingRecipeListSerializer
+
+    def to_internal_value(self, data):
+        components = data.get('components')
+        if hasattr(data, 'getlist') and isinstance(components, str):
+            # В multipart/form-data список продуктов передаётся строкой JSON
+            data = {key: data.get(key) for key in data}
+            try:
+                data['components'] = json.loads(components)
+            except ValueError:
+                raise serializers.ValidationError(
+                    {'components': 'Некорректный JSON списка продуктов!'}
+                )
+        return super().to_internal_value(data)
 
     def to_representation(self, instance):
+        return self.to_cached_representations([instance])[0]
+
+    def to_cached_representations(self, recipes):
+        """Представления рецептов из кеша с флагами текущего пользователя"""
+        request = self.context.get('request')
+        fragments = get_recipe_fragments(
+            recipes,
+            request.build_absolute_uri('/') if request else '',
+            self.render_fragments
+        )
+        return [
+            self.apply_viewer_flags(fragments[recipe.pk], recipe)
+            for recipe in recipes
+        ]
+
+    def apply_viewer_flags(self, fragment, instance):
+        return {
+            **fragment,
+            'creator': {
+                **fragment['creator'],
+                'is_subscribed': SubscriptionLoader.from_context(
+                    self.context
+                ).load(instance.creator_id),
+            },
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+        }
+
+    def render_fragments(self, recipes):
+        """Фрагменты рецептов, которых нет в кеше.
+
+        Продукты читаются одним запросом и только для этих рецептов:
+        при попадании в кеш запроса продуктов нет.
+        """
+        prefetch_related_objects(recipes, Prefetch(
+            'recipe_components',
+            queryset=RecipeComponent.objects.select_related('component')
+        ))
+        return [self.render_fragment(recipe) for recipe in recipes]
+
+    def render_fragment(self, instance):
         representation = super().to_representation(instance)
         representation['components'] = ComponentOutputSerializer(
-            instance.recipe_components.select_related('component'), many=True
+            instance.recipe_components.all(), many=True
         ).data
         return representation
 
-    def get_is_favorited(self, obj):
+    def _get_user_flag(self, obj, flag_name, model_class):
+        if hasattr(obj, flag_name):
+            return getattr(obj, flag_name)
         user = self.context.get('request').user
         return (
             user and user.is_authenticated and 
-            FavoriteRecipe.objects.filter(user=user, recipe=obj).exists()
+            model_class.objects.filter(user=user, recipe=obj).exists()
         )
 
+    def get_is_favorited(self, obj):
+        return self._get_user_flag(obj, 'is_favorited', FavoriteRecipe)
+
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        return (
-            user and user.is_authenticated and 
-            ShoppingCart.objects.filter(user=user, recipe=obj).exists()
-        )
+        return self._get_user_flag(obj, 'is_in_shopping_cart', ShoppingCart)
 
     def validate_components(self, components_list):
         if not isinstance(components_list, list) or not components_list:
@@ -109,17 +198,24 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
         
         return components_list
 
+    @transaction.atomic
     def create(self, validated_data):
         components = validated_data.pop('components')
         recipe = super().create(validated_data)
         self._create_recipe_components(recipe, components)
+        update_search_vectors([recipe.pk])
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         components = validated_data.pop('components')
+        remove_recipe_from_shopping_lists(instance.pk)
         instance.recipe_components.all().delete()
         self._create_recipe_components(instance, components)
-        return super().update(instance, validated_data)
+        add_recipe_to_shopping_lists(instance.pk)
+        instance = super().update(instance, validated_data)
+        update_search_vectors([instance.pk])
+        return instance
         
 
     def _create_recipe_components(self, recipe, components):
@@ -131,34 +227,57 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
             )
             for component_data in components
         ])
+        increment(
+            ProductComponent, 'recipes_count',
+            *(component_data['id'].pk for component_data in components)
+        )
 
 
 class CookingRecipeShortSerializer(serializers.ModelSerializer):
     
+    picture_sizes = ImageSizesField('picture')
 
     class Meta:
         model = CookingRecipe
-        fields = ('id', 'title', 'picture', 'cook_duration')
+        fields = ('id', 'title', 'picture', 'picture_sizes', 'cook_duration')
         read_only_fields = fields
 
 
 class UserSubscriptionSerializer(UserSerializer):
     
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source='recipes.count', read_only=True
-    )
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = [*UserSerializer.Meta.fields, 'recipes', 'recipes_count']
         read_only_fields = fields
 
+    @staticmethod
+    def get_recipes_limit(request):
+        recipes_limit = request.query_params.get('recipes_limit', '')
+        return int(recipes_limit) if recipes_limit.isdigit() else None
+
+    @classmethod
+    def get_recipes_prefetch(cls, request):
+        """Prefetch последних рецептов авторов одним запросом"""
+        recipes = CookingRecipe.objects.only(
+            'id', 'title', 'picture', 'picture_derivatives', 'cook_duration',
+            'creator_id', 'date_created'
+        )
+        recipes_limit = cls.get_recipes_limit(request)
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
+        return models.Prefetch(
+            'recipes', queryset=recipes, to_attr='latest_recipes'
+        )
+
     def get_recipes(self, user):
-        recipes_queryset = user.recipes.all()
-        recipes_limit = self.context['request'].query_params.get('recipes_limit')
-        
-        if recipes_limit:
-            recipes_queryset = recipes_queryset[:int(recipes_limit)]
+        recipes_queryset = getattr(user, 'latest_recipes', None)
+        if recipes_queryset is None:
+            recipes_queryset = user.recipes.all()
+            recipes_limit = self.get_recipes_limit(self.context['request'])
+            if recipes_limit is not None:
+                recipes_queryset = recipes_queryset[:recipes_limit]
         
         return CookingRecipeShortSerializer(
             recipes_queryset, 
@@ -1,2 +1,1195 @@
+import io
+import json
+import os
+import runpy
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.http import Http404
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from recipes.models import (
+    CookingRecipe, DeletedRecipe, FavoriteRecipe, FeedEntry, ImageJob,
+    ProductComponent, RecipeComponent, ShoppingCart, ShoppingListItem, User,
+    UserSubscription
+)
+from recipes import pantry
+from recipes.routers import unavailable_until
+from recipes.shopping_list import calculate_shopping_lists
+from recipes.views import aredirect_to_recipe
+
+from .views import CookingRecipeViewSet, ProductComponentViewSet, UserViewSet
+
+
+class RecipesDataMixin:
+    """Пользователи и рецепты для тестов API"""
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(
+            email=f'{username}@example.com', username=username,
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+
+    @staticmethod
+    def create_recipe(creator, *components, title='Рецепт', quantity=1):
+        recipe = CookingRecipe.objects.create(
+            title=title, description='Описание', cook_duration=10,
+            picture='recipes/images/test.png', creator=creator
+        )
+        for component in components:
+            RecipeComponent.objects.create(
+                recipe=recipe, component=component, quantity=quantity
+            )
+        return recipe
+
+
+class CookingRecipeListQueriesTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = cls.create_user('viewer')
+        components = ProductComponent.objects.bulk_create(
+            ProductComponent(title=f'продукт {index}', unit_type='г')
+            for index in range(3)
+        )
+        for index in range(6):
+            cls.create_recipe(
+                cls.create_user(f'author{index}'), *components,
+                title=f'Рецепт {index}'
+            )
+
+    def get_queries_count(self, limit):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/recipes/?limit={limit}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        self.assertEqual(len(response.data['results'][0]['components']), 3)
+        return len(context.captured_queries)
+
+    def test_list_queries_do_not_depend_on_limit(self):
+        self.assertEqual(self.get_queries_count(1), self.get_queries_count(6))
+
+    def test_authenticated_list_queries_do_not_depend_on_limit(self):
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.get_queries_count(1), self.get_queries_count(6))
+
+
+class SubscriptionLoaderTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = cls.create_user('viewer')
+        cls.authors = [cls.create_user(f'author{index}') for index in range(4)]
+        for author in (cls.viewer, *cls.authors):
+            cls.create_recipe(author)
+        for author in cls.authors[:2]:
+            UserSubscription.objects.create(
+                subscriber=cls.viewer, target_user=author
+            )
+
+    def get_with_subscription_queries(self, url):
+        self.client.force_authenticate(self.viewer)
+        table = UserSubscription._meta.db_table
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        queries = [
+            query for query in context.captured_queries
+            if table in query['sql']
+        ]
+        return response.data['results'], queries
+
+    def test_recipe_list_loads_subscriptions_once(self):
+        results, queries = self.get_with_subscription_queries(
+            '/api/recipes/?limit=10'
+        )
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(queries), 1)
+        subscribed = {author.pk for author in self.authors[:2]}
+        for item in results:
+            self.assertEqual(
+                item['creator']['is_subscribed'],
+                item['creator']['id'] in subscribed
+            )
+
+    def test_user_list_loads_subscriptions_once(self):
+        results, queries = self.get_with_subscription_queries(
+            '/api/users/?limit=10'
+        )
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            {item['id'] for item in results if item['is_subscribed']},
+            {author.pk for author in self.authors[:2]}
+        )
+
+
+class RecipeUserFlagsTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.viewer = cls.create_user('viewer')
+        cls.favorite, cls.carted, cls.both, cls.plain = (
+            cls.create_recipe(cls.author, title=f'Рецепт {index}')
+            for index in range(4)
+        )
+        for recipe in (cls.favorite, cls.both):
+            FavoriteRecipe.objects.create(user=cls.viewer, recipe=recipe)
+        for recipe in (cls.carted, cls.both):
+            ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_flags(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/?limit=10')
+        self.assertEqual(response.status_code, 200)
+        flag_queries = [
+            query['sql'] for query in context.captured_queries
+            if FavoriteRecipe._meta.db_table in query['sql']
+            or ShoppingCart._meta.db_table in query['sql']
+        ]
+        flags = {
+            item['id']: (item['is_favorited'], item['is_in_shopping_cart'])
+            for item in response.data['results']
+        }
+        return flags, flag_queries
+
+    def test_anonymous_flags(self):
+        flags, flag_queries = self.get_flags()
+        self.assertEqual(flag_queries, [])
+        self.assertEqual(set(flags.values()), {(False, False)})
+
+    def test_flags_annotated_in_list_query(self):
+        self.client.force_authenticate(self.viewer)
+        flags, flag_queries = self.get_flags()
+        self.assertEqual(len(flag_queries), 1)
+        self.assertIn(ShoppingCart._meta.db_table, flag_queries[0])
+        self.assertIn(FavoriteRecipe._meta.db_table, flag_queries[0])
+        self.assertEqual(flags, {
+            self.favorite.pk: (True, False),
+            self.carted.pk: (False, True),
+            self.both.pk: (True, True),
+            self.plain.pk: (False, False),
+        })
+
+
+class SubscriptionsRecipesLimitTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = cls.create_user('viewer')
+        cls.latest_recipes = {}
+        now = timezone.now()
+        for index in range(3):
+            author = cls.create_user(f'author{index}')
+            UserSubscription.objects.create(subscriber=cls.viewer, target_user=author)
+            recipes = [cls.create_recipe(author) for _ in range(3)]
+            for age, recipe in enumerate(recipes):
+                CookingRecipe.objects.filter(pk=recipe.pk).update(
+                    date_created=now - timedelta(days=age)
+                )
+            cls.latest_recipes[author.pk] = [recipe.pk for recipe in recipes]
+
+    def setUp(self):
+        self.client.force_authenticate(self.viewer)
+
+    def get_recipes(self, recipes_limit):
+        table = CookingRecipe._meta.db_table
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                f'/api/users/subscriptions/?recipes_limit={recipes_limit}'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        recipe_queries = [
+            query for query in context.captured_queries
+            if f'FROM "{table}"' in query['sql']
+        ]
+        # Рецепты всех авторов страницы читаются не более чем одним запросом
+        self.assertLessEqual(len(recipe_queries), 1)
+        for author in response.data['results']:
+            self.assertEqual(author['recipes_count'], 3)
+        return {
+            author['id']: [recipe['id'] for recipe in author['recipes']]
+            for author in response.data['results']
+        }
+
+    def test_recipes_limit(self):
+        self.assertEqual(self.get_recipes(2), {
+            author_id: recipe_ids[:2]
+            for author_id, recipe_ids in self.latest_recipes.items()
+        })
+
+    def test_zero_recipes_limit(self):
+        self.assertEqual(self.get_recipes(0), {
+            author_id: [] for author_id in self.latest_recipes
+        })
+
+    def test_invalid_recipes_limit_ignored(self):
+        for recipes_limit in ('abc', '-1', '1.5'):
+            self.assertEqual(self.get_recipes(recipes_limit), self.latest_recipes)
+
+
+class ConditionalGetTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.viewer = cls.create_user('viewer')
+        cls.recipe = cls.create_recipe(cls.author)
+
+    def assertNotModified(self, url, **headers):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, 304)
+        return etag, context.captured_queries
+
+    def test_recipe_list_not_modified_without_queries(self):
+        _, queries = self.assertNotModified('/api/recipes/')
+        self.assertEqual(queries, [])
+
+    def test_recipe_etag_changes_after_update(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag, _ = self.assertNotModified(url)
+        self.recipe.title = 'Новый рецепт'
+        self.recipe.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Новый рецепт')
+
+    def test_recipe_etag_changes_after_update_without_versions(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag, _ = self.assertNotModified(url)
+        # Изменение из другого процесса, версия которого не дошла до кеша
+        CookingRecipe.objects.filter(pk=self.recipe.pk).update(
+            title='Новый рецепт', updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Новый рецепт')
+
+    def test_recipe_etag_changes_after_favorite(self):
+        self.client.force_authenticate(self.viewer)
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag, _ = self.assertNotModified(url)
+        self.client.post(f'{url}favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_ingredients_and_users_not_modified(self):
+        self.assertNotModified('/api/ingredients/')
+        self.assertNotModified('/api/users/')
+        self.assertNotModified(f'/api/users/{self.author.pk}/')
+
+
+class CursorPaginationTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        for index in range(5):
+            cls.create_recipe(cls.author, title=f'Рецепт {index}')
+        # Одинаковое время создания: порядок задаёт только id
+        CookingRecipe.objects.update(date_created=timezone.now())
+
+    def get_page(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url.replace('http://testserver', ''))
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'].upper())
+        return response.data
+
+    def get_ids(self, page):
+        return [item['id'] for item in page['results']]
+
+    def test_pages_split_recipes_with_same_timestamp(self):
+        expected = list(
+            CookingRecipe.objects.order_by('-id').values_list('id', flat=True)
+        )
+        page = self.get_page('/api/recipes/?cursor=&limit=2')
+        self.assertIsNone(page['previous'])
+        ids = self.get_ids(page)
+        while page['next']:
+            page = self.get_page(page['next'])
+            ids += self.get_ids(page)
+        self.assertEqual(ids, expected)
+        self.assertIsNotNone(page['previous'])
+
+    def test_previous_link_returns_to_previous_page(self):
+        first = self.get_page('/api/recipes/?cursor=&limit=2')
+        second = self.get_page(first['next'])
+        self.assertEqual(
+            self.get_ids(self.get_page(second['previous'])), self.get_ids(first)
+        )
+
+    def test_pages_stable_after_insert(self):
+        first = self.get_page('/api/recipes/?cursor=&limit=2')
+        self.create_recipe(self.author, title='Новый рецепт')
+        second = self.get_page(first['next'])
+        expected = list(
+            CookingRecipe.objects.order_by('-id')
+            .exclude(title='Новый рецепт')
+            .values_list('id', flat=True)[2:4]
+        )
+        self.assertEqual(self.get_ids(second), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=cD1bMV0%3D')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_search_rejected(self):
+        response = self.client.get('/api/recipes/?cursor=&search=рецепт')
+        self.assertEqual(response.status_code, 400)
+
+    def test_user_list_cursor(self):
+        for index in range(3):
+            self.create_user(f'user{index}')
+        page = self.get_page('/api/users/?cursor=&limit=2')
+        usernames = [item['username'] for item in page['results']]
+        while page['next']:
+            page = self.get_page(page['next'])
+            usernames += [item['username'] for item in page['results']]
+        self.assertEqual(
+            usernames,
+            list(User.objects.order_by('username').values_list('username', flat=True))
+        )
+
+
+class ShoppingListAggregateTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.buyer = cls.create_user('buyer')
+        cls.flour, cls.salt, cls.milk = (
+            ProductComponent.objects.create(title=title, unit_type='г')
+            for title in ('мука', 'соль', 'молоко')
+        )
+        cls.bread = cls.create_recipe(cls.author, cls.flour, cls.salt, quantity=100)
+        cls.pancakes = cls.create_recipe(cls.author, cls.flour, cls.milk, quantity=50)
+
+    def setUp(self):
+        self.client.force_authenticate(self.buyer)
+
+    def get_items(self):
+        return {
+            (item.user_id, item.component_id): (item.quantity, item.recipes_count)
+            for item in ShoppingListItem.objects.all()
+        }
+
+    def assertAggregateMatches(self):
+        expected = {
+            (row['recipe__shopping_items__user'], row['component']): (
+                row['total_quantity'], row['total_recipes']
+            )
+            for row in calculate_shopping_lists()
+        }
+        self.assertEqual(self.get_items(), expected)
+
+    def cart(self, recipe, method='post'):
+        response = getattr(self.client, method)(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertIn(response.status_code, (201, 204))
+
+    def test_cart_and_uncart(self):
+        self.cart(self.bread)
+        self.cart(self.pancakes)
+        self.assertEqual(self.get_items()[(self.buyer.pk, self.flour.pk)], (150, 2))
+        self.assertAggregateMatches()
+        self.cart(self.bread, 'delete')
+        self.assertEqual(self.get_items()[(self.buyer.pk, self.flour.pk)], (50, 1))
+        self.assertNotIn((self.buyer.pk, self.salt.pk), self.get_items())
+        self.assertAggregateMatches()
+
+    def test_component_edit_and_recipe_delete(self):
+        self.cart(self.bread)
+        self.cart(self.pancakes)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(f'/api/recipes/{self.bread.pk}/', {
+            'components': [
+                {'id': self.flour.pk, 'quantity': 30},
+                {'id': self.milk.pk, 'quantity': 20},
+            ]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_items()[(self.buyer.pk, self.milk.pk)], (70, 2))
+        self.assertAggregateMatches()
+        self.assertEqual(
+            self.client.delete(f'/api/recipes/{self.pancakes.pk}/').status_code, 204
+        )
+        self.assertEqual(self.get_items(), {
+            (self.buyer.pk, self.flour.pk): (30, 1),
+            (self.buyer.pk, self.milk.pk): (20, 1),
+        })
+        self.assertAggregateMatches()
+
+    def test_admin_component_add_and_change(self):
+        self.cart(self.pancakes)
+        component_admin = admin.site.get_model_admin(RecipeComponent)
+        request = RequestFactory().post('/admin/')
+        component = RecipeComponent(recipe=self.pancakes, component=self.salt, quantity=5)
+        component_admin.save_model(request, component, None, change=False)
+        self.assertEqual(self.get_items()[(self.buyer.pk, self.flour.pk)], (50, 1))
+        self.assertAggregateMatches()
+        component.quantity = 15
+        component_admin.save_model(request, component, None, change=True)
+        self.assertEqual(self.get_items()[(self.buyer.pk, self.salt.pk)], (15, 1))
+        self.assertAggregateMatches()
+        # Строка перенесена в рецепт не из корзины
+        component.recipe = self.create_recipe(self.author, self.milk)
+        component_admin.save_model(request, component, None, change=True)
+        self.assertNotIn((self.buyer.pk, self.salt.pk), self.get_items())
+        self.assertAggregateMatches()
+
+    def test_rebuild_restores_aggregate(self):
+        self.cart(self.bread)
+        self.cart(self.pancakes)
+        ShoppingListItem.objects.filter(component=self.flour).update(quantity=1)
+        ShoppingListItem.objects.filter(component=self.milk).delete()
+        output = io.StringIO()
+        call_command('rebuild_shopping_lists', '--verify', stdout=output)
+        self.assertIn('Расхождений в списках покупок: 2', output.getvalue())
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.assertAggregateMatches()
+        output = io.StringIO()
+        call_command('rebuild_shopping_lists', '--verify', stdout=output)
+        self.assertIn('Списки покупок совпадают с корзинами', output.getvalue())
+
+
+class ShoppingListDownloadTest(RecipesDataMixin, APITestCase):
+
+    url = '/api/recipes/download-shopping-list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.buyer = cls.create_user('buyer')
+        flour, salt = (
+            ProductComponent.objects.create(title=title, unit_type='г')
+            for title in ('мука', 'соль')
+        )
+        cls.bread = cls.create_recipe(
+            cls.author, flour, salt, title='Хлеб', quantity=100
+        )
+        cls.pancakes = cls.create_recipe(
+            cls.author, flour, title='Блины', quantity=50
+        )
+        for recipe in (cls.bread, cls.pancakes):
+            ShoppingCart.objects.create(user=cls.buyer, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.buyer)
+
+    def download(self, export_format='txt'):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'{self.url}?format={export_format}')
+            self.assertEqual(response.status_code, 200)
+            content = b''.join(response.streaming_content).decode()
+        return response, content, len(context.captured_queries)
+
+    def test_txt(self):
+        response, content, _ = self.download()
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('shopping_list.txt', response['Content-Disposition'])
+        date = timezone.localdate().strftime('%d.%m.%Y')
+        self.assertTrue(content.startswith(
+            f'Список покупок на {date}\n\nПРОДУКТЫ:\n'
+            '1. Мука - 150 г\n2. Соль - 100 г\n\nРЕЦЕПТЫ:\n'
+        ))
+        for title in ('Хлеб', 'Блины'):
+            self.assertIn(
+                f'• {title} (автор: Имя Фамилия @author)\n', content
+            )
+
+    def test_csv(self):
+        response, content, _ = self.download('csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertEqual(
+            content,
+            'Продукт,Количество,Единица измерения\r\n'
+            'Мука,150,г\r\nСоль,100,г\r\n'
+        )
+
+    def test_unknown_format(self):
+        response = self.client.get(f'{self.url}?format=pdf')
+        self.assertEqual(response.status_code, 404)
+
+    def test_repeat_download_served_from_cache(self):
+        for export_format in ('txt', 'csv'):
+            _, content, queries = self.download(export_format)
+            self.assertGreater(queries, 0)
+            self.assertEqual(self.download(export_format)[1:], (content, 0))
+
+    def test_cart_change_invalidates_cache(self):
+        self.download('csv')
+        response = self.client.delete(
+            f'/api/recipes/{self.pancakes.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        _, content, queries = self.download('csv')
+        self.assertGreater(queries, 0)
+        self.assertIn('Мука,100,г', content)
+
+
+class RecipeCacheTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.viewer = cls.create_user('viewer')
+        cls.recipes = [cls.create_recipe(cls.author) for _ in range(3)]
+
+    def setUp(self):
+        cache.clear()
+
+    def get_list(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], len(context.captured_queries)
+
+    def test_tests_use_separate_cache(self):
+        self.assertNotEqual(
+            settings.CACHES['default']['LOCATION'], str(settings.BASE_DIR / 'cache')
+        )
+
+    def test_fragments_reused_between_requests(self):
+        self.client.force_authenticate(self.viewer)
+        first, cold_queries = self.get_list()
+        second, warm_queries = self.get_list()
+        self.assertEqual(first, second)
+        # Продукты рецептов читаются только для фрагментов не из кеша
+        self.assertEqual(warm_queries, cold_queries - 1)
+
+    def test_recipe_and_author_changes_invalidate(self):
+        self.client.force_authenticate(self.viewer)
+        self.get_list()
+        recipe = self.recipes[0]
+        recipe.title = 'Новый рецепт'
+        recipe.save()
+        self.author.first_name = 'Пётр'
+        self.author.save()
+        results, _ = self.get_list()
+        titles = {item['id']: item['title'] for item in results}
+        self.assertEqual(titles[recipe.pk], 'Новый рецепт')
+        self.assertEqual(
+            {item['creator']['first_name'] for item in results}, {'Пётр'}
+        )
+
+    def test_anonymous_response_not_served_to_viewer(self):
+        recipe = self.recipes[0]
+        FavoriteRecipe.objects.create(user=self.viewer, recipe=recipe)
+        anonymous, _ = self.get_list()
+        self.assertFalse(any(item['is_favorited'] for item in anonymous))
+        _, cached_queries = self.get_list()
+        self.assertEqual(cached_queries, 0)
+        self.client.force_authenticate(self.viewer)
+        results, _ = self.get_list()
+        favorited = {item['id'] for item in results if item['is_favorited']}
+        self.assertEqual(favorited, {recipe.pk})
+
+
+class ImageDerivativesTest(RecipesDataMixin, APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root, IMAGE_DERIVATIVE_WIDTHS=(100, 400)
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        author = self.create_user('author')
+        buffer = io.BytesIO()
+        Image.new('RGBA', (800, 600), (255, 0, 0, 128)).save(buffer, 'PNG')
+        self.recipe = CookingRecipe(
+            title='Рецепт', description='Описание', cook_duration=10,
+            creator=author
+        )
+        self.recipe.picture.save('dish.png', ContentFile(buffer.getvalue()))
+
+    def get_picture_sizes(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['picture'], response.data['picture_sizes']
+
+    def test_original_served_until_derivatives_ready(self):
+        self.assertTrue(ImageJob.objects.filter(object_id=self.recipe.pk).exists())
+        picture, sizes = self.get_picture_sizes()
+        self.assertEqual(sizes['100'], {'webp': picture, 'jpeg': picture})
+
+        call_command('process_images', once=True, stdout=io.StringIO())
+
+        self.assertFalse(ImageJob.objects.exists())
+        _, sizes = self.get_picture_sizes()
+        self.assertNotEqual(sizes['100']['webp'], sizes['100']['jpeg'])
+        self.assertTrue(sizes['100']['webp'].endswith('.webp'))
+        self.recipe.refresh_from_db()
+        small = self.recipe.picture_derivatives['sizes']['100']['jpeg']
+        with self.recipe.picture.storage.open(small) as file:
+            self.assertEqual(Image.open(file).size, (100, 75))
+
+    def test_derivatives_served_after_processing_elsewhere(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag = self.client.get(url).headers['ETag']
+        updated_at = CookingRecipe.objects.get(pk=self.recipe.pk).updated_at
+        # Обработчик изображений в отдельном контейнере: своё подключение
+        # к общему кешу
+        worker_cache = caches.create_connection('default')
+        with mock.patch('recipes.versions.cache', worker_cache):
+            call_command('process_images', once=True, stdout=io.StringIO())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['picture_sizes']['100']['webp'].endswith('.webp'))
+        self.assertGreater(
+            CookingRecipe.objects.get(pk=self.recipe.pk).updated_at, updated_at
+        )
+
+
+class MultipartUploadTest(RecipesDataMixin, APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = self.create_user('author')
+        self.component = ProductComponent.objects.create(
+            title='мука', unit_type='г'
+        )
+        self.client.force_authenticate(self.user)
+
+    def get_image(self, name='dish.bin', image_format='PNG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (20, 10)).save(buffer, image_format)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_create_recipe_with_multipart_picture(self):
+        response = self.client.post('/api/recipes/', {
+            'title': 'Блины', 'description': 'Описание', 'cook_duration': 10,
+            'picture': self.get_image(),
+            'components': json.dumps([{'id': self.component.pk, 'quantity': 5}]),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = CookingRecipe.objects.get()
+        self.assertTrue(recipe.picture.name.endswith('.png'))
+        self.assertEqual(recipe.recipe_components.get().quantity, 5)
+
+    def test_multipart_rejects_non_image(self):
+        response = self.client.put('/api/users/me/avatar/', {
+            'avatar': SimpleUploadedFile('avatar.png', b'not an image'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(IMAGE_MAX_PIXELS=100)
+    def test_multipart_rejects_large_image(self):
+        response = self.client.put('/api/users/me/avatar/', {
+            'avatar': self.get_image(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_avatar_multipart_upload(self):
+        response = self.client.put('/api/users/me/avatar/', {
+            'avatar': self.get_image(image_format='JPEG'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar.name.endswith('.jpeg'))
+
+
+@override_settings(PERF_INSTRUMENTATION=True)
+class PerformanceMiddlewareTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.create_recipe(cls.author)
+
+    def test_server_timing_header(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.get('/api/recipes/')
+        timing = response.headers['Server-Timing']
+        for name in ('total', 'view', 'db', 'serialize', 'render'):
+            self.assertIn(f'{name};dur=', timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    @override_settings(PERF_SLOW_REQUEST_MS=0, PERF_EXPLAIN_SLOW_QUERIES=True)
+    def test_slow_request_log_with_explain(self):
+        self.client.force_authenticate(self.author)
+        with self.assertLogs('foodgram.performance', 'WARNING') as logs:
+            self.client.get('/api/recipes/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'recipes-list')
+        self.assertGreater(record['queries'], 0)
+        self.assertLessEqual(len(record['top_queries']), 5)
+        self.assertTrue(any('explain' in query for query in record['top_queries']))
+
+    def test_sampled_profile_dump(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.settings(PERF_PROFILE_SAMPLE_RATE=1, PERF_PROFILE_DIR=directory):
+            self.client.get('/api/ingredients/')
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    @override_settings(PERF_INSTRUMENTATION=False)
+    def test_disabled_middleware_adds_nothing(self):
+        response = self.client.get('/api/ingredients/')
+        self.assertNotIn('Server-Timing', response.headers)
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.create_recipe(cls.author)
+
+    def test_latency_labelled_by_viewset_action(self):
+        self.client.get('/api/recipes/')
+        self.client.force_authenticate(self.author)
+        self.client.get('/api/recipes/download-shopping-list/')
+        content = self.client.get('/api/metrics/').content.decode()
+        self.assertRegex(
+            content,
+            r'foodgram_request_duration_seconds_count\{action="list",'
+            r'method="GET",status="2xx",view="CookingRecipeViewSet"\} [1-9]'
+        )
+        self.assertIn('action="download_shopping_list"', content)
+        self.assertIn('foodgram_request_db_queries_bucket{', content)
+        self.assertIn('foodgram_requests_in_flight', content)
+
+    def test_cache_hit_ratio(self):
+        self.client.get('/api/recipes/')
+        etag = self.client.get('/api/recipes/').headers['ETag']
+        self.client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        content = self.client.get('/api/metrics/').content.decode()
+        self.assertRegex(content, r'foodgram_cache_hit_ratio\{cache="anonymous_response"\} 0\.\d')
+        self.assertRegex(content, r'foodgram_cache_hit_ratio\{cache="conditional"\} 0\.\d')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+
+class AsyncViewsTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.reader = cls.create_user('reader')
+        UserSubscription.objects.create(subscriber=cls.reader, target_user=cls.author)
+        component = ProductComponent.objects.create(title='мука', unit_type='г')
+        for index in range(3):
+            cls.recipe = cls.create_recipe(
+                cls.author, component, title=f'Рецепт {index}', quantity=100
+            )
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipe)
+        cls.token = Token.objects.create(user=cls.reader).key
+
+    def get_views(self):
+        with self.settings(ASYNC_VIEWS=True):
+            return {
+                'recipes': CookingRecipeViewSet.as_view({'get': 'list', 'post': 'create'}),
+                'recipe': CookingRecipeViewSet.as_view({'get': 'retrieve'}),
+                'ingredients': ProductComponentViewSet.as_view({'get': 'list'}),
+                'subscriptions': UserViewSet.as_view(
+                    {'get': 'subscriptions'},
+                    **UserViewSet.subscriptions.kwargs
+                ),
+            }
+
+    async def call(self, view, path, authorized=False, **kwargs):
+        headers = {'Authorization': f'Token {self.token}'} if authorized else {}
+        response = await view(AsyncRequestFactory().get(path, headers=headers), **kwargs)
+        return response.render()
+
+    async def test_async_responses_match_sync(self):
+        views = self.get_views()
+        cases = (
+            ('recipes', '/api/recipes/?limit=2&offset=1', False, {}),
+            ('recipes', f'/api/recipes/?limit=6&creator={self.author.pk}&is_favorited=1', True, {}),
+            ('recipe', f'/api/recipes/{self.recipe.pk}/', True, {'pk': self.recipe.pk}),
+            ('ingredients', '/api/ingredients/?name=му', False, {}),
+            ('subscriptions', '/api/users/subscriptions/?recipes_limit=2', True, {}),
+        )
+        for name, path, authorized, kwargs in cases:
+            with self.subTest(path=path):
+                response = await self.call(views[name], path, authorized, **kwargs)
+                headers = {'Authorization': f'Token {self.token}'} if authorized else {}
+                expected = await self.async_client.get(path, headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_async_errors(self):
+        views = self.get_views()
+        response = await self.call(views['recipe'], '/api/recipes/0/', pk=0)
+        self.assertEqual(response.status_code, 404)
+        response = await self.call(views['subscriptions'], '/api/users/subscriptions/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_not_modified(self):
+        views = self.get_views()
+        path = f'/api/recipes/{self.recipe.pk}/'
+        etag = (await self.call(views['recipe'], path, pk=self.recipe.pk))['ETag']
+        response = await views['recipe'](
+            AsyncRequestFactory().get(path, headers={'If-None-Match': etag}), pk=self.recipe.pk
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_async_only_when_enabled(self):
+        self.assertTrue(iscoroutinefunction(self.get_views()['recipes']))
+        self.assertFalse(iscoroutinefunction(
+            CookingRecipeViewSet.as_view({'get': 'list'})
+        ))
+
+    async def test_writes_use_sync_view(self):
+        response = await self.get_views()['recipes'](
+            AsyncRequestFactory().post('/api/recipes/', {}, content_type='application/json')
+        )
+        self.assertEqual(response.render().status_code, 400)
+        self.assertIn('title', response.data)
+
+    async def test_shopping_list_streams_asynchronously(self):
+        path = '/api/recipes/download-shopping-list/'
+        headers = {'Authorization': f'Token {self.token}'}
+        expected = await self.async_client.get(path, headers=headers)
+        with self.settings(ASYNC_VIEWS=True):
+            response = await self.async_client.get(path, headers=headers)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertIn('Мука - 100 г'.encode(), content)
+        self.assertEqual(
+            content, await sync_to_async(b''.join)(expected.streaming_content)
+        )
+
+    async def test_short_link_redirect(self):
+        request = AsyncRequestFactory().get(f'/{self.recipe.pk}/')
+        response = await aredirect_to_recipe(request, self.recipe.pk)
+        self.assertEqual(response.url, f'/recipes/{self.recipe.pk}/')
+        with self.assertRaises(Http404):
+            await aredirect_to_recipe(request, 0)
+
+    @override_settings(PERF_INSTRUMENTATION=True, METRICS_ENABLED=True)
+    async def test_async_middleware_counts_queries(self):
+        response = await self.async_client.get(
+            '/api/recipes/', headers={'Authorization': f'Token {self.token}'}
+        )
+        self.assertRegex(
+            response.headers['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"'
+        )
+
+
+@override_settings(DB_REPLICAS=['replica'])
+class ReplicaRoutingTest(RecipesDataMixin, APITestCase):
+    """Вторая тестовая БД играет роль реплики, не получающей записи
+    основной БД, как при отставании репликации"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Реплика создаётся только для этих тестов, поэтому не указана
+        # в databases класса, по которому тестовые БД готовит test runner
+        cls.databases = {'default', 'replica'}
+        default = connections['default'].settings_dict
+        # connections.settings — тот же словарь, что и settings.DATABASES
+        settings.DATABASES['replica'] = {
+            **default, 'TEST': {**default['TEST'], 'NAME': None}
+        }
+        cls.replica_name = default['NAME']
+        connections['replica'].creation.create_test_db(verbosity=0, serialize=False)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].creation.destroy_test_db(cls.replica_name, verbosity=0)
+        del connections['replica']
+        del settings.DATABASES['replica']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.reader = cls.create_user('reader')
+        cls.recipe = cls.create_recipe(cls.author)
+        cls.tokens = {
+            user.username: Token.objects.create(user=user).key
+            for user in (cls.author, cls.reader)
+        }
+
+    def setUp(self):
+        cache.clear()
+        unavailable_until.clear()
+        self.authorize('reader')
+
+    def authorize(self, username):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[username]}')
+
+    def get_recipe_ids(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_reads_go_to_replica(self):
+        # Токен читается из основной БД, рецепты — из пустой реплики
+        self.assertEqual(self.get_recipe_ids(), [])
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_client_reads_own_writes(self):
+        response = self.client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_recipe_ids(), [self.recipe.pk])
+        self.authorize('author')
+        self.assertEqual(self.get_recipe_ids(), [])
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        replica = connections['replica']
+        with mock.patch.object(
+            replica, 'ensure_connection', side_effect=OperationalError
+        ) as ensure_connection:
+            with self.assertLogs('foodgram.replicas', 'WARNING'):
+                self.assertEqual(self.get_recipe_ids(), [self.recipe.pk])
+            self.assertEqual(self.get_recipe_ids(), [self.recipe.pk])
+        self.assertEqual(ensure_connection.call_count, 1)
+
+    def test_replicas_from_environment(self):
+        with mock.patch.dict(os.environ, {
+            'SECRET_KEY': 'secret', 'DB_REPLICA_HOSTS': 'replica-db:6432 replica-two'
+        }):
+            module = runpy.run_path(
+                os.path.join(settings.BASE_DIR, 'foodgram', 'settings.py')
+            )
+        self.assertEqual(module['DB_REPLICAS'], ['replica1', 'replica2'])
+        databases = module['DATABASES']
+        self.assertEqual(
+            (databases['replica1']['HOST'], databases['replica1']['PORT']),
+            ('replica-db', '6432')
+        )
+        self.assertEqual(databases['replica2']['PORT'], databases['default']['PORT'])
+        self.assertEqual([code for code, _name in module['LANGUAGES']], ['ru', 'en'])
+
+
+class FeedTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.popular, cls.reader, cls.other = (
+            cls.create_user(username)
+            for username in ('author', 'popular', 'reader', 'other')
+        )
+        cls.old_recipe = cls.create_recipe(cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+    def get_feed_ids(self, **params):
+        response = self.client.get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_subscribe_backfills_and_publish_fans_out(self):
+        self.assertEqual(self.get_feed_ids(), [])
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.author)
+        recipe = self.create_recipe(self.author)
+        self.create_recipe(self.other)
+        self.assertEqual(self.get_feed_ids(), [recipe.pk, self.old_recipe.pk])
+        response = self.client.get('/api/recipes/feed/', {'limit': 1, 'offset': 1})
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']], [self.old_recipe.pk]
+        )
+
+    def test_unsubscribe_trims_feed(self):
+        subscription = UserSubscription.objects.create(
+            subscriber=self.reader, target_user=self.author
+        )
+        subscription.delete()
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.get_feed_ids(), [])
+
+    @override_settings(FEED_FANOUT_MAX_SUBSCRIBERS=1)
+    def test_popular_author_read_on_request(self):
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.author)
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.popular)
+        first = self.create_recipe(self.popular)
+        UserSubscription.objects.create(subscriber=self.other, target_user=self.popular)
+        # Второй подписчик: рецепты автора убраны из лент и не рассылаются
+        self.assertFalse(FeedEntry.objects.filter(author=self.popular).exists())
+        second = self.create_recipe(self.author)
+        third = self.create_recipe(self.popular)
+        self.assertFalse(FeedEntry.objects.filter(author=self.popular).exists())
+        self.assertEqual(
+            self.get_feed_ids(),
+            [third.pk, second.pk, first.pk, self.old_recipe.pk]
+        )
+        self.assertEqual(self.get_feed_ids(limit=2, offset=1), [second.pk, first.pk])
+        UserSubscription.objects.get(subscriber=self.other).delete()
+        self.assertEqual(
+            set(FeedEntry.objects.filter(author=self.popular).values_list(
+                'recipe_id', flat=True
+            )),
+            {first.pk, third.pk}
+        )
+
+    @override_settings(FEED_FANOUT_MAX_SUBSCRIBERS=1)
+    def test_reconciled_counter_crossing_threshold(self):
+        # Счётчик разошёлся с подписками: автор считается популярным
+        User.objects.filter(pk=self.author.pk).update(subscribers_count=5)
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.author)
+        self.assertFalse(FeedEntry.objects.exists())
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertEqual(self.get_feed_ids(), [self.old_recipe.pk])
+        self.assertTrue(FeedEntry.objects.filter(author=self.author).exists())
+        # Подписка в обход сигналов: после сверки автор становится популярным
+        UserSubscription.objects.bulk_create([
+            UserSubscription(subscriber=self.other, target_user=self.author)
+        ])
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.get_feed_ids(), [self.old_recipe.pk])
+
+    def test_feed_page_is_one_query(self):
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.author)
+        for _ in range(3):
+            self.create_recipe(self.author)
+        with CaptureQueriesContext(connection) as context:
+            self.get_feed_ids(limit=2)
+        feed_queries = [
+            query['sql'] for query in context.captured_queries
+            if FeedEntry._meta.db_table in query['sql']
+        ]
+        # Подписки на популярных авторов, число записей и страница ленты
+        self.assertEqual(len(feed_queries), 2)
+        self.assertIn('LIMIT 2', feed_queries[-1])
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/recipes/feed/').status_code, 401)
+
+
+class PantryTest(RecipesDataMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.flour, cls.eggs, cls.milk, cls.salt = (
+            ProductComponent.objects.create(title=title, unit_type='г')
+            for title in ('мука', 'яйца', 'молоко', 'соль')
+        )
+        cls.pancakes = cls.create_recipe(cls.author, cls.flour, cls.eggs, cls.milk)
+        cls.omelette = cls.create_recipe(cls.author, cls.eggs, cls.milk)
+        cls.bread = cls.create_recipe(cls.author, cls.flour, cls.salt)
+
+    def setUp(self):
+        cache.clear()
+        # Индекс процесса не видит откат данных предыдущих тестов
+        index_patch = mock.patch('recipes.pantry._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+    def get_matches(self, *components, **params):
+        response = self.client.get('/api/recipes/pantry/', {
+            'ingredients': ','.join(str(component.pk) for component in components),
+            **params
+        })
+        self.assertEqual(response.status_code, 200)
+        return [
+            (recipe['id'], recipe['missing_ingredients'])
+            for recipe in response.json()['results']
+        ]
+
+    def test_covered_recipes_first(self):
+        self.assertEqual(self.get_matches(self.eggs, self.milk), [
+            (self.omelette.pk, 0), (self.pancakes.pk, 1)
+        ])
+        self.assertEqual(self.get_matches(self.eggs, self.milk, self.flour), [
+            (self.omelette.pk, 0), (self.pancakes.pk, 0), (self.bread.pk, 1)
+        ])
+        response = self.client.get('/api/recipes/pantry/', {
+            'ingredients': [self.flour.pk, self.salt.pk], 'limit': 1, 'offset': 1
+        })
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(response.json()['results'][0]['id'], self.pancakes.pk)
+
+    def test_index_follows_recipe_changes(self):
+        self.assertEqual(self.get_matches(self.salt), [(self.bread.pk, 1)])
+        soup = self.create_recipe(self.author, self.salt)
+        self.bread.delete()
+        self.assertEqual(self.get_matches(self.salt), [(soup.pk, 0)])
+        RecipeComponent.objects.create(recipe=soup, component=self.milk, quantity=1)
+        self.assertEqual(self.get_matches(self.salt), [(soup.pk, 1)])
+
+    def test_index_polls_changes_without_versions(self):
+        self.assertEqual(self.get_matches(self.salt), [(self.bread.pk, 1)])
+        # Изменения из процесса, версии которого сюда не доходят
+        with mock.patch('recipes.versions.cache', LocMemCache('other', {})):
+            soup = self.create_recipe(self.author, self.salt)
+            self.bread.delete()
+        with override_settings(PANTRY_SYNC_INTERVAL=0):
+            self.assertEqual(self.get_matches(self.salt), [(soup.pk, 0)])
+
+    def test_deleted_recipes_removed_without_id_scan(self):
+        self.assertEqual(self.get_matches(self.salt), [(self.bread.pk, 1)])
+        self.bread.delete()
+        with mock.patch.object(pantry.PantryIndex, 'remove_missing') as remove_missing:
+            self.assertEqual(self.get_matches(self.salt), [])
+            with override_settings(PANTRY_SYNC_INTERVAL=0):
+                self.assertEqual(self.get_matches(self.salt), [])
+        remove_missing.assert_not_called()
+
+    def test_missed_deletions_found_by_id_scan(self):
+        self.assertEqual(self.get_matches(self.salt), [(self.bread.pk, 1)])
+        with mock.patch('recipes.versions.cache', LocMemCache('other', {})):
+            self.bread.delete()
+        # Записи об удалении устарели и удалены
+        DeletedRecipe.objects.all().delete()
+        with override_settings(PANTRY_SYNC_INTERVAL=0):
+            self.assertEqual(self.get_matches(self.salt), [])
+
+    def test_old_index_served_during_rebuild(self):
+        self.get_matches(self.salt)
+        index = pantry._index
+        with mock.patch.object(index, 'needs_rebuild', return_value=True):
+            with pantry._build_lock:
+                self.assertEqual(self.get_matches(self.salt), [(self.bread.pk, 1)])
+                self.assertIs(pantry._index, index)
+            self.get_matches(self.salt)
+        self.assertIsNot(pantry._index, index)
+
+    def test_invalid_ingredients(self):
+        for value in ('', 'мука', '1,,2', '²', '1,²'):
+            response = self.client.get('/api/recipes/pantry/', {'ingredients': value})
+            self.assertEqual(response.status_code, 400)
@@ -5,6 +5,7 @@ from .views import (
     ProductComponentViewSet,
     CookingRecipeViewSet,
     UserViewSet,
+    metrics,
 )
 
 router = DefaultRouter()
@@ -15,4 +16,5 @@ router.register(r'users', UserViewSet, basename='users')
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,61 +1,116 @@
-from datetime import datetime
-from django.db.models import Sum
+import hmac
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.forms import ValidationError
-from django.http import FileResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from rest_framework import filters, viewsets, permissions, status
+from rest_framework import exceptions, viewsets, permissions, status
 from rest_framework.permissions import AllowAny
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from recipes.models import CookingRecipe, ProductComponent, ShoppingCart, RecipeComponent, FavoriteRecipe
 from recipes.models import UserSubscription, User
+from recipes.catalog import get_ingredient_catalog
+from recipes.feed import Feed
+from recipes.pantry import match_pantry
 from .serializers import (
     ProductSerializer, CookingRecipeSerializer, CookingRecipeShortSerializer, 
     UserSubscriptionSerializer, UserSerializer
 )
+from .async_views import AsyncReadViewSetMixin
+from .caching import cached_anonymous_response
+from .conditional import (
+    catalog_rating_period, catalog_version_keys, conditional_by_versions,
+    current_user_version_keys, recipe_version_keys, recipes_version_keys,
+    subscriptions_version_keys, user_version_keys, users_version_keys
+)
+from .exporters import aexport_shopping_list, export_shopping_list
+from .loaders import SubscriptionLoader
+from .pagination import (
+    FeedPagination, PantryPagination, RecipePagination, UserPagination
+)
 from .permissions import CreatorOrReadOnly
-from .filters import CookingRecipeFilter
+from .renderers import CSVRenderer, PlainTextRenderer
+from .filters import CookingRecipeFilter, CookingRecipeSearchFilter
+from .metrics import render_metrics
 
 UserModel = get_user_model()
 
 
-class ProductComponentViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductComponentViewSet(AsyncReadViewSetMixin, viewsets.ReadOnlyModelViewSet):
     
     queryset = ProductComponent.objects.all()
     serializer_class = ProductSerializer
     pagination_class = None
     permission_classes = [AllowAny]
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter)
-    filterset_fields = ('title',)
-    search_fields = ('^title',)
 
-    def get_queryset(self):
-        search_term = self.request.query_params.get('title')
-        if search_term:
-            return self.queryset.filter(title__istartswith=search_term)
-        return self.queryset
+    def search_components(self, request):
+        """Поиск продуктов по началу названия без обращения к БД"""
+        params = request.query_params
+        search_term = params.get('name') or params.get('title', '')
+        limit = params.get('limit')
+        components = get_ingredient_catalog().search(
+            search_term, int(limit) if limit and limit.isdigit() else None
+        )
+        return self.get_serializer(components, many=True).data
+
+    @conditional_by_versions(catalog_version_keys, salt=catalog_rating_period)
+    def list(self, request, *args, **kwargs):
+        return Response(self.search_components(request))
 
+    @conditional_by_versions(catalog_version_keys, salt=catalog_rating_period)
+    async def alist(self, request, *args, **kwargs):
+        # Справочник может перечитываться из кеша или БД по истечении TTL
+        return Response(await sync_to_async(self.search_components)(request))
 
-class CookingRecipeViewSet(viewsets.ModelViewSet):
+    @conditional_by_versions(catalog_version_keys)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class CookingRecipeViewSet(AsyncReadViewSetMixin, viewsets.ModelViewSet):
     
     serializer_class = CookingRecipeSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
     permission_classes = (CreatorOrReadOnly,)
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter)
-    search_fields = ('title',)
+    filter_backends = (DjangoFilterBackend, CookingRecipeSearchFilter)
     filterset_class = CookingRecipeFilter
 
+    @conditional_by_versions(recipes_version_keys)
+    @cached_anonymous_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_by_versions(recipe_version_keys)
+    @cached_anonymous_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @conditional_by_versions(recipes_version_keys)
+    @cached_anonymous_response
+    async def alist(self, request, *args, **kwargs):
+        return await self.alist_response(
+            await self.afilter_queryset(self.get_queryset())
+        )
+
+    @conditional_by_versions(recipe_version_keys)
+    @cached_anonymous_response
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(await self.aserialize(self.get_serializer(instance)))
+
     def get_queryset(self):
         return (
             CookingRecipe.objects
             .select_related('creator')
-            .prefetch_related('recipe_components__component', 'favorite_recipes', 'shopping_items')
+            .with_user_flags(self.request.user)
         )
 
     def perform_create(self, serializer):
@@ -90,47 +145,72 @@ class CookingRecipeViewSet(viewsets.ModelViewSet):
         detail=False, 
         methods=['get'], 
         url_path='download-shopping-list',
-        permission_classes=[permissions.IsAuthenticated]
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[PlainTextRenderer, CSVRenderer]
     )
     def download_shopping_list(self, request):
-        user = request.user
-        shopping_list = (
-            RecipeComponent.objects
-            .filter(recipe__shopping_items__user=user) 
-            .values('component__title', 'component__unit_type')
-            .annotate(total_quantity=Sum('quantity'))
-            .order_by('component__title')
+        """Скачать список покупок в формате txt или csv"""
+        export_format = request.accepted_renderer.format
+        response = StreamingHttpResponse(
+            (aexport_shopping_list if settings.ASYNC_VIEWS else export_shopping_list)(
+                request.user, export_format
+            ),
+            content_type=f'{request.accepted_renderer.media_type}; charset=utf-8'
         )
-        recipes_in_cart = (
-            CookingRecipe.objects
-            .filter(shopping_items__user=user)  
-            .select_related('creator')
-            .values('title', 'creator__username', 'creator__first_name', 'creator__last_name')
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{export_format}"'
         )
-        content = '\n'.join([
-            f'Список покупок на {datetime.now().strftime("%d.%m.%Y")}',
-            '',
-            'ПРОДУКТЫ:',
-            *[
-                f'{index}. {item["component__title"].capitalize()} - '
-                f'{item["total_quantity"]} {item["component__unit_type"]}'
-                for index, item in enumerate(shopping_list, 1)
-            ],
-            '',
-            'РЕЦЕПТЫ:',
-            *[
-                f'• {recipe["title"]} (автор: '
-                f'{recipe["creator__first_name"]} {recipe["creator__last_name"]} '
-                f'@{recipe["creator__username"]})'
-                for recipe in recipes_in_cart
-            ],
-        ])
-        return FileResponse(
-            content,
-            as_attachment=True,
-            filename='shopping_list.txt',
-            content_type='text/plain'
+        return response
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='feed',
+        permission_classes=[permissions.IsAuthenticated],
+        pagination_class=FeedPagination
+    )
+    @conditional_by_versions(recipes_version_keys)
+    def feed(self, request):
+        """Рецепты авторов из подписок пользователя, от новых к старым"""
+        recipe_ids = self.paginate_queryset(Feed(request.user))
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes], many=True
         )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='pantry',
+        permission_classes=[permissions.AllowAny],
+        pagination_class=PantryPagination
+    )
+    def pantry(self, request):
+        """Рецепты по продуктам в наличии (?ingredients=1,2,3): сначала
+        те, для которых есть все продукты, затем по числу недостающих"""
+        values = ','.join(request.query_params.getlist('ingredients')).split(',')
+        try:
+            component_ids = [int(value) for value in values]
+        except ValueError:
+            raise exceptions.ValidationError(
+                {'ingredients': 'Укажите id продуктов через запятую.'}
+            )
+        matches = self.paginate_queryset(match_pantry(component_ids))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _missing in matches]
+        )
+        matches = [
+            (recipes[recipe_id], missing) for recipe_id, missing in matches
+            if recipe_id in recipes
+        ]
+        serializer = self.get_serializer(
+            [recipe for recipe, _missing in matches], many=True
+        )
+        return self.get_paginated_response([
+            {**data, 'missing_ingredients': missing}
+            for data, (_recipe, missing) in zip(serializer.data, matches)
+        ])
 
     @action(
         detail=True, 
@@ -153,23 +233,32 @@ class CookingRecipeViewSet(viewsets.ModelViewSet):
         if not recipe_exists:
             return Response({'error': f'Рецепт с id={pk} не найден'}, status=status.HTTP_404_NOT_FOUND)
 
-        short_link = request.build_absolute_uri(reverse('recipes:short-link', kwargs={'pk': pk}))
+        short_link = request.build_absolute_uri(reverse('short-link', kwargs={'recipe_id': pk}))
         return Response({'short-link': short_link})
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(AsyncReadViewSetMixin, DjoserUserViewSet):
     
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = UserPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    @conditional_by_versions(users_version_keys)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_by_versions(user_version_keys)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(
         detail=False, 
         methods=['get'], 
         url_path='me', 
         permission_classes=[permissions.IsAuthenticated]
     )
+    @conditional_by_versions(current_user_version_keys)
     def me(self, request, *args, **kwargs):
         """Получить текущего пользователя"""
         return super().me(request, *args, **kwargs)
@@ -227,15 +316,32 @@ class UserViewSet(DjoserUserViewSet):
         url_path='subscriptions',
         permission_classes=[permissions.IsAuthenticated]
     )
+    @conditional_by_versions(subscriptions_version_keys)
     def subscriptions(self, request):
         """Получить список подписок пользователя"""
-        subscribed_users = User.objects.filter(
+        page = self.paginate_queryset(self.get_subscriptions_queryset(request))
+        return self.get_paginated_response(self.serialize_subscriptions(request, page))
+
+    @conditional_by_versions(subscriptions_version_keys)
+    async def asubscriptions(self, request):
+        page = await self.paginator.apaginate_queryset(
+            self.get_subscriptions_queryset(request), request, view=self
+        )
+        return self.get_paginated_response(
+            await sync_to_async(self.serialize_subscriptions)(request, page)
+        )
+
+    def get_subscriptions_queryset(self, request):
+        return User.objects.filter(
             authors__subscriber=request.user 
-        ).prefetch_related('recipes')
-        
-        page = self.paginate_queryset(subscribed_users)
+        ).prefetch_related(UserSubscriptionSerializer.get_recipes_prefetch(request))
+
+    def serialize_subscriptions(self, request, page):
+        SubscriptionLoader.from_context({'request': request}).mark_subscribed(
+            user.pk for user in page
+        )
         serializer = UserSubscriptionSerializer(page, many=True, context={'request': request})
-        return self.get_paginated_response(serializer.data)
+        return serializer.data
         
     @action(
         detail=True, 
@@ -243,9 +349,9 @@ class UserViewSet(DjoserUserViewSet):
         url_path='subscribe',
         permission_classes=[permissions.IsAuthenticated]
     )
-    def subscribe(self, request, pk=None):
+    def subscribe(self, request, id=None):
         """Подписаться/отписаться от пользователя"""
-        target_user = get_object_or_404(User, pk=pk)
+        target_user = get_object_or_404(User, pk=id)
         
         if request.method == 'POST':
             if target_user == request.user:
@@ -274,3 +380,14 @@ class UserViewSet(DjoserUserViewSet):
         )
         subscription.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def metrics(request):
+    """Метрики Prometheus в текстовом формате"""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'
+    ):
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
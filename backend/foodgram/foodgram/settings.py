@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
     'django_filters',
@@ -55,6 +56,9 @@ INSTALLED_APPS = [
 DJANGO_SHORT_URL_REDIRECT_URL = ''
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -85,10 +89,24 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Режим сервера: wsgi — синхронные воркеры gunicorn, asgi — воркеры uvicorn
+# под gunicorn. В режиме asgi GET-запросы к списку и странице рецепта,
+# поиску продуктов, подпискам и короткой ссылке обрабатываются асинхронно
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+ASYNC_VIEWS = SERVER_MODE == 'asgi'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Соединения с БД переиспользуются между запросами: без пула соединение
+# живёт DB_CONN_MAX_AGE секунд и проверяется перед повторным использованием.
+# DB_POOL=True включает пул psycopg на DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE
+# соединений в каждом процессе (ожидание свободного — до DB_POOL_TIMEOUT с).
+# В режиме asgi у каждого запроса свой поток, поэтому постоянные соединения
+# там по умолчанию выключены и вместо них стоит использовать пул
+DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -97,9 +115,62 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
         'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(
+            os.getenv('DB_CONN_MAX_AGE', 0 if ASYNC_VIEWS else 60)
+        ),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+if DB_POOL:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+
+# Реплики PostgreSQL для чтения: адреса host[:port] через пробел, остальные
+# параметры подключения как у основной БД. GET-запросы читают из реплик,
+# запись и чтение клиента в течение DB_REPLICA_LAG_SECONDS после его записи —
+# из основной БД. Недоступная реплика пропускается DB_REPLICA_RETRY_SECONDS
+DB_REPLICAS = []
+for index, address in enumerate(os.getenv('DB_REPLICA_HOSTS', '').split(), start=1):
+    host, _sep, port = address.partition(':')
+    DB_REPLICAS.append(f'replica{index}')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['recipes.routers.PrimaryReplicaRouter']
+DB_REPLICA_LAG_SECONDS = float(os.getenv('DB_REPLICA_LAG_SECONDS', 5))
+DB_REPLICA_RETRY_SECONDS = float(os.getenv('DB_REPLICA_RETRY_SECONDS', 30))
+
+# Версии данных в кеше должны быть общими для всех процессов: воркеров
+# gunicorn, обработчика изображений и management-команд. По умолчанию
+# кеш хранится в файлах каталога CACHE_LOCATION, в docker-compose это том,
+# общий для backend и images. CACHE_BACKEND задаёт другой общий кеш
+# (Redis, Memcached); кеш в памяти процесса (locmem) подходит только для
+# разработки с одним процессом
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100_000)),
+        },
     }
 }
 
+# Тесты работают с кешем во временном каталоге, а не с общим кешем
+TEST_RUNNER = 'foodgram.test_runner.TestRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -152,6 +223,17 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загруженные файлы хранятся под именем-хешем содержимого (ab/cd/abcd…),
+# одинаковые файлы не дублируются и удаляются вместе с последней ссылкой
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -172,6 +254,95 @@ REST_FRAMEWORK = {
 
 }
 
+# Время жизни индекса продуктов в памяти процесса (сек), после которого
+# обновляется рейтинг продуктов по числу рецептов
+INGREDIENT_CATALOG_TTL = int(os.getenv('INGREDIENT_CATALOG_TTL', 300))
+
+# Время хранения рецептов и ответов анонимным пользователям в кеше (сек)
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 60 * 60))
+
+# Время хранения выгруженного списка покупок в кеше (сек)
+SHOPPING_LIST_CACHE_TIMEOUT = int(os.getenv('SHOPPING_LIST_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Лента подписок: рецепты авторов, у которых подписчиков не больше
+# FEED_FANOUT_MAX_SUBSCRIBERS, записываются в ленты при публикации,
+# рецепты остальных авторов читаются при выдаче ленты
+FEED_FANOUT_MAX_SUBSCRIBERS = int(os.getenv('FEED_FANOUT_MAX_SUBSCRIBERS', 1000))
+# Число последних рецептов автора, добавляемых в ленту при подписке
+FEED_BACKFILL_RECIPES = int(os.getenv('FEED_BACKFILL_RECIPES', 50))
+
+# Подбор рецептов по продуктам в запасах: индекс в памяти процесса
+# перечитывает рецепты, изменённые за PANTRY_SYNC_OVERLAP секунд до
+# последнего известного изменения, чтобы не пропустить долгие транзакции
+PANTRY_SYNC_OVERLAP = int(os.getenv('PANTRY_SYNC_OVERLAP', 60))
+# Как часто индекс сверяется с последним изменением и числом рецептов в БД
+# на случай, если версии из других процессов до него не дошли (секунды)
+PANTRY_SYNC_INTERVAL = float(os.getenv('PANTRY_SYNC_INTERVAL', 5))
+# Сколько хранятся записи об удалённых рецептах (секунды): индекс, который
+# их пропустил, сверяет id всех рецептов с БД
+PANTRY_DELETED_RETENTION = int(os.getenv('PANTRY_DELETED_RETENTION', 86400))
+
+# Ширина уменьшенных копий изображений рецептов и аватаров (px)
+IMAGE_DERIVATIVE_WIDTHS = tuple(
+    int(width)
+    for width in os.getenv('IMAGE_DERIVATIVE_WIDTHS', '160,480,960').split(',')
+)
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv('IMAGE_DERIVATIVE_QUALITY', 80))
+
+# Предельный размер загружаемого изображения (пиксели)
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+
+# Файлы из multipart/form-data пишутся во временный файл по частям,
+# чтобы память процесса не зависела от размера загрузки
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Число попыток обработки изображения, после которых задача остаётся
+# в очереди с ошибкой
+IMAGE_JOB_MAX_ATTEMPTS = int(os.getenv('IMAGE_JOB_MAX_ATTEMPTS', 3))
+
+# Замеры времени обработки запросов: заголовок Server-Timing, журнал
+# медленных запросов и выборочное профилирование. При выключенном
+# инструментировании middleware не участвует в обработке запросов
+PERF_INSTRUMENTATION = os.getenv('PERF_INSTRUMENTATION', 'False') == 'True'
+# Порог медленного запроса (мс) и число самых долгих SQL-запросов в журнале
+PERF_SLOW_REQUEST_MS = float(os.getenv('PERF_SLOW_REQUEST_MS', 500))
+PERF_SLOW_QUERIES_LOGGED = int(os.getenv('PERF_SLOW_QUERIES_LOGGED', 5))
+# Добавлять в журнал план выполнения (EXPLAIN) самых долгих SELECT-запросов
+PERF_EXPLAIN_SLOW_QUERIES = os.getenv('PERF_EXPLAIN_SLOW_QUERIES', 'False') == 'True'
+# Доля запросов, для которых сохраняется профиль cProfile (0 — выключено)
+PERF_PROFILE_SAMPLE_RATE = float(os.getenv('PERF_PROFILE_SAMPLE_RATE', 0))
+PERF_PROFILE_DIR = os.getenv('PERF_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+# Метрики Prometheus на /api/metrics/. Если задан METRICS_TOKEN, запрос
+# должен содержать заголовок Authorization: Bearer <токен>. Для сбора
+# метрик со всех процессов gunicorn задаётся PROMETHEUS_MULTIPROC_DIR
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.performance': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'foodgram.replicas': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 DJOSER = {
     'HIDE_USERS': False,
     'LOGIN_FIELD': 'email',
@@ -0,0 +1,29 @@
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Запускает тесты с отдельным файловым кешем во временном каталоге.
+
+    Тесты очищают кеш, а кеш по умолчанию общий для всех процессов
+    разработки: без подмены тесты стирали бы его версии и фрагменты.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_location = tempfile.mkdtemp(prefix='foodgram-test-cache-')
+        self.cache_override = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.cache_location,
+            }
+        })
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        shutil.rmtree(self.cache_location, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
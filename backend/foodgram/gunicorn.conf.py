@@ -0,0 +1,38 @@
+import os
+import shutil
+
+# SERVER_MODE=asgi запускает приложение в воркерах uvicorn,
+# иначе используются синхронные воркеры gunicorn
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+
+# При включённых метриках каждый процесс пишет значения в файлы каталога
+# PROMETHEUS_MULTIPROC_DIR, а /api/metrics/ суммирует их по всем процессам
+if os.getenv('METRICS_ENABLED', 'False') == 'True':
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/foodgram-metrics')
+
+
+def on_starting(server):
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Индекс подбора по запасам строится в каждом процессе; при
+    # PANTRY_PRELOAD=True это происходит до первого запроса
+    if os.getenv('PANTRY_PRELOAD', 'False') == 'True':
+        from django.db import connections
+        from recipes.pantry import match_pantry
+        match_pantry(())
+        connections.close_all()
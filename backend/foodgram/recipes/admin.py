@@ -1,10 +1,16 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from .models import (
     CookingRecipe, ProductComponent, RecipeComponent, 
-    FavoriteRecipe, ShoppingCart, User, UserSubscription
+    FavoriteRecipe, ImageJob, MediaBlob, ShoppingCart, ShoppingListItem,
+    User, UserSubscription
+)
+from .search import update_search_vectors
+from .shopping_list import (
+    add_recipe_to_shopping_lists, remove_recipe_from_shopping_lists
 )
 
 
@@ -42,7 +48,7 @@ class HasSubscriptionsFilter(BaseHasRelatedFilter):
         ('yes', _('Есть подписки')),
         ('no', _('Нет подписок')),
     )
-    related_field = 'following'
+    related_field = 'subscriptions'
 
 
 class HasSubscribersFilter(BaseHasRelatedFilter):
@@ -52,7 +58,7 @@ class HasSubscribersFilter(BaseHasRelatedFilter):
         ('yes', _('Есть подписчики')),
         ('no', _('Нет подписчиков')),
     )
-    related_field = 'followers'
+    related_field = 'authors'
 
 
 @admin.register(User)
@@ -74,30 +80,25 @@ class FoodgramUserAdmin(UserAdmin):
         'subscribers_count', 'subscriptions_count', 'get_avatar'
     )
     
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related(
-            'recipes', 'following', 'followers'
-        )
-    
     @admin.display(description=_('ФИО'), ordering='first_name')
     def get_full_name(self, user):
         """ФИО пользователя"""
         return f"{user.first_name} {user.last_name}".strip()
     
-    @admin.display(description=_('рецептов'), ordering='recipes')
+    @admin.display(description=_('рецептов'), ordering='recipes_count')
     def recipes_count(self, user):
         """Количество рецептов пользователя"""
-        return user.recipes.count()
+        return user.recipes_count
     
-    @admin.display(description=_('Подписчиков'), ordering='followers')
+    @admin.display(description=_('Подписчиков'), ordering='subscribers_count')
     def subscribers_count(self, user):
         """Количество подписчиков"""
-        return user.followers.count()
+        return user.subscribers_count
     
-    @admin.display(description=_('Подписок'), ordering='following')
+    @admin.display(description=_('Подписок'), ordering='subscriptions_count')
     def subscriptions_count(self, user):
         """Количество подписок"""
-        return user.following.count()
+        return user.subscriptions_count
     
     @admin.display(description=_('Аватар'))
     def get_avatar(self, user):
@@ -136,7 +137,7 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
     @admin.display(description=_('Рецептов у автора'))
     def get_subscription_info(self, obj):
         """Дополнительная информация о подписке"""
-        target_recipes = obj.target_user.authored_recipes.count()
+        target_recipes = obj.target_user.recipes_count
         return f"{target_recipes} {_('рецептов')}"
 
 class HasInRecipesFilter(BaseHasRelatedFilter):
@@ -156,10 +157,10 @@ class ProductComponentAdmin(admin.ModelAdmin):
     list_filter = ('unit_type', HasInRecipesFilter)
     ordering = ('title',)
     
-    @admin.display(description=_('Количество рецептов'))
+    @admin.display(description=_('Количество рецептов'), ordering='recipes_count')
     def recipe_count(self, obj):
         """Количество рецептов с этим ингредиентом"""
-        return obj.recipe_components.count()
+        return obj.recipes_count
 
 
 @admin.register(CookingRecipe)
@@ -172,7 +173,14 @@ class CookingRecipeAdmin(admin.ModelAdmin):
     search_fields = ('title', 'creator__email', 'creator__username')
     list_filter = ('creator', 'date_created')
     ordering = ('-date_created',)
-    readonly_fields = ('date_created', 'get_ingredients', 'get_image', 'favorites_count')
+    readonly_fields = (
+        'date_created', 'updated_at', 'get_ingredients', 'get_image',
+        'favorites_count'
+    )
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        update_search_vectors([obj.pk])
     
     @admin.display(description=_('Продукты'))
     def get_ingredients(self, obj):
@@ -191,10 +199,10 @@ class CookingRecipeAdmin(admin.ModelAdmin):
             )
         return _('Нет изображения')
     
-    @admin.display(description=_('В избранном'), ordering='favorite_recipes')
+    @admin.display(description=_('В избранном'), ordering='favorites_count')
     def favorites_count(self, obj):
         """Количество добавлений в избранное"""
-        return obj.favorite_recipes.count()
+        return obj.favorites_count
 
 
 @admin.register(RecipeComponent)
@@ -205,6 +213,31 @@ class RecipeComponentAdmin(admin.ModelAdmin):
     list_filter = ('recipe', 'component')
     ordering = ('recipe',)
 
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        # Продукты рецепта вычитаются из списков покупок до сохранения
+        # и добавляются заново после, в том числе при добавлении строки:
+        # иначе уже учтённые продукты рецепта добавились бы повторно
+        recipe_ids = {obj.recipe_id}
+        if change:
+            recipe_ids.update(
+                RecipeComponent.objects.filter(pk=obj.pk)
+                .values_list('recipe_id', flat=True)
+            )
+        for recipe_id in recipe_ids:
+            remove_recipe_from_shopping_lists(recipe_id)
+        super().save_model(request, obj, form, change)
+        for recipe_id in recipe_ids:
+            add_recipe_to_shopping_lists(recipe_id)
+        update_search_vectors(list(recipe_ids))
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        remove_recipe_from_shopping_lists(obj.recipe_id)
+        super().delete_model(request, obj)
+        add_recipe_to_shopping_lists(obj.recipe_id)
+        update_search_vectors([obj.recipe_id])
+
 
 @admin.register(FavoriteRecipe)
 class FavoriteRecipeAdmin(admin.ModelAdmin):
@@ -239,6 +272,33 @@ class ShoppingCartAdmin(admin.ModelAdmin):
         return obj.recipe.creator.get_full_name() or obj.recipe.creator.username
 
 
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    
+    list_display = ('user', 'component', 'quantity', 'recipes_count')
+    search_fields = ('user__email', 'user__username', 'component__title')
+    readonly_fields = ('user', 'component', 'quantity', 'recipes_count')
+    ordering = ('user', 'component')
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    
+    list_display = ('model_label', 'object_id', 'source', 'attempts', 'date_created')
+    list_filter = ('model_label',)
+    readonly_fields = (
+        'model_label', 'object_id', 'source', 'attempts', 'error', 'date_created'
+    )
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    
+    list_display = ('name', 'references', 'date_created')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'references', 'date_created')
+
+
 class CustomAdminSite(admin.AdminSite):
     def index(self, request, extra_context=None):
         extra_context = extra_context or {}
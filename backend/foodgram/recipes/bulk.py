@@ -0,0 +1,53 @@
+import csv
+import io
+
+from django.db import connection
+from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+
+def _copy_rows(model, fields, rows):
+    """Загружает строки через COPY во временную таблицу и переносит их
+    в таблицу модели, пропуская нарушения уникальности"""
+    table = model._meta.db_table
+    columns = ', '.join(model._meta.get_field(field).column for field in fields)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS bulk_{table} '
+            f'(LIKE {table} INCLUDING DEFAULTS INCLUDING IDENTITY)'
+        )
+        cursor.execute(f'TRUNCATE bulk_{table}')
+        copy_sql = f'COPY bulk_{table} ({columns}) FROM STDIN WITH (FORMAT csv)'
+        if is_psycopg3:
+            with cursor.cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            cursor.cursor.copy_expert(copy_sql, buffer)
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM bulk_{table} '
+            'ON CONFLICT DO NOTHING'
+        )
+        return cursor.rowcount
+
+
+def insert_rows(model, fields, rows):
+    """Вставляет пачку строк (кортежей значений fields) без сигналов.
+
+    В PostgreSQL используется COPY, в остальных СУБД — bulk_create.
+    Строки, нарушающие ограничения уникальности, пропускаются.
+    Возвращает число вставленных строк.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    if connection.vendor == 'postgresql':
+        return _copy_rows(model, fields, rows)
+    attnames = [model._meta.get_field(field).attname for field in fields]
+    before = model.objects.count()
+    model.objects.bulk_create(
+        (model(**dict(zip(attnames, row))) for row in rows),
+        batch_size=1000, ignore_conflicts=True
+    )
+    return model.objects.count() - before
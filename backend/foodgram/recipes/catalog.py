@@ -0,0 +1,83 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ProductComponent
+
+CATALOG_VERSION_KEY = 'ingredient_catalog_version'
+
+
+def get_catalog_version():
+    """Текущая версия справочника продуктов"""
+    return cache.get_or_set(CATALOG_VERSION_KEY, time.time_ns, timeout=None)
+
+
+def bump_catalog_version():
+    """Помечает справочник продуктов изменённым"""
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+class IngredientCatalog:
+    """Индекс продуктов для поиска по префиксу названия"""
+
+    def __init__(self, components):
+        self._components = sorted(
+            components, key=lambda component: component.title.casefold()
+        )
+        self._keys = [component.title.casefold() for component in self._components]
+
+    def __len__(self):
+        return len(self._components)
+
+    def search(self, prefix='', limit=None):
+        """Продукты, название которых начинается с prefix.
+
+        Совпадения упорядочены по числу рецептов с продуктом,
+        без prefix возвращается весь справочник по алфавиту.
+        """
+        if not prefix:
+            return self._components[:limit]
+        prefix = prefix.casefold()
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + '\U0010ffff', lo=start)
+        matches = sorted(
+            self._components[start:end],
+            key=lambda component: -component.recipes_count
+        )
+        return matches[:limit]
+
+
+_lock = threading.Lock()
+_catalog = None
+_catalog_version = None
+_catalog_built_at = 0.0
+
+
+def _is_fresh(version):
+    return (
+        _catalog is not None
+        and _catalog_version == version
+        and time.monotonic() - _catalog_built_at < settings.INGREDIENT_CATALOG_TTL
+    )
+
+
+def get_ingredient_catalog():
+    """Индекс продуктов текущего процесса, перестраиваемый при изменениях.
+
+    Индекс перестраивается при смене версии справочника и не реже
+    INGREDIENT_CATALOG_TTL секунд, чтобы обновлять рейтинг продуктов.
+    """
+    global _catalog, _catalog_version, _catalog_built_at
+
+    version = get_catalog_version()
+    if _is_fresh(version):
+        return _catalog
+    with _lock:
+        if not _is_fresh(version):
+            _catalog = IngredientCatalog(ProductComponent.objects.order_by())
+            _catalog_version = version
+            _catalog_built_at = time.monotonic()
+    return _catalog
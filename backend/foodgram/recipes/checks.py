@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+LOCAL_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Версии данных в кеше процесса не видны другим процессам"""
+    if settings.CACHES['default']['BACKEND'] != LOCAL_CACHE_BACKEND or settings.DEBUG:
+        return []
+    return [Warning(
+        'Кеш по умолчанию хранится в памяти процесса.',
+        hint=(
+            'Изменения из других воркеров, обработчика изображений и '
+            'management-команд не сбросят закешированные ответы и ETag. '
+            'Укажите общий кеш в CACHE_BACKEND и CACHE_LOCATION.'
+        ),
+        id='recipes.W001',
+    )]
+
+
+@register()
+def check_replicas_cache(app_configs, **kwargs):
+    """Отметки о записи клиента должны быть видны всем процессам, иначе
+    после записи в одном воркере клиент читает отстающую реплику в другом"""
+    if not settings.DB_REPLICAS or (
+        settings.CACHES['default']['BACKEND'] != LOCAL_CACHE_BACKEND
+    ):
+        return []
+    return [Error(
+        'Реплики БД подключены, а кеш хранится в памяти процесса.',
+        hint='Укажите общий кеш в CACHE_BACKEND и CACHE_LOCATION.',
+        id='recipes.E001',
+    )]
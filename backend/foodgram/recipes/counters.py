@@ -0,0 +1,70 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import (
+    CookingRecipe, FavoriteRecipe, ProductComponent, RecipeComponent, User,
+    UserSubscription
+)
+
+# Счётчик: модель и поле счётчика, модель связи и её внешний ключ
+COUNTERS = (
+    (User, 'recipes_count', CookingRecipe, 'creator'),
+    (User, 'subscribers_count', UserSubscription, 'target_user'),
+    (User, 'subscriptions_count', UserSubscription, 'subscriber'),
+    (CookingRecipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (ProductComponent, 'recipes_count', RecipeComponent, 'component'),
+)
+
+
+def change_counter(model, field, pks, delta):
+    """Атомарно изменяет счётчик field у объектов pks на delta.
+
+    Счётчик не опускается ниже нуля: если он разошёлся со связями,
+    удаление связи не должно нарушать ограничение поля.
+    """
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def increment(model, field, *pks):
+    change_counter(model, field, pks, 1)
+
+
+def decrement(model, field, *pks):
+    change_counter(model, field, pks, -1)
+
+
+def count_related(related_model, foreign_key):
+    return Coalesce(
+        Subquery(
+            related_model.objects
+            .filter(**{foreign_key: OuterRef('pk')})
+            .order_by()
+            .values(foreign_key)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0)
+    )
+
+
+def reconcile_counters(dry_run=False):
+    """Сверяет счётчики с фактическим числом связей и исправляет расхождения.
+
+    Возвращает число расходящихся объектов для каждого счётчика.
+    """
+    drift = {}
+    for model, field, related_model, foreign_key in COUNTERS:
+        actual = count_related(related_model, foreign_key)
+        drifted = (
+            model.objects
+            .annotate(actual_count=actual)
+            .exclude(**{field: F('actual_count')})
+        )
+        label = f'{model._meta.model_name}.{field}'
+        drift[label] = (
+            drifted.count() if dry_run
+            else drifted.update(**{field: actual})
+        )
+    return drift
@@ -0,0 +1,220 @@
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Exists, OuterRef
+
+from .models import CookingRecipe, FeedEntry, User, UserSubscription
+
+# Записи ленты для подписчиков авторов, у которых подписчиков
+# не больше FEED_FANOUT_MAX_SUBSCRIBERS
+FAN_OUT_SQL = f"""
+INSERT INTO {FeedEntry._meta.db_table}
+    (subscriber_id, recipe_id, author_id, date_created)
+SELECT subscription.subscriber_id, recipe.id, recipe.creator_id, recipe.date_created
+FROM {UserSubscription._meta.db_table} AS subscription
+JOIN {CookingRecipe._meta.db_table} AS recipe
+    ON recipe.creator_id = subscription.target_user_id
+JOIN {User._meta.db_table} AS author ON author.id = recipe.creator_id
+WHERE author.subscribers_count <= %s AND {{condition}}
+ON CONFLICT (subscriber_id, recipe_id) DO NOTHING
+"""
+LATEST_RECIPES_CONDITION = f"""recipe.id IN (
+    SELECT id FROM {CookingRecipe._meta.db_table}
+    WHERE creator_id = %s ORDER BY date_created DESC, id DESC LIMIT %s
+)"""
+
+
+def fan_out(condition, params):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            FAN_OUT_SQL.format(condition=condition),
+            [settings.FEED_FANOUT_MAX_SUBSCRIBERS, *params]
+        )
+
+
+def add_recipe_to_feeds(recipe_id):
+    """Добавляет новый рецепт в ленты подписчиков автора"""
+    fan_out('recipe.id = %s', [recipe_id])
+
+
+def add_author_to_feeds(author_id, subscriber_id=None):
+    """Добавляет последние FEED_BACKFILL_RECIPES рецептов автора в ленты
+    его подписчиков или только subscriber_id, если он указан"""
+    condition = LATEST_RECIPES_CONDITION
+    params = [author_id, settings.FEED_BACKFILL_RECIPES]
+    if subscriber_id is not None:
+        condition += ' AND subscription.subscriber_id = %s'
+        params.append(subscriber_id)
+    fan_out(condition, params)
+
+
+def remove_author_from_feeds(author_id, subscriber_id=None):
+    """Удаляет рецепты автора из лент подписчиков или только subscriber_id"""
+    entries = FeedEntry.objects.filter(author_id=author_id)
+    if subscriber_id is not None:
+        entries = entries.filter(subscriber_id=subscriber_id)
+    entries.delete()
+
+
+def is_fanned_out(subscribers_count):
+    """Рецепты автора записываются в ленты подписчиков при публикации"""
+    return subscribers_count <= settings.FEED_FANOUT_MAX_SUBSCRIBERS
+
+
+def get_subscribers_count(author_id):
+    return (
+        User.objects.filter(pk=author_id)
+        .values_list('subscribers_count', flat=True)
+        .first()
+    )
+
+
+def update_feeds_on_subscribe(subscription):
+    """Заполняет ленту нового подписчика.
+
+    Когда у автора становится больше FEED_FANOUT_MAX_SUBSCRIBERS
+    подписчиков, его рецепты убираются из лент и дальше читаются
+    при выдаче ленты. Порог определяется сравнением числа подписчиков
+    до и после подписки, а не точным значением.
+    """
+    subscribers_count = get_subscribers_count(subscription.target_user_id)
+    if subscribers_count is None:
+        return
+    if is_fanned_out(subscribers_count):
+        add_author_to_feeds(
+            subscription.target_user_id, subscription.subscriber_id
+        )
+    elif is_fanned_out(subscribers_count - 1):
+        remove_author_from_feeds(subscription.target_user_id)
+
+
+def update_feeds_on_unsubscribe(subscription):
+    """Убирает автора из ленты бывшего подписчика.
+
+    Когда число подписчиков автора опускается до
+    FEED_FANOUT_MAX_SUBSCRIBERS, его рецепты снова записываются в ленты.
+    Порог определяется так же, как при подписке.
+    """
+    remove_author_from_feeds(
+        subscription.target_user_id, subscription.subscriber_id
+    )
+    subscribers_count = get_subscribers_count(subscription.target_user_id)
+    if (
+        subscribers_count is not None and is_fanned_out(subscribers_count)
+        and not is_fanned_out(subscribers_count + 1)
+    ):
+        add_author_to_feeds(subscription.target_user_id)
+
+
+def reconcile_fan_out(dry_run=False):
+    """Приводит ленты в соответствие с числом подписчиков авторов.
+
+    Нужна после исправления счётчиков: счётчик мог перескочить порог
+    FEED_FANOUT_MAX_SUBSCRIBERS, минуя обработку подписок. Рецепты
+    авторов сверх порога убираются из лент, а авторам не выше порога
+    без записей в лентах они добавляются. Возвращает число таких авторов.
+    """
+    popular = list(
+        FeedEntry.objects
+        .filter(author_id__in=User.objects.filter(
+            subscribers_count__gt=settings.FEED_FANOUT_MAX_SUBSCRIBERS
+        ).values('pk'))
+        .values_list('author_id', flat=True)
+        .distinct()
+    )
+    missing = list(
+        User.objects
+        .filter(
+            subscribers_count__gt=0,
+            subscribers_count__lte=settings.FEED_FANOUT_MAX_SUBSCRIBERS,
+            recipes_count__gt=0
+        )
+        .exclude(Exists(FeedEntry.objects.filter(author=OuterRef('pk'))))
+        .values_list('pk', flat=True)
+    )
+    if not dry_run:
+        FeedEntry.objects.filter(author_id__in=popular).delete()
+        for author_id in missing:
+            add_author_to_feeds(author_id)
+    return len(popular) + len(missing)
+
+
+def calculate_feeds():
+    """Записи лент, посчитанные заново по подпискам: (подписчик, рецепт,
+    автор, дата) для последних FEED_BACKFILL_RECIPES рецептов авторов"""
+    subscriptions = (
+        UserSubscription.objects
+        .filter(
+            target_user__subscribers_count__lte=(
+                settings.FEED_FANOUT_MAX_SUBSCRIBERS
+            )
+        )
+        .values_list('subscriber_id', 'target_user_id')
+        .order_by('target_user_id')
+    )
+    latest = {}
+    for subscriber_id, author_id in subscriptions.iterator():
+        if author_id not in latest:
+            latest[author_id] = list(
+                CookingRecipe.objects.filter(creator_id=author_id)
+                .order_by('-date_created', '-id')
+                .values_list('id', 'date_created')
+                [:settings.FEED_BACKFILL_RECIPES]
+            )
+        for recipe_id, date_created in latest[author_id]:
+            yield subscriber_id, recipe_id, author_id, date_created
+
+
+class Feed:
+    """Лента подписчика: id рецептов от новых к старым.
+
+    Рецепты авторов с числом подписчиков до FEED_FANOUT_MAX_SUBSCRIBERS
+    записаны в ленту при публикации, и страница читается диапазоном
+    индекса feed_entry_timeline_idx. Рецепты остальных авторов
+    читаются при выдаче по индексу recipe_creator_date_idx
+    и объединяются с записями ленты одним запросом.
+    Поддерживает count() и срезы, как queryset для пагинации.
+    """
+
+    def __init__(self, user):
+        self.entries = (
+            FeedEntry.objects.filter(subscriber=user)
+            .values_list('recipe_id', 'date_created')
+        )
+        self.popular_authors = list(
+            UserSubscription.objects
+            .filter(
+                subscriber=user,
+                target_user__subscribers_count__gt=(
+                    settings.FEED_FANOUT_MAX_SUBSCRIBERS
+                )
+            )
+            .values_list('target_user_id', flat=True)
+        )
+        self.published = (
+            CookingRecipe.objects.filter(creator__in=self.popular_authors)
+            .values_list('id', 'date_created')
+        )
+        if self.popular_authors:
+            # Записи, оставшиеся от времени, когда подписчиков было меньше
+            self.entries = self.entries.exclude(author__in=self.popular_authors)
+
+    def count(self):
+        count = self.entries.count()
+        if self.popular_authors:
+            count += self.published.count()
+        return count
+
+    def __getitem__(self, page):
+        ordering = ('-date_created', '-recipe_id')
+        if not self.popular_authors:
+            rows = self.entries.order_by(*ordering)[page]
+        else:
+            entries = self.entries.order_by()
+            published = self.published.order_by()
+            if connections[entries.db].features.supports_slicing_ordering_in_compound:
+                # Каждая часть читает по индексу не больше строк, чем
+                # нужно до конца страницы
+                entries = entries.order_by(*ordering)[:page.stop]
+                published = published.order_by('-date_created', '-id')[:page.stop]
+            rows = entries.union(published, all=True).order_by(*ordering)[page]
+        return [recipe_id for recipe_id, _date_created in rows]
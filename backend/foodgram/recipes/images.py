@@ -0,0 +1,151 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import CookingRecipe, ImageJob, User
+from .versions import bump_author_version, bump_recipe_version
+
+DERIVATIVES_DIR = 'derivatives'
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+# Поля с изображениями, для которых строятся уменьшенные копии,
+# и функции, сбрасывающие закешированные представления объекта
+IMAGE_FIELDS = {
+    CookingRecipe: ('picture', bump_recipe_version),
+    User: ('avatar', bump_author_version),
+}
+
+
+def get_image_field(model):
+    return IMAGE_FIELDS[model][0]
+
+
+def get_ready_derivatives(instance, field_name):
+    """Готовые копии текущего изображения: {ширина: {формат: путь}}"""
+    derivatives = getattr(instance, f'{field_name}_derivatives') or {}
+    if derivatives.get('source') != getattr(instance, field_name).name:
+        return {}
+    return derivatives.get('sizes', {})
+
+
+def enqueue_image(instance):
+    """Ставит изображение объекта в очередь, если для него нет копий"""
+    field_name = get_image_field(type(instance))
+    image = getattr(instance, field_name)
+    if not image or get_ready_derivatives(instance, field_name):
+        return
+    lookup = {'model_label': instance._meta.label_lower, 'object_id': instance.pk}
+    if not ImageJob.objects.filter(**lookup).exclude(source=image.name).update(
+        source=image.name, attempts=0, error=''
+    ):
+        ImageJob.objects.get_or_create(**lookup, defaults={'source': image.name})
+
+
+def get_derivative_name(source, width, extension):
+    root, _ = os.path.splitext(source)
+    return f'{DERIVATIVES_DIR}/{root}/{width}.{extension}'
+
+
+def _prepare(image, image_format):
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+    if image_format == 'JPEG' or not has_alpha:
+        return image.convert('RGB')
+    return image.convert('RGBA')
+
+
+def render_derivatives(source):
+    """Сохраняет уменьшенные копии изображения во всех размерах и форматах.
+
+    Изображения не увеличиваются: если оригинал уже ширины, копия
+    сохраняет его размер. JPEG декодируется сразу в уменьшенном виде.
+    """
+    widths = sorted(settings.IMAGE_DERIVATIVE_WIDTHS)
+    sizes = {}
+    with default_storage.open(source) as file, Image.open(file) as image:
+        image.draft('RGB', (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(image)
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = (
+                image.resize((width, height), Image.LANCZOS)
+                if image.width > width else image
+            )
+            sizes[str(width)] = {}
+            for key, (image_format, extension) in DERIVATIVE_FORMATS.items():
+                buffer = io.BytesIO()
+                _prepare(resized, image_format).save(
+                    buffer, image_format,
+                    quality=settings.IMAGE_DERIVATIVE_QUALITY
+                )
+                sizes[str(width)][key] = default_storage.save(
+                    get_derivative_name(source, width, extension),
+                    ContentFile(buffer.getvalue())
+                )
+    return sizes
+
+
+def delete_derivatives(derivatives):
+    for formats in (derivatives or {}).get('sizes', {}).values():
+        for name in formats.values():
+            default_storage.delete(name)
+
+
+def process_job(job):
+    """Строит копии изображения из задачи и сохраняет их пути в объекте"""
+    model = next(
+        model for model in IMAGE_FIELDS
+        if model._meta.label_lower == job.model_label
+    )
+    field_name, invalidate = IMAGE_FIELDS[model]
+    instance = model.objects.filter(pk=job.object_id).only(
+        'pk', field_name, f'{field_name}_derivatives'
+    ).first()
+    if instance is None or getattr(instance, field_name).name != job.source:
+        return
+    previous = getattr(instance, f'{field_name}_derivatives')
+    sizes = render_derivatives(job.source)
+    values = {f'{field_name}_derivatives': {'source': job.source, 'sizes': sizes}}
+    # Обработчик работает в отдельном процессе: время изменения в БД
+    # сменит валидаторы ответа, даже если кеш у процессов не общий
+    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        values['updated_at'] = timezone.now()
+    model.objects.filter(pk=job.object_id, **{field_name: job.source}).update(**values)
+    transaction.on_commit(lambda: delete_derivatives(previous))
+    invalidate(job.object_id)
+
+
+def process_jobs(batch_size):
+    """Обрабатывает пакет задач очереди, возвращает число обработанных.
+
+    Задачи блокируются с SKIP LOCKED, поэтому несколько обработчиков
+    не берут одну и ту же задачу. Неудачные задачи остаются в очереди
+    до IMAGE_JOB_MAX_ATTEMPTS попыток.
+    """
+    with transaction.atomic():
+        jobs = list(
+            ImageJob.objects
+            .filter(attempts__lt=settings.IMAGE_JOB_MAX_ATTEMPTS)
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        for job in jobs:
+            try:
+                with transaction.atomic():
+                    process_job(job)
+            except Exception as error:
+                job.attempts += 1
+                job.error = repr(error)
+                job.save(update_fields=('attempts', 'error'))
+            else:
+                ImageJob.objects.filter(pk=job.pk, source=job.source).delete()
+    return len(jobs)
@@ -0,0 +1,515 @@
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from threading import local
+from urllib.parse import quote, urlsplit
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authtoken.models import Token
+from recipes.models import (
+    CookingRecipe, ProductComponent, ShoppingCart, User, UserSubscription
+)
+
+DEFAULT_POSTMAN_PATH = (
+    Path(settings.PROJECT_DIR) / 'postman_collection'
+    / 'foodgram.postman_collection.json'
+)
+DEFAULT_OUTPUT_DIR = Path(settings.PROJECT_DIR) / 'benchmarks'
+SAFE_METHODS = ('GET', 'HEAD')
+PERCENTILES = (50, 95, 99)
+# Сколько кандидатов читать из БД при выборе пользователей и рецептов
+SAMPLE_POOL = 1000
+POSTMAN_VARIABLE_RE = re.compile(r'{{(\w+)}}')
+SERVER_START_TIMEOUT = 30
+SERVER_TIMING_QUERIES_RE = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def percentile(values, rank):
+    """Значение методом ближайшего ранга для отсортированного списка"""
+    return values[max(0, math.ceil(len(values) * rank / 100) - 1)]
+
+
+def get_label(path):
+    """Имя маршрута (recipes-list, users-subscriptions, …) для пути запроса"""
+    path = urlsplit(path).path
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return path
+
+
+def get_allowed_host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def walk_postman(items, auth=None):
+    """Запросы коллекции Postman: (метод, адрес, нужна ли авторизация).
+
+    Авторизация, не заданная у запроса, наследуется от папки.
+    """
+    for item in items:
+        item_auth = item.get('auth') or auth
+        if 'item' in item:
+            yield from walk_postman(item['item'], item_auth)
+            continue
+        request = item['request']
+        url = request['url']
+        if isinstance(url, dict):
+            url = url['raw']
+        auth_type = (request.get('auth') or item_auth or {}).get('type')
+        yield request['method'], url, auth_type not in (None, 'noauth')
+
+
+def read_replay(path):
+    """Запросы из JSON Lines файла вида {"method", "path", "auth"}.
+
+    Строки без пути (например, не относящиеся к трафику) пропускаются.
+    """
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            path = record.get('path') or record.get('url')
+            if isinstance(path, str) and path.startswith(('/', 'http')):
+                yield (
+                    record.get('method', 'GET').upper(),
+                    urlsplit(path)._replace(scheme='', netloc='').geturl(),
+                    bool(record.get('auth'))
+                )
+
+
+class ClientRunner:
+    """Запросы через тестовый клиент Django в том же процессе.
+
+    Считает SQL-запросы, выполненные при обработке каждого запроса.
+    """
+
+    concurrency = 1
+
+    def __init__(self):
+        self.client = Client(
+            raise_request_exception=False, headers={'host': get_allowed_host()}
+        )
+
+    def send(self, method, path, token):
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        headers = {'authorization': f'Token {token}'} if token else {}
+        with connection.execute_wrapper(count_queries):
+            response = self.client.generic(method, path, headers=headers)
+            if response.streaming:
+                for _chunk in response.streaming_content:
+                    pass
+        return response.status_code, queries
+
+
+class HttpRunner:
+    """Запросы по HTTP к запущенному серверу, по соединению на поток.
+
+    Число SQL-запросов берётся из заголовка Server-Timing, если на сервере
+    включено PERF_INSTRUMENTATION.
+    """
+
+    def __init__(self, url, concurrency):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.concurrency = concurrency
+        self.connections = local()
+
+    def send(self, method, path, token):
+        if not hasattr(self.connections, 'http'):
+            self.connections.http = http.client.HTTPConnection(
+                self.host, self.port, timeout=60
+            )
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        try:
+            self.connections.http.request(method, self.prefix + path, headers=headers)
+            response = self.connections.http.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.connections.http.close()
+            return 0, None
+        queries = SERVER_TIMING_QUERIES_RE.search(
+            response.getheader('Server-Timing', '')
+        )
+        return response.status, int(queries[1]) if queries else None
+
+
+@contextmanager
+def gunicorn_server(bind, workers, server_mode='wsgi'):
+    """Запускает gunicorn с текущими настройками и ждёт, пока он примет соединение.
+
+    Приложение и класс воркеров выбирает gunicorn.conf.py по SERVER_MODE.
+    """
+    host, port = bind.rsplit(':', 1)
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', bind, '--workers', str(workers), '--log-level', 'warning'
+        ],
+        cwd=settings.BASE_DIR,
+        env={**os.environ, 'SERVER_MODE': server_mode}
+    )
+    try:
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            if process.poll() is not None:
+                raise CommandError(_('gunicorn завершился при запуске'))
+            try:
+                socket.create_connection((host, int(port)), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise CommandError(_('gunicorn не запустился за {} с').format(
+                        SERVER_START_TIMEOUT
+                    ))
+                time.sleep(0.2)
+        yield f'http://{bind}'
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+class Command(BaseCommand):
+    help = _(
+        'Измеряет задержки, пропускную способность и число SQL-запросов '
+        'эндпоинтов API, воспроизводя записанные и сгенерированные запросы'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', choices=('client', 'gunicorn', 'uvicorn'), default='client',
+            help=_(
+                'Тестовый клиент Django в процессе, локальный gunicorn (WSGI) '
+                'или gunicorn с воркерами uvicorn (ASGI)'
+            )
+        )
+        parser.add_argument(
+            '--url',
+            help=_('Адрес уже запущенного сервера вместо запуска gunicorn')
+        )
+        parser.add_argument('--bind', default='127.0.0.1:8765',
+                            help=_('Адрес, на котором запускается gunicorn'))
+        parser.add_argument('--workers', type=int, default=2,
+                            help=_('Число процессов gunicorn'))
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help=_('Число параллельных соединений при работе по HTTP'))
+        parser.add_argument('--requests', type=int, default=200,
+                            help=_('Число сгенерированных запросов к каждому эндпоинту'))
+        parser.add_argument('--warmup', type=int, default=20,
+                            help=_('Число неучитываемых запросов перед замером'))
+        parser.add_argument('--users', type=int, default=20,
+                            help=_('Число пользователей, от имени которых идут запросы'))
+        parser.add_argument('--postman',
+                            help=_('Коллекция Postman для воспроизведения (по умолчанию '
+                                   'postman_collection/, если она есть; "" — не использовать)'))
+        parser.add_argument('--replay',
+                            help=_('JSON Lines файл с записанными запросами'))
+        parser.add_argument('--no-generated', action='store_true',
+                            help=_('Не генерировать запросы, только воспроизводить'))
+        parser.add_argument('--seed', type=int, default=0,
+                            help=_('Начальное значение генератора случайных чисел'))
+        parser.add_argument('--output',
+                            help=_('Файл для результатов (по умолчанию benchmarks/<цель>-<время>.json)'))
+        parser.add_argument('--compare',
+                            help=_('Файл результатов прошлого запуска для сравнения'))
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.tokens = {}
+        self.load_samples(options['users'])
+        requests = defaultdict(list)
+        sources = []
+        if not options['no_generated']:
+            sources.append(self.generate_requests(options['requests']))
+        postman = options['postman']
+        # В контейнере backend коллекции рядом с кодом нет
+        if postman is None and DEFAULT_POSTMAN_PATH.exists():
+            postman = str(DEFAULT_POSTMAN_PATH)
+        if postman:
+            sources.append(self.read_postman(postman, options['requests']))
+        if options['replay']:
+            sources.append(self.repeat(
+                list(read_replay(options['replay'])), options['requests']
+            ))
+        for source in sources:
+            for method, path, user_id in source:
+                if method in SAFE_METHODS:
+                    requests[get_label(path)].append((method, path, user_id))
+        if not requests:
+            raise CommandError(_('Нет запросов для замера'))
+        requests = {
+            label: [(method, path, self.get_token(user_id)) for method, path, user_id in items]
+            for label, items in requests.items()
+        }
+
+        if options['target'] == 'client':
+            results = self.run(ClientRunner(), requests, options['warmup'])
+        elif options['url']:
+            results = self.run(
+                HttpRunner(options['url'], options['concurrency']),
+                requests, options['warmup']
+            )
+        else:
+            server_mode = 'asgi' if options['target'] == 'uvicorn' else 'wsgi'
+            with gunicorn_server(
+                options['bind'], options['workers'], server_mode
+            ) as url:
+                results = self.run(
+                    HttpRunner(url, options['concurrency']), requests, options['warmup']
+                )
+
+        report = {
+            'target': options['target'],
+            'url': options['url'],
+            'started_at': timezone.now().isoformat(),
+            'git_commit': self.get_git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'connections': {
+                'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                'pool': connection.settings_dict['OPTIONS'].get('pool'),
+            },
+            'options': {
+                key: options[key] for key in (
+                    'workers', 'concurrency', 'requests', 'warmup', 'users', 'seed'
+                )
+            },
+            'data': {
+                'users': User.objects.count(),
+                'recipes': CookingRecipe.objects.count(),
+                'ingredients': ProductComponent.objects.count(),
+            },
+            'endpoints': results,
+        }
+        self.print_report(results)
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                self.print_comparison(json.load(file)['endpoints'], results)
+        output = Path(options['output'] or DEFAULT_OUTPUT_DIR / '{}-{}.json'.format(
+            options['target'], timezone.now().strftime('%Y%m%d-%H%M%S')
+        ))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(_('Результаты сохранены в {}').format(output)))
+
+    def load_samples(self, users):
+        """Пользователи, рецепты и продукты, на которых строятся запросы"""
+        def sample(queryset, size):
+            pool = list(queryset[:SAMPLE_POOL])
+            return self.random.sample(pool, min(size, len(pool)))
+
+        self.readers = sample(
+            UserSubscription.objects.values_list('subscriber_id', flat=True)
+            .order_by('subscriber_id').distinct(), users
+        )
+        self.buyers = sample(
+            ShoppingCart.objects.values_list('user_id', flat=True)
+            .order_by('user_id').distinct(), users
+        )
+        self.authors = sample(
+            CookingRecipe.objects.values_list('creator_id', flat=True)
+            .order_by('creator_id').distinct(), users
+        )
+        self.users = self.readers or self.buyers or self.authors or sample(
+            User.objects.values_list('pk', flat=True).order_by('pk'), users
+        )
+        self.recipe_ids = sample(
+            CookingRecipe.objects.values_list('pk', flat=True), SAMPLE_POOL
+        )
+        self.recipes_count = CookingRecipe.objects.count()
+        self.ingredients = list(
+            ProductComponent.objects.values_list('pk', 'title')[:SAMPLE_POOL]
+        )
+
+    def get_token(self, user_id):
+        if user_id is None:
+            return None
+        if user_id not in self.tokens:
+            self.tokens[user_id] = Token.objects.get_or_create(user_id=user_id)[0].key
+        return self.tokens[user_id]
+
+    def generate_requests(self, count):
+        """Запросы к основным эндпоинтам с параметрами, как у живого трафика"""
+        pages = max(1, min(50, math.ceil(self.recipes_count / 6)))
+        for index in range(count):
+            user = self.random.choice(self.users) if self.users else None
+            variant = index % 4
+            if variant == 0 or user is None:
+                offset = self.random.randrange(pages) * 6
+                yield 'GET', f'/api/recipes/?limit=6&offset={offset}', None
+            elif variant == 1:
+                yield 'GET', '/api/recipes/?limit=6', user
+            elif variant == 2 and self.authors:
+                yield 'GET', f'/api/recipes/?creator={self.random.choice(self.authors)}', user
+            else:
+                yield 'GET', '/api/recipes/?is_favorited=1', user
+        for _index in range(count if self.ingredients else 0):
+            title = self.random.choice(self.ingredients)[1]
+            prefix = title[:self.random.randint(1, 3)]
+            yield 'GET', f'/api/ingredients/?name={quote(prefix)}', None
+        for _index in range(count if self.readers else 0):
+            yield 'GET', '/api/users/subscriptions/?recipes_limit=3', self.random.choice(
+                self.readers
+            )
+        for _index in range(count if self.buyers else 0):
+            yield 'GET', '/api/recipes/download-shopping-list/', self.random.choice(
+                self.buyers
+            )
+
+    def read_postman(self, path, count):
+        """GET-запросы коллекции Postman с переменными, взятыми из БД.
+
+        Запросы с переменными, которые нечем заполнить, пропускаются.
+        """
+        variables = {'baseUrl': ''}
+        if self.users:
+            variables['userId'] = self.random.choice(self.authors or self.users)
+        if len(self.recipe_ids) > 1:
+            variables['firstRecipeId'], variables['secondRecipeId'] = (
+                self.recipe_ids[:2]
+            )
+        if self.ingredients:
+            variables['firstIndredientId'] = self.ingredients[0][0]
+            variables['ingredientNameFirstLatter'] = quote(self.ingredients[0][1][:1])
+        if not os.path.exists(path):
+            raise CommandError(_('Коллекция Postman {} не найдена').format(path))
+        with open(path, encoding='utf-8') as file:
+            collection = json.load(file)
+        requests = []
+        for method, url, auth in walk_postman(collection['item']):
+            names = POSTMAN_VARIABLE_RE.findall(url)
+            if not all(name in variables for name in names) or auth and not self.users:
+                continue
+            requests.append((
+                method,
+                POSTMAN_VARIABLE_RE.sub(lambda match: str(variables[match[1]]), url),
+                self.random.choice(self.users) if auth else None
+            ))
+        return self.repeat(requests, count)
+
+    def repeat(self, requests, count):
+        """Повторяет записанную последовательность примерно до count запросов"""
+        for _round in range(max(1, count // max(1, len(requests)))):
+            for method, path, user in requests:
+                if user is True:
+                    user = self.random.choice(self.users) if self.users else None
+                yield method, path, user or None
+
+    def run(self, runner, requests, warmup):
+        results = {}
+        for label, items in requests.items():
+            self.stdout.write(_('Замер {}: {} запросов').format(label, len(items)))
+            for index in range(min(warmup, len(items))):
+                runner.send(*items[index])
+            samples = []
+
+            def measure(request):
+                started = time.perf_counter()
+                status, queries = runner.send(*request)
+                samples.append((time.perf_counter() - started, status, queries))
+
+            started = time.perf_counter()
+            if runner.concurrency == 1:
+                # Тестовый клиент работает в текущем потоке и его соединении с БД
+                for request in items:
+                    measure(request)
+            else:
+                with ThreadPoolExecutor(runner.concurrency) as executor:
+                    list(executor.map(measure, items))
+            results[label] = self.summarize(samples, time.perf_counter() - started)
+        return results
+
+    def summarize(self, samples, elapsed):
+        latencies = sorted(duration * 1000 for duration, _status, _queries in samples)
+        queries = [count for _duration, _status, count in samples if count is not None]
+        statuses = Counter(status for _duration, status, _queries in samples)
+        summary = {
+            'requests': len(samples),
+            'errors': sum(
+                count for status, count in statuses.items() if not 200 <= status < 400
+            ),
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'rps': round(len(samples) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+        }
+        for rank in PERCENTILES:
+            summary[f'p{rank}_ms'] = round(percentile(latencies, rank), 3)
+        summary['queries_mean'] = (
+            round(sum(queries) / len(queries), 2) if queries else None
+        )
+        summary['queries_max'] = max(queries) if queries else None
+        return summary
+
+    def print_report(self, results):
+        self.stdout.write(
+            f'{"endpoint":<40} {"n":>6} {"err":>5} {"p50":>9} {"p95":>9} '
+            f'{"p99":>9} {"rps":>9} {"sql":>6}'
+        )
+        for label, summary in results.items():
+            queries = summary['queries_mean']
+            self.stdout.write(
+                f'{label:<40} {summary["requests"]:>6} {summary["errors"]:>5} '
+                f'{summary["p50_ms"]:>9.2f} {summary["p95_ms"]:>9.2f} '
+                f'{summary["p99_ms"]:>9.2f} {summary["rps"]:>9.1f} '
+                f'{"-" if queries is None else queries:>6}'
+            )
+
+    def print_comparison(self, previous, results):
+        """Изменение задержек и пропускной способности относительно прошлого запуска"""
+        self.stdout.write(_('Сравнение с прошлым запуском:'))
+        for label, summary in results.items():
+            if label not in previous:
+                continue
+            changes = ', '.join(
+                '{} {} → {} ({:+.1f}%)'.format(
+                    key, previous[label][key], summary[key],
+                    (summary[key] - previous[label][key]) / previous[label][key] * 100
+                )
+                for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps')
+                if previous[label].get(key)
+            )
+            self.stdout.write(f'{label}: {changes}')
+
+    def get_git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
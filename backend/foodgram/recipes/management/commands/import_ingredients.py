@@ -1,43 +1,213 @@
-from django.core.management.base import BaseCommand
-from django.utils.translation import gettext_lazy as _
-from recipes.models import ProductComponent
+import csv
 import json
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.translation import gettext_lazy as _
+from recipes.catalog import bump_catalog_version
+from recipes.models import ProductComponent, RecipeComponent
+
+KEYS_TABLE = 'import_ingredient_keys'
+READ_SIZE = 64 * 1024
+
+
+def read_json(file):
+    """Поочерёдно разбирает объекты JSON-массива, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    expected = 'start'
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise ValueError(_('файл закончился до конца массива'))
+            buffer, position = chunk, 0
+            continue
+        char = buffer[position]
+        if expected == 'start':
+            if char != '[':
+                raise ValueError(_('ожидался массив JSON'))
+            position += 1
+            expected = 'item_or_end'
+        elif char == ']' and expected != 'item':
+            return
+        elif expected == 'separator':
+            if char != ',':
+                raise ValueError(_('ожидалась запятая в позиции {}').format(position))
+            position += 1
+            expected = 'item'
+        else:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = file.read(READ_SIZE)
+                if not chunk:
+                    raise
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield item
+            expected = 'separator'
+
+
+def read_rows(path):
+    """Пары (название, единица измерения) из JSON или CSV файла"""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8', newline='') as file:
+        if extension == '.csv':
+            for row in csv.reader(file):
+                if row:
+                    yield row[0], row[1] if len(row) > 1 else ''
+        elif extension == '.json':
+            for index, item in enumerate(read_json(file)):
+                if not isinstance(item, dict):
+                    raise ValueError(
+                        _('элемент {} массива не объект JSON').format(index)
+                    )
+                yield item.get('name', ''), item.get('measurement_unit', '')
+        else:
+            raise CommandError(
+                _('Неизвестный формат файла {}: нужен .json или .csv').format(path)
+            )
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
 class Command(BaseCommand):
+    help = _('Синхронизирует справочник продуктов с файлом JSON или CSV')
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--path',
             default='data/ingredients.json',
-            help=_('Путь к JSON файлу с продуктами (относительно корня проекта)') 
+            help=_('Путь к JSON или CSV файлу с продуктами (относительно корня проекта)')
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help=_('Показать изменения справочника, ничего не меняя')
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help=_('Удалить продукты, которых нет в файле и нет в рецептах')
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help=_('Число строк файла, обрабатываемых за раз')
         )
-        
-    def handle(self, *args, **options):
-        file_path = options['path']
 
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                ingredients = [
-                    ProductComponent(
-                        **{'title': item['name'], 'unit_type': item['measurement_unit']}
-                    )
-                    for item in json.load(file)
-                ]
-
-                existing_count = ProductComponent.objects.count()
-                
-                ProductComponent.objects.bulk_create(ingredients, ignore_conflicts=True)
-                
-                added_count = ProductComponent.objects.count() - existing_count
-
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        _(f'Успешно импортировано {added_count} из {len(ingredients)} ингредиентов')
-                    )
+    def handle(self, *args, **options):
+        if not os.path.exists(options['path']):
+            raise CommandError(_('Файл {} не найден').format(options['path']))
+        self.dry_run = options['dry_run']
+        self.added = self.existing = self.skipped = self.pruned = 0
+        with transaction.atomic():
+            if options['prune']:
+                self.create_keys_table()
+            try:
+                for batch in batched(read_rows(options['path']), options['batch_size']):
+                    self.sync_batch(batch, options['prune'])
+            except (ValueError, UnicodeDecodeError, csv.Error) as error:
+                raise CommandError(
+                    _('Ошибка при разборе файла {}: {}').format(options['path'], error)
                 )
+            if options['prune']:
+                self.prune()
+                self.drop_keys_table()
+        if not self.dry_run and (self.added or self.pruned):
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            _(
+                '{}Добавлено: {}, уже было: {}, удалено: {}, пропущено строк: {}'
+            ).format(
+                _('Пробный запуск. ') if self.dry_run else '',
+                self.added, self.existing, self.pruned, self.skipped
+            )
+        ))
+
+    def sync_batch(self, rows, prune):
+        title_length = ProductComponent._meta.get_field('title').max_length
+        unit_length = ProductComponent._meta.get_field('unit_type').max_length
+        keys = {}
+        for title, unit_type in rows:
+            title, unit_type = str(title).strip(), str(unit_type).strip()
+            if not title or not unit_type or (
+                len(title) > title_length or len(unit_type) > unit_length
+            ):
+                self.skipped += 1
+                continue
+            keys[title, unit_type] = None
+        existing = set(
+            ProductComponent.objects
+            .filter(title__in={title for title, unit_type in keys})
+            .values_list('title', 'unit_type')
+        )
+        new_keys = [key for key in keys if key not in existing]
+        self.existing += len(keys) - len(new_keys)
+        self.added += len(new_keys)
+        if prune:
+            self.save_keys(keys)
+        if self.dry_run:
+            for title, unit_type in new_keys:
+                self.stdout.write(f'+ {title} ({unit_type})')
+            return
+        ProductComponent.objects.bulk_create(
+            (
+                ProductComponent(title=title, unit_type=unit_type)
+                for title, unit_type in new_keys
+            ),
+            ignore_conflicts=True
+        )
 
+    def create_keys_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {KEYS_TABLE} ('
+                'title varchar(128) NOT NULL, unit_type varchar(64) NOT NULL, '
+                'PRIMARY KEY (title, unit_type))'
+            )
 
-        except Exception as e:
-            self.stdout.write(
-            self.style.ERROR(_(f'Ошибка при обработке файла {file_path}: {e}'))
-            )
\ No newline at end of file
+    def drop_keys_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {KEYS_TABLE}')
+
+    def save_keys(self, keys):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {KEYS_TABLE} (title, unit_type) VALUES (%s, %s) '
+                'ON CONFLICT DO NOTHING',
+                list(keys)
+            )
+
+    def prune(self):
+        """Удаляет продукты, которых нет в файле и которые не входят в рецепты"""
+        table = ProductComponent._meta.db_table
+        condition = (
+            f'id NOT IN (SELECT component_id FROM {RecipeComponent._meta.db_table}) '
+            f'AND NOT EXISTS (SELECT 1 FROM {KEYS_TABLE} k '
+            f'WHERE k.title = {table}.title AND k.unit_type = {table}.unit_type)'
+        )
+        with connection.cursor() as cursor:
+            if not self.dry_run:
+                cursor.execute(f'DELETE FROM {table} WHERE {condition}')
+                self.pruned = cursor.rowcount
+                return
+            cursor.execute(
+                f'SELECT title, unit_type FROM {table} WHERE {condition} '
+                'ORDER BY title, unit_type'
+            )
+            while rows := cursor.fetchmany(1000):
+                for title, unit_type in rows:
+                    self.stdout.write(f'- {title} ({unit_type})')
+                self.pruned += len(rows)
@@ -0,0 +1,100 @@
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from recipes.images import IMAGE_FIELDS
+from recipes.storage import is_content_name
+
+
+class Command(BaseCommand):
+    help = _(
+        'Переносит загруженные ранее изображения в хранилище '
+        'с адресацией по содержимому'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help=_('Только посчитать файлы для переноса, ничего не меняя')
+        )
+        parser.add_argument(
+            '--keep-originals',
+            action='store_true',
+            help=_('Не удалять файлы из старых каталогов после переноса')
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help=_('Число объектов, читаемых из БД за раз')
+        )
+
+    def handle(self, *args, **options):
+        self.legacy_storage = FileSystemStorage()
+        self.dry_run = options['dry_run']
+        self.migrated = {}
+        self.missing = 0
+        for model, (field_name, invalidate) in IMAGE_FIELDS.items():
+            derivatives_field = f'{field_name}_derivatives'
+            instances = (
+                model.objects.exclude(**{field_name: ''})
+                .exclude(**{f'{field_name}__isnull': True})
+                .only('pk', field_name, derivatives_field)
+            )
+            for instance in instances.iterator(chunk_size=options['batch_size']):
+                changes = self.migrate_instance(
+                    getattr(instance, field_name).name,
+                    getattr(instance, derivatives_field)
+                )
+                if changes and not self.dry_run:
+                    name, derivatives = changes
+                    model.objects.filter(pk=instance.pk).update(**{
+                        field_name: name, derivatives_field: derivatives
+                    })
+                    invalidate(instance.pk)
+        if not self.dry_run and not options['keep_originals']:
+            for name in self.migrated:
+                self.legacy_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            _('Перенесено файлов: {}, не найдено: {}').format(
+                len(self.migrated), self.missing
+            )
+        ))
+
+    def migrate_instance(self, name, derivatives):
+        """Новые имена изображения и его копий или None, если менять нечего"""
+        new_name = self.migrate_file(name)
+        sizes = {
+            width: {
+                image_format: self.migrate_file(derivative)
+                for image_format, derivative in formats.items()
+            }
+            for width, formats in derivatives.get('sizes', {}).items()
+        }
+        if new_name == name and all(
+            sizes[width] == formats
+            for width, formats in derivatives.get('sizes', {}).items()
+        ):
+            return None
+        if derivatives.get('source') == name:
+            derivatives = {'source': new_name, 'sizes': sizes}
+        else:
+            derivatives = {}
+        return new_name, derivatives
+
+    def migrate_file(self, name):
+        if is_content_name(name):
+            return name
+        if not self.legacy_storage.exists(name):
+            self.missing += 1
+            self.stdout.write(self.style.WARNING(
+                _('Файл не найден: {}').format(name)
+            ))
+            return name
+        if self.dry_run:
+            self.migrated[name] = name
+            return name
+        with self.legacy_storage.open(name) as file:
+            self.migrated[name] = default_storage.save(name, File(file))
+        return self.migrated[name]
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from recipes.images import IMAGE_FIELDS, enqueue_image, process_jobs
+
+
+class Command(BaseCommand):
+    help = _('Строит уменьшенные копии изображений из очереди обработки')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help=_('Обработать очередь и завершиться, не дожидаясь новых задач')
+        )
+        parser.add_argument(
+            '--enqueue-missing',
+            action='store_true',
+            help=_('Поставить в очередь все изображения без уменьшенных копий')
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help=_('Число задач, забираемых из очереди за раз')
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help=_('Пауза между проверками пустой очереди (сек)')
+        )
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            self.enqueue_missing()
+        processed = 0
+        while True:
+            batch = process_jobs(options['batch_size'])
+            processed += batch
+            if batch:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            _('Обработано задач: {}').format(processed)
+        ))
+
+    def enqueue_missing(self):
+        for model, (field_name, _invalidate) in IMAGE_FIELDS.items():
+            instances = (
+                model.objects.exclude(**{field_name: ''})
+                .exclude(**{f'{field_name}__isnull': True})
+                .only('pk', field_name, f'{field_name}_derivatives')
+            )
+            for instance in instances.iterator():
+                enqueue_image(instance)
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils.translation import gettext_lazy as _
+from recipes.feed import calculate_feeds
+from recipes.models import FeedEntry, UserSubscription
+
+
+class Command(BaseCommand):
+    help = _('Пересчитывает ленты подписок пользователей по подпискам')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help=_('Только сравнить ленты с подписками, ничего не меняя')
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help=_('Размер пакета при записи лент')
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+            return
+        with transaction.atomic():
+            FeedEntry.objects.all().delete()
+            entries = FeedEntry.objects.bulk_create(
+                (
+                    FeedEntry(
+                        subscriber_id=subscriber_id, recipe_id=recipe_id,
+                        author_id=author_id, date_created=date_created
+                    )
+                    for subscriber_id, recipe_id, author_id, date_created
+                    in calculate_feeds()
+                ),
+                batch_size=options['batch_size']
+            )
+        self.stdout.write(self.style.SUCCESS(
+            _('Ленты подписок пересчитаны: {} записей').format(len(entries))
+        ))
+
+    def verify(self):
+        expected = {
+            (subscriber_id, recipe_id)
+            for subscriber_id, recipe_id, *_rest in calculate_feeds()
+        }
+        actual = set(FeedEntry.objects.values_list('subscriber_id', 'recipe_id'))
+        # Новые рецепты дополняют ленты сверх FEED_BACKFILL_RECIPES, поэтому
+        # лишними считаются только записи авторов не из подписок
+        # или с рассылкой при чтении
+        extra = set(
+            FeedEntry.objects
+            .filter(~Exists(UserSubscription.objects.filter(
+                subscriber=OuterRef('subscriber'),
+                target_user=OuterRef('author'),
+                target_user__subscribers_count__lte=(
+                    settings.FEED_FANOUT_MAX_SUBSCRIBERS
+                )
+            )))
+            .values_list('subscriber_id', 'recipe_id')
+        )
+        missing = expected - actual
+        for subscriber_id, recipe_id in sorted(missing):
+            self.stdout.write(self.style.WARNING(
+                _('Пользователь {}: в ленте нет рецепта {}').format(
+                    subscriber_id, recipe_id
+                )
+            ))
+        for subscriber_id, recipe_id in sorted(extra):
+            self.stdout.write(self.style.WARNING(
+                _('Пользователь {}: лишний рецепт {} в ленте').format(
+                    subscriber_id, recipe_id
+                )
+            ))
+        if missing or extra:
+            self.stdout.write(self.style.ERROR(
+                _('Расхождений в лентах подписок: {}').format(
+                    len(missing) + len(extra)
+                )
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(_('Ленты подписок совпадают с подписками')))
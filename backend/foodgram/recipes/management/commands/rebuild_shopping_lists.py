@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import (
+    SHOPPING_LIST_VERSION_KEY, calculate_shopping_lists
+)
+from recipes.versions import bump_versions
+
+
+class Command(BaseCommand):
+    help = _('Пересчитывает списки покупок пользователей по корзинам')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help=_('Только сравнить списки покупок с корзинами, ничего не меняя')
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help=_('Размер пакета при записи списков покупок')
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (row['recipe__shopping_items__user'], row['component']): (
+                row['total_quantity'], row['total_recipes']
+            )
+            for row in calculate_shopping_lists()
+        }
+        if options['verify']:
+            self.verify(expected)
+            return
+        with transaction.atomic():
+            # Сменить версии нужно и у тех, чей список теперь пуст
+            user_ids = {user_id for user_id, _component_id in expected}
+            user_ids.update(
+                ShoppingListItem.objects.values_list('user_id', flat=True).distinct()
+            )
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(
+                        user_id=user_id, component_id=component_id,
+                        quantity=quantity, recipes_count=recipes_count
+                    )
+                    for (user_id, component_id), (quantity, recipes_count)
+                    in expected.items()
+                ),
+                batch_size=options['batch_size']
+            )
+            bump_versions([
+                SHOPPING_LIST_VERSION_KEY.format(user_id) for user_id in user_ids
+            ])
+        self.stdout.write(self.style.SUCCESS(
+            _('Списки покупок пересчитаны: {} позиций').format(len(expected))
+        ))
+
+    def verify(self, expected):
+        actual = {
+            (item['user'], item['component']): (
+                item['quantity'], item['recipes_count']
+            )
+            for item in ShoppingListItem.objects.values(
+                'user', 'component', 'quantity', 'recipes_count'
+            )
+        }
+        mismatches = [
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        ]
+        for user_id, component_id in mismatches:
+            self.stdout.write(self.style.WARNING(
+                _('Пользователь {} продукт {}: ожидалось {}, в списке {}').format(
+                    user_id, component_id,
+                    expected.get((user_id, component_id)),
+                    actual.get((user_id, component_id))
+                )
+            ))
+        if mismatches:
+            self.stdout.write(self.style.ERROR(
+                _('Расхождений в списках покупок: {}').format(len(mismatches))
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(_('Списки покупок совпадают с корзинами')))
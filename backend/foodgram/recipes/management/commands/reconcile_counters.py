@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from recipes.counters import reconcile_counters
+from recipes.feed import reconcile_fan_out
+
+
+class Command(BaseCommand):
+    help = _('Сверяет счётчики рецептов, подписчиков, избранного и продуктов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help=_('Только показать расхождения, ничего не исправляя')
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = reconcile_counters(dry_run=options['dry_run'])
+            # Исправленное число подписчиков могло пересечь порог рассылки
+            feed_authors = reconcile_fan_out(dry_run=options['dry_run'])
+        for counter, count in drift.items():
+            style = self.style.WARNING if count else self.style.SUCCESS
+            self.stdout.write(style(
+                _('{}: расхождений {}').format(counter, count)
+            ))
+        style = self.style.WARNING if feed_authors else self.style.SUCCESS
+        self.stdout.write(style(
+            _('Ленты подписок: авторов с расхождениями {}').format(feed_authors)
+        ))
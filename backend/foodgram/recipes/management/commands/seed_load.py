@@ -0,0 +1,249 @@
+import io
+import random
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from PIL import Image
+from recipes.bulk import insert_rows
+from recipes.catalog import bump_catalog_version
+from recipes.counters import reconcile_counters
+from recipes.models import (
+    CookingRecipe, FavoriteRecipe, MediaBlob, ProductComponent,
+    RecipeComponent, ShoppingCart, User, UserSubscription
+)
+from recipes.search import update_search_vectors
+from recipes.versions import (
+    RECIPES_VERSION_KEY, USERS_VERSION_KEY, set_new_versions
+)
+
+SEED_PASSWORD = 'password'
+DISH_WORDS = (
+    'Суп', 'Салат', 'Пирог', 'Каша', 'Рагу', 'Запеканка', 'Омлет', 'Паста',
+    'Плов', 'Блины', 'Котлеты', 'Жаркое', 'Щи', 'Борщ', 'Оладьи', 'Гуляш',
+)
+# Типичное количество продукта в рецепте по единице измерения
+QUANTITIES = {
+    'г': (10, 500, 10),
+    'кг': (1, 3, 1),
+    'мл': (10, 500, 10),
+    'л': (1, 2, 1),
+    'шт.': (1, 6, 1),
+}
+DEFAULT_QUANTITY = (1, 5, 1)
+# Сколько раз досэмплировать связи, отброшенные как повторы
+FILL_ROUNDS = 5
+
+
+def zipf_weights(count, exponent):
+    """Накопленные веса степенного распределения для count элементов"""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = _(
+        'Заполняет БД синтетическими пользователями, рецептами, избранным, '
+        'корзинами и подписками для нагрузочного тестирования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help=_('Число пользователей'))
+        parser.add_argument('--recipes', type=int, default=5000,
+                            help=_('Число рецептов'))
+        parser.add_argument('--favorites', type=int, default=None,
+                            help=_('Число записей избранного (по умолчанию 10 на пользователя)'))
+        parser.add_argument('--carts', type=int, default=None,
+                            help=_('Число рецептов в корзинах (по умолчанию 3 на пользователя)'))
+        parser.add_argument('--subscriptions', type=int, default=None,
+                            help=_('Число подписок (по умолчанию 5 на пользователя)'))
+        parser.add_argument('--exponent', type=float, default=1.1,
+                            help=_('Показатель степенного распределения популярности'))
+        parser.add_argument('--seed', type=int, default=0,
+                            help=_('Начальное значение генератора случайных чисел'))
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help=_('Размер пакета при записи в БД'))
+
+    def handle(self, *args, **options):
+        components = list(
+            ProductComponent.objects.order_by('pk').values_list('pk', 'unit_type')
+        )
+        if not components:
+            raise CommandError(
+                _('Справочник продуктов пуст, сначала выполните import_ingredients')
+            )
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError(_('Нужно хотя бы 2 пользователя и 1 рецепт'))
+        self.random = random.Random(options['seed'])
+        self.seed = options['seed']
+        self.batch_size = options['batch_size']
+        self.exponent = options['exponent']
+        users = options['users']
+        relations = {
+            'favorites': options['favorites'] or users * 10,
+            'carts': options['carts'] or users * 3,
+            'subscriptions': options['subscriptions'] or users * 5,
+        }
+
+        with transaction.atomic():
+            user_ids = self.create_users(users)
+            self.random.shuffle(components)
+            recipe_ids = self.create_recipes(options['recipes'], user_ids)
+            self.report(_('Продуктов в рецептах'), self.create_recipe_components(
+                recipe_ids, components
+            ))
+            self.random.shuffle(recipe_ids)
+            self.report(_('Избранное'), self.create_user_recipe_relations(
+                FavoriteRecipe, relations['favorites'], user_ids, recipe_ids
+            ))
+            self.report(_('Корзины'), self.create_user_recipe_relations(
+                ShoppingCart, relations['carts'], user_ids, recipe_ids
+            ))
+            self.report(_('Подписки'), self.create_subscriptions(
+                relations['subscriptions'], user_ids
+            ))
+            self.update_derived_data(recipe_ids)
+        set_new_versions([RECIPES_VERSION_KEY, USERS_VERSION_KEY])
+        bump_catalog_version()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def report(self, label, count):
+        self.stdout.write(f'{label}: {count}')
+
+    def batches(self, total, make_batch):
+        """Вызывает make_batch(size) пакетами, пока не наберётся total строк"""
+        for start in range(0, total, self.batch_size):
+            yield make_batch(min(self.batch_size, total - start))
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        prefix = f'seed{self.seed}_'
+        user_ids = []
+        for start in range(0, count, self.batch_size):
+            users = User.objects.bulk_create([
+                User(
+                    email=f'{prefix}{index}@example.com',
+                    username=f'{prefix}{index}',
+                    first_name='Пользователь', last_name=str(index),
+                    password=password
+                )
+                for index in range(start, min(start + self.batch_size, count))
+            ])
+            user_ids.extend(user.pk for user in users)
+        self.report(_('Пользователи'), len(user_ids))
+        return user_ids
+
+    def get_picture(self):
+        """Общее для всех рецептов изображение-заглушка"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (230, 180, 120)).save(buffer, 'JPEG')
+        return default_storage.save('seed.jpg', ContentFile(buffer.getvalue()))
+
+    def create_recipes(self, count, user_ids):
+        picture = self.get_picture()
+        author_weights = zipf_weights(len(user_ids), self.exponent)
+        recipe_ids = []
+
+        def make_batch(size):
+            authors = self.random.choices(user_ids, cum_weights=author_weights, k=size)
+            return [
+                CookingRecipe(
+                    title=f'{self.random.choice(DISH_WORDS)} №{len(recipe_ids) + index}',
+                    description='Синтетический рецепт для нагрузочного тестирования.',
+                    cook_duration=self.random.randint(5, 180),
+                    picture=picture,
+                    creator_id=author
+                )
+                for index, author in enumerate(authors)
+            ]
+
+        for recipes in self.batches(count, make_batch):
+            recipe_ids.extend(
+                recipe.pk for recipe in CookingRecipe.objects.bulk_create(recipes)
+            )
+        MediaBlob.objects.filter(name=picture).update(
+            references=F('references') + len(recipe_ids) - 1
+        )
+        self.report(_('Рецепты'), len(recipe_ids))
+        return recipe_ids
+
+    def create_recipe_components(self, recipe_ids, components):
+        """От 3 до 15 продуктов на рецепт, популярные продукты встречаются чаще"""
+        weights = zipf_weights(len(components), self.exponent)
+        created = 0
+        rows = []
+        for recipe_id in recipe_ids:
+            size = min(len(components), round(self.random.triangular(3, 15, 7)))
+            chosen = {}
+            while len(chosen) < size:
+                for pk, unit_type in self.random.choices(
+                    components, cum_weights=weights, k=size - len(chosen)
+                ):
+                    chosen[pk] = unit_type
+            for pk, unit_type in chosen.items():
+                low, high, step = QUANTITIES.get(unit_type, DEFAULT_QUANTITY)
+                rows.append((recipe_id, pk, self.random.randrange(low, high + 1, step)))
+            if len(rows) >= self.batch_size:
+                created += insert_rows(
+                    RecipeComponent, ('recipe', 'component', 'quantity'), rows
+                )
+                rows = []
+        return created + insert_rows(
+            RecipeComponent, ('recipe', 'component', 'quantity'), rows
+        )
+
+    def sample_pairs(self, count, left, right):
+        """Пары со степенным распределением активности и популярности"""
+        left_weights = zipf_weights(len(left), self.exponent)
+        right_weights = zipf_weights(len(right), self.exponent)
+
+        def make_batch(size):
+            return zip(
+                self.random.choices(left, cum_weights=left_weights, k=size),
+                self.random.choices(right, cum_weights=right_weights, k=size)
+            )
+
+        return self.batches(count, make_batch)
+
+    def fill_pairs(self, model, fields, count, left, right, allow_equal=True):
+        """Добавляет до count уникальных пар, досэмплируя выпавшие повторы"""
+        inserted = 0
+        for _round in range(FILL_ROUNDS):
+            if inserted >= count:
+                break
+            inserted += sum(
+                insert_rows(model, fields, (
+                    pair for pair in batch if allow_equal or pair[0] != pair[1]
+                ))
+                for batch in self.sample_pairs(count - inserted, left, right)
+            )
+        return inserted
+
+    def create_user_recipe_relations(self, model, count, user_ids, recipe_ids):
+        return self.fill_pairs(
+            model, ('user', 'recipe'), count, user_ids, recipe_ids
+        )
+
+    def create_subscriptions(self, count, user_ids):
+        authors = list(user_ids)
+        self.random.shuffle(authors)
+        return self.fill_pairs(
+            UserSubscription, ('subscriber', 'target_user'), count,
+            user_ids, authors, allow_equal=False
+        )
+
+    def update_derived_data(self, recipe_ids):
+        """Пересчитывает то, что при обычной записи обновляют сигналы"""
+        reconcile_counters()
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        call_command('rebuild_feeds', stdout=self.stdout)
+        for start in range(0, len(recipe_ids), self.batch_size):
+            update_search_vectors(recipe_ids[start:start + self.batch_size])
@@ -0,0 +1,58 @@
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+CREATE_INDEXES_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipes_cookingrecipe_search_vector_gin '
+    'ON recipes_cookingrecipe USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS recipes_cookingrecipe_title_trgm '
+    'ON recipes_cookingrecipe USING gin (title gin_trgm_ops)',
+)
+
+DROP_INDEXES_SQL = (
+    'DROP INDEX IF EXISTS recipes_cookingrecipe_search_vector_gin',
+    'DROP INDEX IF EXISTS recipes_cookingrecipe_title_trgm',
+)
+
+FILL_SEARCH_VECTOR_SQL = """
+UPDATE recipes_cookingrecipe AS recipe SET search_vector =
+    setweight(to_tsvector('russian', coalesce(recipe.title, '')), 'A')
+    || setweight(to_tsvector('russian', coalesce(recipe.description, '')), 'B')
+    || setweight(to_tsvector('russian', coalesce((
+        SELECT string_agg(component.title, ' ')
+        FROM recipes_recipecomponent AS recipe_component
+        JOIN recipes_productcomponent AS component
+            ON component.id = recipe_component.component_id
+        WHERE recipe_component.recipe_id = recipe.id
+    ), '')), 'C')
+"""
+
+
+def run_postgresql(*statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='cookingrecipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_postgresql(FILL_SEARCH_VECTOR_SQL, *CREATE_INDEXES_SQL),
+            run_postgresql(*DROP_INDEXES_SQL),
+        ),
+    ]
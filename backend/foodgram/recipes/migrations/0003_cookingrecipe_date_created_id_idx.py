@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_cookingrecipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cookingrecipe',
+            index=models.Index(fields=['-date_created', '-id'], name='recipe_date_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_shopping_lists(apps, schema_editor):
+    RecipeComponent = apps.get_model('recipes', 'RecipeComponent')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    rows = (
+        RecipeComponent.objects
+        .filter(recipe__shopping_items__isnull=False)
+        .values('recipe__shopping_items__user', 'component')
+        .annotate(total_quantity=Sum('quantity'), total_recipes=Count('recipe'))
+        .order_by()
+    )
+    ShoppingListItem.objects.bulk_create(
+        (
+            ShoppingListItem(
+                user_id=row['recipe__shopping_items__user'],
+                component_id=row['component'],
+                quantity=row['total_quantity'],
+                recipes_count=row['total_recipes'],
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_cookingrecipe_date_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('recipes_count', models.PositiveIntegerField(default=0, verbose_name='Рецептов в корзине')),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.productcomponent', verbose_name='Продукт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Продукт в списке покупок',
+                'verbose_name_plural': 'Списки покупок',
+                'ordering': ('user', 'component'),
+                'default_related_name': 'shopping_list',
+                'constraints': [models.UniqueConstraint(fields=('user', 'component'), name='unique_shopping_list_component')],
+            },
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('User', 'recipes_count', 'CookingRecipe', 'creator'),
+    ('User', 'subscribers_count', 'UserSubscription', 'target_user'),
+    ('User', 'subscriptions_count', 'UserSubscription', 'subscriber'),
+    ('CookingRecipe', 'favorites_count', 'FavoriteRecipe', 'recipe'),
+    ('ProductComponent', 'recipes_count', 'RecipeComponent', 'component'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model_name, field, related_model_name, foreign_key in COUNTERS:
+        related_model = apps.get_model('recipes', related_model_name)
+        apps.get_model('recipes', model_name).objects.update(**{
+            field: Coalesce(
+                Subquery(
+                    related_model.objects
+                    .filter(**{foreign_key: OuterRef('pk')})
+                    .order_by()
+                    .values(foreign_key)
+                    .annotate(total=Count('pk'))
+                    .values('total')
+                ),
+                Value(0)
+            )
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cookingrecipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='productcomponent',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscriptions_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+from django.db.models import Count, F, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicate_components(apps, schema_editor):
+    """Сливает продукты с одинаковыми названием и единицей измерения"""
+    ProductComponent = apps.get_model('recipes', 'ProductComponent')
+    RecipeComponent = apps.get_model('recipes', 'RecipeComponent')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = (
+        ProductComponent.objects
+        .values('title', 'unit_type')
+        .annotate(kept_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for group in duplicates:
+        kept_id = group['kept_id']
+        others = list(
+            ProductComponent.objects
+            .filter(title=group['title'], unit_type=group['unit_type'])
+            .exclude(pk=kept_id)
+            .values_list('pk', flat=True)
+        )
+        for item in RecipeComponent.objects.filter(component_id__in=others):
+            if not RecipeComponent.objects.filter(
+                recipe_id=item.recipe_id, component_id=kept_id
+            ).update(quantity=F('quantity') + item.quantity):
+                RecipeComponent.objects.create(
+                    recipe_id=item.recipe_id, component_id=kept_id,
+                    quantity=item.quantity
+                )
+        for item in ShoppingListItem.objects.filter(component_id__in=others):
+            if not ShoppingListItem.objects.filter(
+                user_id=item.user_id, component_id=kept_id
+            ).update(
+                quantity=F('quantity') + item.quantity,
+                recipes_count=F('recipes_count') + item.recipes_count
+            ):
+                ShoppingListItem.objects.create(
+                    user_id=item.user_id, component_id=kept_id,
+                    quantity=item.quantity, recipes_count=item.recipes_count
+                )
+        ProductComponent.objects.filter(pk__in=others).delete()
+    ProductComponent.objects.update(recipes_count=Coalesce(
+        Subquery(
+            RecipeComponent.objects
+            .filter(component=OuterRef('pk'))
+            .order_by()
+            .values('component')
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_mediablob'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_components, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_merge_duplicate_components'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='productcomponent',
+            constraint=models.UniqueConstraint(fields=('title', 'unit_type'), name='unique_product_component'),
+        ),
+    ]
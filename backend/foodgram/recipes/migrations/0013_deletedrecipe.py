@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-17 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_cookingrecipe_updated_at_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe_id', models.PositiveIntegerField(verbose_name='Идентификатор рецепта')),
+                ('date_deleted', models.DateTimeField(auto_now_add=True, verbose_name='Дата удаления')),
+            ],
+            options={
+                'verbose_name': 'Удалённый рецепт',
+                'verbose_name_plural': 'Удалённые рецепты',
+                'ordering': ('date_deleted',),
+                'indexes': [models.Index(fields=['date_deleted'], name='deleted_recipe_date_idx')],
+            },
+        ),
+    ]
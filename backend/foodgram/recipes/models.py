@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -25,6 +26,18 @@ class User(AbstractUser):
         null=True,
         blank=True
     )
+    avatar_derivatives = models.JSONField(
+        _('Уменьшенные копии аватара'), default=dict, editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        _('Количество рецептов'), default=0, editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        _('Количество подписчиков'), default=0, editable=False
+    )
+    subscriptions_count = models.PositiveIntegerField(
+        _('Количество подписок'), default=0, editable=False
+    )
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -68,16 +81,44 @@ class ProductComponent(models.Model):
     
     title = models.CharField(_('Наименование'), max_length=128)
     unit_type = models.CharField(_('Единица измерения'), max_length=64)
+    recipes_count = models.PositiveIntegerField(
+        _('Количество рецептов'), default=0, editable=False
+    )
 
     class Meta:
         ordering = ('title',)
         verbose_name = _('Продукт')
         verbose_name_plural = _('Продукты')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['title', 'unit_type'],
+                name='unique_product_component'
+            )
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.unit_type})"
 
 
+class CookingRecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги избранного и корзины для пользователя"""
+        if not user or not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+        )
+
+
 class CookingRecipe(models.Model):
     
     title = models.CharField(_('Название рецепта'), max_length=256)
@@ -89,6 +130,9 @@ class CookingRecipe(models.Model):
         ]
     )
     picture = models.ImageField(_('Изображение блюда'), upload_to='recipes/images')
+    picture_derivatives = models.JSONField(
+        _('Уменьшенные копии изображения'), default=dict, editable=False
+    )
     creator = models.ForeignKey(
         User,
         verbose_name=_('Автор рецепта'),
@@ -103,9 +147,27 @@ class CookingRecipe(models.Model):
         through_fields=('recipe', 'component')
     )
     date_created = models.DateTimeField(_('Дата создания'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('Дата изменения'), auto_now=True)
+    favorites_count = models.PositiveIntegerField(
+        _('В избранном'), default=0, editable=False
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = CookingRecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-date_created',)
+        indexes = [
+            models.Index(
+                fields=['-date_created', '-id'],
+                name='recipe_date_created_id_idx'
+            ),
+            models.Index(
+                fields=['creator', '-date_created', '-id'],
+                name='recipe_creator_date_idx'
+            ),
+            models.Index(fields=['updated_at'], name='recipe_updated_at_idx')
+        ]
         verbose_name = _('Рецепт')
         verbose_name_plural = _('Рецепты')
 
@@ -182,9 +244,149 @@ class ShoppingCart(BaseUserRecipeRelation):
         default_related_name = 'shopping_items'
 
 
+class ShoppingListItem(models.Model):
+    
+    user = models.ForeignKey(
+        User,
+        verbose_name=_('Пользователь'),
+        on_delete=models.CASCADE
+    )
+    component = models.ForeignKey(
+        ProductComponent,
+        verbose_name=_('Продукт'),
+        on_delete=models.CASCADE
+    )
+    quantity = models.PositiveIntegerField(_('Количество'), default=0)
+    recipes_count = models.PositiveIntegerField(_('Рецептов в корзине'), default=0)
+
+    class Meta:
+        ordering = ('user', 'component')
+        verbose_name = _('Продукт в списке покупок')
+        verbose_name_plural = _('Списки покупок')
+        default_related_name = 'shopping_list'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'component'],
+                name='unique_shopping_list_component'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.component} - {self.quantity} ({self.user})"
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика, записанный при публикации.
+
+    Автор и дата создания рецепта копируются в запись, чтобы страница
+    ленты читалась диапазоном одного индекса.
+    """
+
+    subscriber = models.ForeignKey(
+        User,
+        verbose_name=_('Подписчик'),
+        related_name='feed_entries',
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(
+        CookingRecipe,
+        verbose_name=_('Рецепт'),
+        related_name='feed_entries',
+        on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name=_('Автор'),
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+    date_created = models.DateTimeField(_('Дата создания рецепта'))
+
+    class Meta:
+        ordering = ('subscriber', '-date_created', '-recipe')
+        verbose_name = _('Запись ленты')
+        verbose_name_plural = _('Ленты подписок')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscriber', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['subscriber', '-date_created', '-recipe'],
+                name='feed_entry_timeline_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id} в ленте {self.subscriber_id}"
+
+
+class DeletedRecipe(models.Model):
+    """Запись об удалённом рецепте.
+
+    По этим записям индексы подбора по запасам в каждом процессе убирают
+    удалённые рецепты, не перечитывая id всех рецептов.
+    """
+
+    recipe_id = models.PositiveIntegerField(_('Идентификатор рецепта'))
+    date_deleted = models.DateTimeField(_('Дата удаления'), auto_now_add=True)
+
+    class Meta:
+        ordering = ('date_deleted',)
+        verbose_name = _('Удалённый рецепт')
+        verbose_name_plural = _('Удалённые рецепты')
+        indexes = [
+            models.Index(fields=['date_deleted'], name='deleted_recipe_date_idx')
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id} удалён {self.date_deleted}"
+
+
 class FavoriteRecipe(BaseUserRecipeRelation):
     
     class Meta(BaseUserRecipeRelation.Meta):
         verbose_name = _('Избранный рецепт')
         verbose_name_plural = _('Избранные рецепты')
         default_related_name = 'favorite_recipes'
+
+
+class ImageJob(models.Model):
+
+    model_label = models.CharField(_('Модель'), max_length=100)
+    object_id = models.PositiveIntegerField(_('Идентификатор объекта'))
+    source = models.CharField(_('Исходное изображение'), max_length=255)
+    attempts = models.PositiveSmallIntegerField(_('Попыток'), default=0)
+    error = models.TextField(_('Последняя ошибка'), blank=True)
+    date_created = models.DateTimeField(_('Дата создания'), auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = _('Задача обработки изображения')
+        verbose_name_plural = _('Очередь обработки изображений')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['model_label', 'object_id'],
+                name='unique_image_job_object'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.model_label} #{self.object_id}: {self.source}"
+
+
+class MediaBlob(models.Model):
+
+    name = models.CharField(_('Путь к файлу'), max_length=255, unique=True)
+    references = models.PositiveIntegerField(_('Число ссылок'), default=0)
+    date_created = models.DateTimeField(_('Дата создания'), auto_now_add=True)
+
+    class Meta:
+        ordering = ('name',)
+        verbose_name = _('Медиафайл')
+        verbose_name_plural = _('Медиафайлы')
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
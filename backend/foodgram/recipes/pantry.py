@@ -0,0 +1,405 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max
+
+from .models import CookingRecipe, DeletedRecipe, RecipeComponent
+from .versions import RECIPES_VERSION_KEY, bump_versions, get_versions
+
+DELETED_RECIPES_VERSION_KEY = 'deleted_recipes_version'
+# Доля устаревших позиций, после которой индекс строится заново
+REBUILD_DEAD_SHARE = 0.25
+# Продукт хранится битовым числом, если оно не больше массива позиций
+DENSE_POSITIONS_RATIO = 32
+
+
+def bump_deleted_recipes_version():
+    """Помечает, что рецепты удалялись"""
+    bump_versions([DELETED_RECIPES_VERSION_KEY])
+
+
+def record_deleted_recipe(recipe_id):
+    """Записывает удаление рецепта для индексов всех процессов,
+    попутно удаляя записи старше PANTRY_DELETED_RETENTION секунд"""
+    expired = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.PANTRY_DELETED_RETENTION
+    )
+    DeletedRecipe.objects.filter(date_deleted__lt=expired).delete()
+    DeletedRecipe.objects.create(recipe_id=recipe_id)
+    bump_deleted_recipes_version()
+
+
+def to_bits(positions, length):
+    """Битовое множество из номеров позиций"""
+    buffer = bytearray((length + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def drop_highest(bits, count):
+    """bits без count старших установленных битов"""
+    if count <= 0:
+        return bits
+    if count >= bits.bit_count():
+        return 0
+    # Наибольший сдвиг, при котором старше него остаётся count битов
+    low, high = 0, bits.bit_length()
+    while low < high:
+        middle = (low + high + 1) // 2
+        if (bits >> middle).bit_count() >= count:
+            low = middle
+        else:
+            high = middle - 1
+    return bits & ((1 << low) - 1)
+
+
+def iter_positions(bits):
+    """Номера установленных битов от старших к младшим"""
+    while bits:
+        position = bits.bit_length() - 1
+        yield position
+        bits ^= 1 << position
+
+
+def load_components():
+    """(id рецепта, id продукта) по возрастанию id рецепта.
+
+    Строки читаются курсором без values_list: при миллионах продуктов
+    в рецептах это заметно быстрее.
+    """
+    components = RecipeComponent.objects.order_by('recipe_id').values_list(
+        'recipe_id', 'component_id'
+    )
+    sql, params = components.query.sql_with_params()
+    with connections[components.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while rows := cursor.fetchmany(10000):
+            yield from rows
+
+
+def load_changes(since):
+    """(id рецепта, время изменения, id продукта) рецептов, изменённых
+    начиная с since, по возрастанию id рецепта"""
+    return (
+        RecipeComponent.objects
+        .filter(recipe__updated_at__gte=since)
+        .order_by('recipe_id')
+        .values_list('recipe_id', 'recipe__updated_at', 'component_id')
+    )
+
+
+def load_deleted(since):
+    """(id рецепта, время удаления) рецептов, удалённых начиная с since"""
+    return (
+        DeletedRecipe.objects
+        .filter(date_deleted__gte=since)
+        .values_list('recipe_id', 'date_deleted')
+    )
+
+
+class PantryMatch:
+    """Рецепты, в которых есть хотя бы один продукт из запасов.
+
+    Срез возвращает пары (id рецепта, число недостающих продуктов):
+    сначала рецепты, для которых есть все продукты, затем по числу
+    недостающих, внутри группы — недавно добавленные и изменённые выше.
+    Поддерживает count() и срезы, как queryset для пагинации.
+    """
+
+    def __init__(self, recipe_ids, matched, missing_planes):
+        self.recipe_ids = recipe_ids
+        self.matched = matched
+        self.missing_planes = missing_planes
+
+    def count(self):
+        return self.matched.bit_count()
+
+    def get_group(self, missing):
+        """Позиции рецептов, в которых не хватает missing продуктов"""
+        group = self.matched
+        for bit, plane in enumerate(self.missing_planes):
+            group &= plane if missing >> bit & 1 else ~plane
+        return group
+
+    def __getitem__(self, page):
+        skip, needed = page.start or 0, page.stop - (page.start or 0)
+        remaining = self.count()
+        matches = []
+        missing = 0
+        groups = 1 << len(self.missing_planes)
+        while needed > 0 and remaining > skip and missing < groups:
+            group = self.get_group(missing)
+            size = group.bit_count()
+            remaining -= size
+            if skip >= size:
+                skip -= size
+            else:
+                for position in iter_positions(drop_highest(group, skip)):
+                    matches.append((self.recipe_ids[position], missing))
+                    needed -= 1
+                    if not needed:
+                        break
+                skip = 0
+            missing += 1
+        return matches
+
+
+class PantryIndex:
+    """Множества рецептов по продуктам для подбора по запасам.
+
+    Каждый рецепт занимает позицию, для продукта хранится множество
+    позиций рецептов с ним: битовое число для частых продуктов и массив
+    позиций для редких. Число продуктов в рецептах хранится по битам
+    (size_planes[j] — j-й бит числа у всех позиций), поэтому число
+    недостающих продуктов считается сразу для всех рецептов несколькими
+    операциями над длинными целыми, независимо от того, в скольких
+    рецептах встречаются продукты. Изменённый рецепт получает новую
+    позицию, старая помечается устаревшей.
+    """
+
+    def __init__(self, rows, versions, synced_until, deleted_until):
+        """rows — (id рецепта, id продукта) по возрастанию id рецепта,
+        synced_until — время последнего изменения рецептов, deleted_until —
+        время, начиная с которого читаются удаления (timestamp)"""
+        self.versions = versions
+        self.synced_until = synced_until
+        self.deleted_until = deleted_until
+        self.checked_at = time.monotonic()
+        self.recipe_ids = array('q')
+        self.appended = {}
+        self.size_planes = []
+        self.dense = {}
+        self.sparse = {}
+        self.dead = 0
+        sizes = array('H')
+        for recipe_id, recipe_rows in groupby(rows, key=lambda row: row[0]):
+            position = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+            size = 0
+            for _recipe_id, component_id in recipe_rows:
+                self.sparse.setdefault(component_id, array('I')).append(position)
+                size += 1
+            sizes.append(size)
+        self.base_length = length = len(self.recipe_ids)
+        self.retired = bytearray(length)
+        # Время изменения известно только для рецептов, прочитанных при
+        # синхронизации, остальные при повторном чтении получат новую позицию
+        self.stamps = array('d', bytes(8 * length))
+        self.alive = (1 << length) - 1
+        for component_id, positions in list(self.sparse.items()):
+            if len(positions) * DENSE_POSITIONS_RATIO >= length:
+                self.dense[component_id] = to_bits(positions, length)
+                del self.sparse[component_id]
+        for bit in range(max(sizes, default=0).bit_length()):
+            self.size_planes.append(to_bits(
+                (position for position, size in enumerate(sizes) if size >> bit & 1),
+                length
+            ))
+
+    def __len__(self):
+        return len(self.recipe_ids) - self.dead
+
+    def find(self, recipe_id):
+        """Позиция рецепта или None"""
+        position = self.appended.get(recipe_id)
+        if position is not None:
+            return position
+        position = bisect_left(self.recipe_ids, recipe_id, 0, self.base_length)
+        if position < self.base_length and self.recipe_ids[position] == recipe_id:
+            return position
+        return None
+
+    def retire(self, position):
+        if not self.retired[position]:
+            self.retired[position] = 1
+            self.alive &= ~(1 << position)
+            self.dead += 1
+
+    def add(self, recipe_id, stamp, component_ids):
+        position = len(self.recipe_ids)
+        self.recipe_ids.append(recipe_id)
+        self.stamps.append(stamp)
+        self.retired.append(0)
+        self.appended[recipe_id] = position
+        bit = 1 << position
+        self.alive |= bit
+        for component_id in component_ids:
+            if component_id in self.dense:
+                self.dense[component_id] |= bit
+            else:
+                self.sparse.setdefault(component_id, array('I')).append(position)
+        size = len(component_ids)
+        for plane in range(size.bit_length()):
+            if plane == len(self.size_planes):
+                self.size_planes.append(0)
+            if size >> plane & 1:
+                self.size_planes[plane] |= bit
+
+    def apply_changes(self, rows):
+        """Переносит в индекс рецепты, изменившиеся с прошлой синхронизации"""
+        for recipe_id, recipe_rows in groupby(rows, key=lambda row: row[0]):
+            recipe_rows = list(recipe_rows)
+            stamp = recipe_rows[0][1].timestamp()
+            self.synced_until = max(self.synced_until, stamp)
+            position = self.find(recipe_id)
+            if position is not None:
+                if not self.retired[position] and self.stamps[position] == stamp:
+                    continue
+                self.retire(position)
+            self.add(
+                recipe_id, stamp,
+                [component_id for _recipe_id, _stamp, component_id in recipe_rows]
+            )
+
+    def remove_deleted(self, rows):
+        """Убирает из индекса удалённые рецепты: (id рецепта, время удаления)"""
+        for recipe_id, date_deleted in rows:
+            self.deleted_until = max(self.deleted_until, date_deleted.timestamp())
+            position = self.find(recipe_id)
+            if position is not None:
+                self.retire(position)
+
+    def remove_missing(self, existing_ids):
+        """Убирает из индекса рецепты, id которых нет в existing_ids"""
+        existing_ids = set(existing_ids)
+        for position, recipe_id in enumerate(self.recipe_ids):
+            if recipe_id not in existing_ids:
+                self.retire(position)
+
+    def needs_rebuild(self):
+        return self.dead > len(self.recipe_ids) * REBUILD_DEAD_SHARE
+
+    def sync(self, versions, latest=None):
+        """Догоняет изменения рецептов после смены их версий или по опросу БД.
+
+        latest — время последнего изменения и число рецептов в БД, если
+        они прочитаны: так видны и изменения, версии которых не дошли
+        до кеша этого процесса. Изменения читаются по времени изменения
+        рецепта с запасом PANTRY_SYNC_OVERLAP секунд на транзакции,
+        зафиксированные позже более новых. Удалённые рецепты читаются
+        из записей DeletedRecipe с тем же запасом, а с id всех рецептов
+        индекс сверяется, только если в нём больше рецептов, чем в БД:
+        записи об удалении устарели или рецепты удалены в обход сигналов.
+        """
+        changed = versions[RECIPES_VERSION_KEY] != self.versions[RECIPES_VERSION_KEY]
+        deleted = (
+            versions[DELETED_RECIPES_VERSION_KEY]
+            != self.versions[DELETED_RECIPES_VERSION_KEY]
+        )
+        if latest is not None:
+            updated_at, count = latest
+            changed = changed or (
+                updated_at is not None and updated_at.timestamp() > self.synced_until
+            )
+        if changed:
+            self.apply_changes(load_changes(datetime.fromtimestamp(
+                self.synced_until - settings.PANTRY_SYNC_OVERLAP, timezone.utc
+            )))
+        if latest is not None:
+            deleted = deleted or len(self) != count
+        if deleted:
+            self.remove_deleted(load_deleted(datetime.fromtimestamp(
+                self.deleted_until - settings.PANTRY_SYNC_OVERLAP, timezone.utc
+            )))
+        if latest is not None and len(self) > count:
+            self.remove_missing(
+                CookingRecipe.objects.values_list('id', flat=True).iterator()
+            )
+        self.versions = versions
+
+    def get_bits(self, component_id):
+        if component_id in self.dense:
+            return self.dense[component_id]
+        return to_bits(self.sparse.get(component_id, ()), len(self.recipe_ids))
+
+    def match(self, component_ids):
+        """Рецепты по продуктам в запасах: PantryMatch"""
+        hit_planes = []
+        matched = 0
+        for component_id in set(component_ids):
+            carry = self.get_bits(component_id)
+            matched |= carry
+            # Прибавляет единицу к счётчику совпадений в позициях carry
+            for plane, bits in enumerate(hit_planes):
+                hit_planes[plane], carry = bits ^ carry, bits & carry
+                if not carry:
+                    break
+            if carry:
+                hit_planes.append(carry)
+        missing_planes = []
+        borrow = 0
+        for plane in range(max(len(self.size_planes), len(hit_planes))):
+            size = self.size_planes[plane] if plane < len(self.size_planes) else 0
+            hits = hit_planes[plane] if plane < len(hit_planes) else 0
+            missing_planes.append(size ^ hits ^ borrow)
+            borrow = (~size & (hits | borrow)) | (hits & borrow)
+        return PantryMatch(self.recipe_ids, matched & self.alive, missing_planes)
+
+
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+_index = None
+
+
+def get_latest_change():
+    """Время последнего изменения и число рецептов в БД"""
+    latest = CookingRecipe.objects.aggregate(
+        updated_at=Max('updated_at'), count=Count('id')
+    )
+    return latest['updated_at'], latest['count']
+
+
+def build_index(current):
+    """Строит индекс заново и подменяет им текущий.
+
+    Индекс строится вне _lock: пока он строится, запросы обслуживает
+    прежний индекс, а без него ждут построения. Изменения, сделанные
+    во время построения, индекс догонит при следующей синхронизации.
+    """
+    global _index
+
+    if not _build_lock.acquire(blocking=current is None):
+        return current
+    try:
+        if _index is not current:
+            return _index
+        versions = get_versions([RECIPES_VERSION_KEY, DELETED_RECIPES_VERSION_KEY])
+        deleted_until = time.time()
+        synced_until, _count = get_latest_change()
+        index = PantryIndex(
+            load_components(), versions,
+            synced_until.timestamp() if synced_until else 0.0, deleted_until
+        )
+        with _lock:
+            _index = index
+        return index
+    finally:
+        _build_lock.release()
+
+
+def match_pantry(component_ids):
+    """Рецепты по продуктам в запасах по индексу текущего процесса.
+
+    Индекс строится при первом обращении и догоняет изменения рецептов
+    при смене их версий, а раз в PANTRY_SYNC_INTERVAL секунд сверяется
+    с временем последнего изменения и числом рецептов в БД.
+    """
+    index = _index
+    if index is None or index.needs_rebuild():
+        index = build_index(index)
+    versions = get_versions([RECIPES_VERSION_KEY, DELETED_RECIPES_VERSION_KEY])
+    with _lock:
+        latest = None
+        if time.monotonic() >= index.checked_at + settings.PANTRY_SYNC_INTERVAL:
+            latest = get_latest_change()
+            index.checked_at = time.monotonic()
+        if latest is not None or versions != index.versions:
+            index.sync(versions, latest)
+        return index.match(component_ids)
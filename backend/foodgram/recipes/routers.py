@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger('foodgram.replicas')
+
+RECENT_WRITE_KEY = 'replica_recent_write:{}'
+# Токены читаются из основной БД, чтобы новый токен работал сразу после входа
+PRIMARY_APPS = {'authtoken'}
+
+current_reads = ContextVar('current_reads', default=None)
+# Момент (time.monotonic()), до которого реплика считается недоступной
+unavailable_until = {}
+
+
+def get_client_key(request):
+    """Ключ клиента для привязки к основной БД после записи или None"""
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        return None
+    return RECENT_WRITE_KEY.format(
+        hashlib.sha256(authorization.encode()).hexdigest()
+    )
+
+
+def choose_replica():
+    """Случайная доступная реплика или основная БД, если доступных нет"""
+    now = time.monotonic()
+    replicas = [
+        alias for alias in settings.DB_REPLICAS
+        if unavailable_until.get(alias, 0) <= now
+    ]
+    random.shuffle(replicas)
+    for alias in replicas:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as error:
+            unavailable_until[alias] = now + settings.DB_REPLICA_RETRY_SECONDS
+            logger.warning('Реплика %s недоступна: %s', alias, error)
+            continue
+        return alias
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaReads:
+    """Чтение из одной реплики в рамках запроса.
+
+    Реплика выбирается при первом запросе к БД, поэтому запросы,
+    обходящиеся без БД, не открывают соединение с репликой.
+    """
+
+    def __init__(self):
+        self.alias = None
+
+    def get_alias(self):
+        if self.alias is None:
+            self.alias = choose_replica()
+        return self.alias
+
+
+class PrimaryReplicaRouter:
+    """Направляет чтение в безопасных HTTP-запросах в реплики.
+
+    Запись и чтение вне HTTP-запросов (команды, обработка изображений)
+    идут в основную БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        reads = current_reads.get()
+        if reads is None or model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return reads.get_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        return True
+
+
+def mark_recent_write(client_key):
+    cache.set(client_key, True, settings.DB_REPLICA_LAG_SECONDS)
+
+
+def has_recent_write(client_key):
+    return client_key is not None and cache.get(client_key) is not None
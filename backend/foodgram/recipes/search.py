@@ -0,0 +1,75 @@
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+)
+from django.db import connection
+from django.db.models import F, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+from .models import CookingRecipe, RecipeComponent
+
+SEARCH_CONFIG = 'russian'
+
+
+def is_full_text_supported():
+    """Полнотекстовый поиск доступен только в PostgreSQL"""
+    return connection.vendor == 'postgresql'
+
+
+def update_search_vectors(recipe_ids):
+    """Пересчитывает поисковые векторы рецептов.
+
+    В вектор входят название (вес A), описание (вес B)
+    и названия продуктов рецепта (вес C).
+    """
+    if not is_full_text_supported():
+        return
+    component_titles = (
+        RecipeComponent.objects
+        .filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(titles=StringAgg('component__title', delimiter=' '))
+        .values('titles')
+    )
+    CookingRecipe.objects.filter(pk__in=recipe_ids).update(
+        search_vector=(
+            SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(
+                    Subquery(component_titles), Value(''),
+                    output_field=TextField()
+                ),
+                weight='C', config=SEARCH_CONFIG
+            )
+        )
+    )
+
+
+def search_recipes(queryset, search_term):
+    """Рецепты, подходящие под поисковый запрос, от наиболее релевантных.
+
+    В PostgreSQL используется полнотекстовый поиск со стеммингом
+    и сравнение триграмм для опечаток в названии, в остальных СУБД —
+    поиск подстроки.
+    """
+    if not is_full_text_supported():
+        return queryset.filter(
+            Q(title__icontains=search_term)
+            | Q(description__icontains=search_term)
+            | Q(components__title__icontains=search_term)
+        ).distinct()
+    query = SearchQuery(search_term, config=SEARCH_CONFIG, search_type='websearch')
+    return (
+        queryset
+        .filter(
+            Q(search_vector=query)
+            | Q(title__trigram_word_similar=search_term)
+        )
+        .annotate(search_rank=(
+            SearchRank(F('search_vector'), query)
+            + TrigramWordSimilarity(search_term, 'title')
+        ))
+        .order_by('-search_rank', '-date_created')
+    )
@@ -0,0 +1,92 @@
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+
+from .models import RecipeComponent, ShoppingCart, ShoppingListItem
+from .versions import bump_versions, get_versions
+
+SHOPPING_LIST_VERSION_KEY = 'shopping_list_version:{}'
+
+ADD_RECIPE_SQL = f"""
+INSERT INTO {ShoppingListItem._meta.db_table}
+    (user_id, component_id, quantity, recipes_count)
+SELECT cart.user_id, recipe_component.component_id, recipe_component.quantity, 1
+FROM {ShoppingCart._meta.db_table} AS cart
+JOIN {RecipeComponent._meta.db_table} AS recipe_component
+    ON recipe_component.recipe_id = cart.recipe_id
+WHERE cart.recipe_id = %s {{user_condition}}
+ON CONFLICT (user_id, component_id) DO UPDATE SET
+    quantity = {ShoppingListItem._meta.db_table}.quantity + excluded.quantity,
+    recipes_count = {ShoppingListItem._meta.db_table}.recipes_count + 1
+"""
+
+
+def add_recipe_to_shopping_lists(recipe_id, user_id=None):
+    """Добавляет продукты рецепта в списки покупок.
+
+    Учитываются пользователи, у которых рецепт в корзине,
+    или только user_id, если он указан.
+    """
+    params = [recipe_id]
+    user_condition = ''
+    if user_id is not None:
+        user_condition = 'AND cart.user_id = %s'
+        params.append(user_id)
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_RECIPE_SQL.format(user_condition=user_condition), params)
+    bump_shopping_list_versions(recipe_id, user_id)
+
+
+def remove_recipe_from_shopping_lists(recipe_id, user_id=None):
+    """Вычитает продукты рецепта из списков покупок"""
+    items = ShoppingListItem.objects.filter(
+        component__recipe_components__recipe_id=recipe_id,
+        user__shopping_items__recipe_id=recipe_id,
+    )
+    if user_id is not None:
+        items = items.filter(user_id=user_id)
+    recipe_quantity = RecipeComponent.objects.filter(
+        recipe_id=recipe_id, component_id=OuterRef('component_id')
+    ).values('quantity')
+    items.update(
+        quantity=F('quantity') - Subquery(recipe_quantity),
+        recipes_count=F('recipes_count') - 1,
+    )
+    ShoppingListItem.objects.filter(recipes_count=0).filter(
+        component__recipe_components__recipe_id=recipe_id
+    ).delete()
+    bump_shopping_list_versions(recipe_id, user_id)
+
+
+def get_shopping_list_version(user_id):
+    """Версия списка покупок пользователя"""
+    key = SHOPPING_LIST_VERSION_KEY.format(user_id)
+    return get_versions([key])[key]
+
+
+def bump_shopping_list_versions(recipe_id, user_id=None):
+    """Меняет версии списков покупок, в которые входит рецепт"""
+    if user_id is not None:
+        user_ids = [user_id]
+    else:
+        user_ids = (
+            ShoppingCart.objects
+            .filter(recipe_id=recipe_id)
+            .values_list('user_id', flat=True)
+        )
+    bump_versions([SHOPPING_LIST_VERSION_KEY.format(pk) for pk in user_ids])
+
+
+def calculate_shopping_lists(users=None):
+    """Списки покупок, посчитанные заново по корзинам"""
+    carts = RecipeComponent.objects.filter(recipe__shopping_items__isnull=False)
+    if users is not None:
+        carts = carts.filter(recipe__shopping_items__user__in=users)
+    return (
+        carts
+        .values('recipe__shopping_items__user', 'component')
+        .annotate(
+            total_quantity=Sum('quantity'),
+            total_recipes=Count('recipe'),
+        )
+        .order_by()
+    )
@@ -0,0 +1,207 @@
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .counters import decrement, increment
+from .feed import (
+    add_recipe_to_feeds, update_feeds_on_subscribe, update_feeds_on_unsubscribe
+)
+from .images import delete_derivatives, enqueue_image, get_image_field
+from .models import (
+    CookingRecipe, FavoriteRecipe, ImageJob, ProductComponent,
+    RecipeComponent, ShoppingCart, User, UserSubscription
+)
+from .pantry import record_deleted_recipe
+from .search import is_full_text_supported, update_search_vectors
+from .shopping_list import (
+    add_recipe_to_shopping_lists, remove_recipe_from_shopping_lists
+)
+from .versions import (
+    bump_author_version, bump_recipe_version, bump_viewer_version
+)
+
+# Поля пользователя, которые выводятся вместе с рецептами
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name', 'avatar'}
+
+
+@receiver((post_save, post_delete), sender=ProductComponent)
+def invalidate_ingredient_catalog(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(pre_save, sender=ProductComponent)
+def detect_component_rename(sender, instance, **kwargs):
+    instance._renamed = (
+        instance.pk is not None
+        and is_full_text_supported()
+        and sender.objects.filter(pk=instance.pk)
+        .exclude(title=instance.title).exists()
+    )
+
+
+@receiver(post_save, sender=ProductComponent)
+def refresh_component_search_vectors(sender, instance, **kwargs):
+    """Название продукта входит в поисковые векторы рецептов с ним"""
+    if getattr(instance, '_renamed', False):
+        update_search_vectors(
+            RecipeComponent.objects.filter(component=instance).values('recipe')
+        )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        add_recipe_to_shopping_lists(instance.recipe_id, instance.user_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    remove_recipe_from_shopping_lists(instance.recipe_id, instance.user_id)
+
+
+@receiver(post_save, sender=CookingRecipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        increment(User, 'recipes_count', instance.creator_id)
+
+
+@receiver(post_delete, sender=CookingRecipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    decrement(User, 'recipes_count', instance.creator_id)
+
+
+@receiver(post_save, sender=UserSubscription)
+def increment_subscription_counts(sender, instance, created, **kwargs):
+    if created:
+        increment(User, 'subscribers_count', instance.target_user_id)
+        increment(User, 'subscriptions_count', instance.subscriber_id)
+
+
+@receiver(post_delete, sender=UserSubscription)
+def decrement_subscription_counts(sender, instance, **kwargs):
+    decrement(User, 'subscribers_count', instance.target_user_id)
+    decrement(User, 'subscriptions_count', instance.subscriber_id)
+
+
+@receiver(post_save, sender=CookingRecipe)
+def add_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        add_recipe_to_feeds(instance.pk)
+
+
+# Подключаются после счётчиков подписок: используют число подписчиков
+@receiver(post_save, sender=UserSubscription)
+def fill_feed(sender, instance, created, **kwargs):
+    if created:
+        update_feeds_on_subscribe(instance)
+
+
+@receiver(post_delete, sender=UserSubscription)
+def trim_feed(sender, instance, **kwargs):
+    update_feeds_on_unsubscribe(instance)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+def increment_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        increment(CookingRecipe, 'favorites_count', instance.recipe_id)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+def decrement_favorites_count(sender, instance, **kwargs):
+    decrement(CookingRecipe, 'favorites_count', instance.recipe_id)
+
+
+@receiver(post_save, sender=RecipeComponent)
+def increment_component_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        increment(ProductComponent, 'recipes_count', instance.component_id)
+
+
+@receiver(post_delete, sender=RecipeComponent)
+def decrement_component_recipes_count(sender, instance, **kwargs):
+    decrement(ProductComponent, 'recipes_count', instance.component_id)
+
+
+@receiver((post_save, post_delete), sender=CookingRecipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    bump_recipe_version(instance.pk)
+
+
+@receiver(post_delete, sender=CookingRecipe)
+def invalidate_pantry_index(sender, instance, **kwargs):
+    record_deleted_recipe(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=RecipeComponent)
+def invalidate_recipe_components(sender, instance, **kwargs):
+    CookingRecipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now()
+    )
+    bump_recipe_version(instance.recipe_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        bump_author_version(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_author(sender, instance, **kwargs):
+    bump_author_version(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def invalidate_viewer_recipes(sender, instance, **kwargs):
+    bump_viewer_version(instance.user_id)
+
+
+@receiver((post_save, post_delete), sender=UserSubscription)
+def invalidate_viewer_subscriptions(sender, instance, **kwargs):
+    bump_viewer_version(instance.subscriber_id)
+
+
+@receiver(post_save, sender=CookingRecipe)
+@receiver(post_save, sender=User)
+def enqueue_image_derivatives(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or get_image_field(sender) in update_fields:
+        enqueue_image(instance)
+
+
+@receiver(post_delete, sender=CookingRecipe)
+@receiver(post_delete, sender=User)
+def delete_image_derivatives(sender, instance, **kwargs):
+    ImageJob.objects.filter(
+        model_label=sender._meta.label_lower, object_id=instance.pk
+    ).delete()
+    derivatives = getattr(instance, f'{get_image_field(sender)}_derivatives')
+    transaction.on_commit(lambda: delete_derivatives(derivatives))
+
+
+@receiver(pre_save, sender=CookingRecipe)
+def release_replaced_picture(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    previous = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list('picture', flat=True)
+        .first()
+    )
+    if previous and previous != instance.picture.name:
+        storage = instance.picture.storage
+        transaction.on_commit(lambda: storage.delete(previous))
+
+
+@receiver(post_delete, sender=CookingRecipe)
+@receiver(post_delete, sender=User)
+def release_image(sender, instance, **kwargs):
+    image = getattr(instance, get_image_field(sender))
+    if image:
+        name, storage = image.name, image.storage
+        transaction.on_commit(lambda: storage.delete(name))
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import re
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def get_content_name(name, content):
+    """Путь файла по SHA-256 содержимого: ab/cd/abcd….ext"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    content_hash = digest.hexdigest()
+    extension = os.path.splitext(name)[1].lower()
+    return f'{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension}'
+
+
+def is_content_name(name):
+    return bool(CONTENT_NAME_RE.match(name or ''))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище с адресацией по содержимому.
+
+    Одинаковые файлы сохраняются один раз, число ссылок на файл
+    хранится в MediaBlob: каждое сохранение добавляет ссылку, удаление
+    убирает её, а сам файл удаляется с последней ссылкой. Файлы,
+    загруженные до перехода на хранилище, удаляются как обычно.
+    """
+
+    def _save(self, name, content):
+        MediaBlob = apps.get_model('recipes', 'MediaBlob')
+        name = get_content_name(name, content)
+        with transaction.atomic():
+            blob, _ = MediaBlob.objects.select_for_update().get_or_create(
+                name=name
+            )
+            if not super().exists(name):
+                name = super()._save(name, content)
+            MediaBlob.objects.filter(pk=blob.pk).update(
+                references=F('references') + 1
+            )
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Имя файла определяется содержимым в _save
+        return name
+
+    def delete(self, name):
+        if not is_content_name(name):
+            super().delete(name)
+            return
+        MediaBlob = apps.get_model('recipes', 'MediaBlob')
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.references > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(
+                    references=F('references') - 1
+                )
+                return
+            if blob is not None:
+                blob.delete()
+            transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def _delete_unreferenced(self, name):
+        """Удаляет файл, если на него так и не появилось новых ссылок.
+
+        Между фиксацией удаления и этим вызовом _save мог снова сослаться
+        на файл, не записывая его. Строка блокируется, а если её нет —
+        создаётся пустой, чтобы конкурирующий _save дождался удаления
+        файла и записал его заново.
+        """
+        MediaBlob = apps.get_model('recipes', 'MediaBlob')
+        with transaction.atomic():
+            blob, _created = MediaBlob.objects.select_for_update().get_or_create(
+                name=name
+            )
+            if blob.references:
+                return
+            FileSystemStorage.delete(self, name)
+            blob.delete()
@@ -1,2 +1,569 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from random import Random
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import catalog
+from .checks import (
+    LOCAL_CACHE_BACKEND, check_replicas_cache, check_shared_cache
+)
+from .counters import reconcile_counters
+from .models import (
+    CookingRecipe, FavoriteRecipe, FeedEntry, MediaBlob, ProductComponent,
+    RecipeComponent, ShoppingListItem, User, UserSubscription
+)
+from .pantry import DELETED_RECIPES_VERSION_KEY, PantryIndex
+from .search import search_recipes, update_search_vectors
+from .shopping_list import get_shopping_list_version
+from .storage import is_content_name
+from .versions import RECIPES_VERSION_KEY, get_versions, set_new_versions
+
+
+class ContentAddressedStorageTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='password'
+        )
+
+    def create_recipe(self, content=b'image'):
+        recipe = CookingRecipe(
+            title='Рецепт', description='Описание', cook_duration=10,
+            creator=self.author
+        )
+        recipe.picture.save('Dish.PNG', ContentFile(content))
+        return recipe
+
+    def test_identical_uploads_share_one_file(self):
+        first, second = self.create_recipe(), self.create_recipe()
+        self.assertEqual(first.picture.name, second.picture.name)
+        self.assertTrue(is_content_name(first.picture.name))
+        self.assertTrue(first.picture.name.endswith('.png'))
+        self.assertEqual(MediaBlob.objects.get().references, 2)
+
+    def test_file_removed_with_last_reference(self):
+        first, second = self.create_recipe(), self.create_recipe()
+        path = first.picture.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_file_kept_when_referenced_before_removal(self):
+        first = self.create_recipe()
+        path = first.picture.path
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.picture.storage.delete(first.picture.name)
+        # Новая ссылка после удаления строки, но до удаления файла
+        second = self.create_recipe()
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(second.picture.read(), b'image')
+        self.assertEqual(MediaBlob.objects.get().references, 1)
+
+    def test_avatar_delete_keeps_shared_file(self):
+        recipe = self.create_recipe()
+        self.author.avatar.save('avatar.png', ContentFile(b'image'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.avatar.delete()
+        self.assertTrue(os.path.exists(recipe.picture.path))
+        self.assertEqual(MediaBlob.objects.get().references, 1)
+
+    def test_migrate_media_moves_legacy_files(self):
+        os.makedirs(os.path.join(self.media_root, 'recipes/images'))
+        with open(os.path.join(self.media_root, 'recipes/images/old.png'), 'wb') as file:
+            file.write(b'legacy')
+        recipe = CookingRecipe.objects.create(
+            title='Рецепт', description='Описание', cook_duration=10,
+            creator=self.author, picture='recipes/images/old.png'
+        )
+        call_command('migrate_media', stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertTrue(is_content_name(recipe.picture.name))
+        self.assertEqual(recipe.picture.read(), b'legacy')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.media_root, 'recipes/images/old.png')
+        ))
+
+
+class ImportIngredientsTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.json_path = os.path.join(directory, 'ingredients.json')
+        with open(self.json_path, 'w', encoding='utf-8') as file:
+            file.write(
+                '[{"name": "мука", "measurement_unit": "г"},\n'
+                ' {"name": "молоко", "measurement_unit": "мл"},\n'
+                ' {"name": "мука", "measurement_unit": "г"}]'
+            )
+        self.csv_path = os.path.join(directory, 'ingredients.csv')
+        with open(self.csv_path, 'w', encoding='utf-8') as file:
+            file.write('мука,г\nсоль,г\n')
+
+    def import_ingredients(self, *args):
+        stdout = io.StringIO()
+        call_command('import_ingredients', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_repeated_import_does_not_duplicate(self):
+        self.import_ingredients('--path', self.json_path, '--batch-size', '1')
+        self.import_ingredients('--path', self.json_path)
+        self.import_ingredients('--path', self.csv_path)
+        self.assertEqual(
+            sorted(ProductComponent.objects.values_list('title', flat=True)),
+            ['молоко', 'мука', 'соль']
+        )
+
+    def test_non_object_json_item_is_command_error(self):
+        with open(self.json_path, 'w', encoding='utf-8') as file:
+            file.write('[{"name": "мука", "measurement_unit": "г"}, "соль"]')
+        with self.assertRaisesMessage(CommandError, 'элемент 1'):
+            self.import_ingredients('--path', self.json_path)
+        self.assertFalse(ProductComponent.objects.exists())
+
+    def test_dry_run_prune_shows_diff_without_changes(self):
+        self.import_ingredients('--path', self.json_path)
+        output = self.import_ingredients('--path', self.csv_path, '--dry-run', '--prune')
+        self.assertIn('+ соль (г)', output)
+        self.assertIn('- молоко (мл)', output)
+        self.assertEqual(ProductComponent.objects.count(), 2)
+
+    def test_prune_keeps_components_used_in_recipes(self):
+        self.import_ingredients('--path', self.json_path)
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='password'
+        )
+        recipe = CookingRecipe.objects.create(
+            title='Рецепт', description='Описание', cook_duration=10,
+            creator=author, picture='recipe.png'
+        )
+        RecipeComponent.objects.create(
+            recipe=recipe, component=ProductComponent.objects.get(title='молоко'),
+            quantity=1
+        )
+        ProductComponent.objects.create(title='сахар', unit_type='г')
+        self.import_ingredients('--path', self.csv_path, '--prune')
+        self.assertEqual(
+            sorted(ProductComponent.objects.values_list('title', flat=True)),
+            ['молоко', 'мука', 'соль']
+        )
+
+
+class IngredientCatalogTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ProductComponent.objects.bulk_create([
+            ProductComponent(title='Молоко', unit_type='мл', recipes_count=2),
+            ProductComponent(
+                title='молоко топлёное', unit_type='мл', recipes_count=7
+            ),
+            ProductComponent(title='Мука', unit_type='г', recipes_count=9),
+            ProductComponent(title='Масло', unit_type='г', recipes_count=1),
+            ProductComponent(title='соль', unit_type='г', recipes_count=5),
+        ])
+
+    def setUp(self):
+        patcher = mock.patch.object(catalog, '_catalog', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, prefix, limit=None):
+        return [
+            component.title for component
+            in catalog.get_ingredient_catalog().search(prefix, limit)
+        ]
+
+    def test_prefix_match_ignores_case(self):
+        for prefix in ('мол', 'МОЛ', 'Мол'):
+            self.assertEqual(
+                self.search(prefix), ['молоко топлёное', 'Молоко']
+            )
+        self.assertEqual(self.search('молоко т'), ['молоко топлёное'])
+        self.assertEqual(self.search('сахар'), [])
+
+    def test_matches_ranked_by_recipes_count(self):
+        self.assertEqual(self.search('м'), [
+            'Мука', 'молоко топлёное', 'Молоко', 'Масло'
+        ])
+
+    def test_empty_prefix_returns_alphabetical_catalog(self):
+        self.assertEqual(self.search(''), [
+            'Масло', 'Молоко', 'молоко топлёное', 'Мука', 'соль'
+        ])
+
+    def test_limit(self):
+        self.assertEqual(self.search('м', limit=2), ['Мука', 'молоко топлёное'])
+        self.assertEqual(self.search('', limit=1), ['Масло'])
+
+    def test_warm_index_does_not_query_database(self):
+        self.search('м')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('мук'), ['Мука'])
+
+    def test_rebuild_after_version_bump(self):
+        self.assertEqual(self.search('са'), [])
+        # Сохранение продукта сигналом меняет версию справочника
+        ProductComponent.objects.create(title='Сахар', unit_type='г')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('са'), ['Сахар'])
+        with self.assertNumQueries(0):
+            self.search('са')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'нужен полнотекстовый поиск PostgreSQL')
+class FullTextSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author', password='password'
+        )
+        cls.beet = ProductComponent.objects.create(title='свёкла', unit_type='г')
+        cls.soup, cls.salad, cls.pie = (
+            CookingRecipe.objects.create(
+                title=title, description=description, cook_duration=10,
+                picture='recipes/images/test.png', creator=author
+            )
+            for title, description in (
+                ('Борщ', 'Суп на говяжьем бульоне'),
+                ('Винегрет', 'Салат, который подают к борщу'),
+                ('Пирог', 'Сладкая выпечка'),
+            )
+        )
+        RecipeComponent.objects.create(
+            recipe=cls.salad, component=cls.beet, quantity=100
+        )
+        update_search_vectors([cls.soup.pk, cls.salad.pk, cls.pie.pk])
+
+    def search(self, search_term):
+        return list(search_recipes(CookingRecipe.objects.all(), search_term))
+
+    def test_title_ranked_above_description(self):
+        self.assertEqual(self.search('борщ'), [self.soup, self.salad])
+
+    def test_stemming_and_typos(self):
+        self.assertEqual(self.search('борща'), [self.soup, self.salad])
+        self.assertEqual(self.search('пирок'), [self.pie])
+
+    def test_component_titles_searched(self):
+        self.assertEqual(self.search('свёкла'), [self.salad])
+
+    def test_vectors_rebuilt(self):
+        CookingRecipe.objects.update(search_vector=None)
+        self.assertEqual(self.search('выпечка'), [])
+        update_search_vectors([self.pie.pk])
+        self.assertEqual(self.search('выпечка'), [self.pie])
+
+    def test_component_rename_refreshes_vectors(self):
+        self.beet.title = 'буряк'
+        self.beet.save()
+        self.assertEqual(self.search('буряк'), [self.salad])
+        self.assertEqual(self.search('свёкла'), [])
+
+
+class CountersTest(TestCase):
+
+    def setUp(self):
+        self.author, self.reader = (
+            User.objects.create_user(
+                email=f'{username}@example.com', username=username,
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for username in ('author', 'reader')
+        )
+        self.component = ProductComponent.objects.create(title='мука', unit_type='г')
+        self.recipe = CookingRecipe.objects.create(
+            title='Рецепт', description='Описание', cook_duration=10,
+            creator=self.author, picture='recipe.png'
+        )
+        RecipeComponent.objects.create(
+            recipe=self.recipe, component=self.component, quantity=1
+        )
+
+    def get_counters(self):
+        for instance in (self.author, self.reader, self.recipe, self.component):
+            instance.refresh_from_db()
+        return (
+            self.author.recipes_count, self.author.subscribers_count,
+            self.reader.subscriptions_count, self.recipe.favorites_count,
+            self.component.recipes_count
+        )
+
+    def test_signals_maintain_counters(self):
+        subscription = UserSubscription.objects.create(
+            subscriber=self.reader, target_user=self.author
+        )
+        favorite = FavoriteRecipe.objects.create(user=self.reader, recipe=self.recipe)
+        self.assertEqual(self.get_counters(), (1, 1, 1, 1, 1))
+        subscription.delete()
+        favorite.delete()
+        self.assertEqual(self.get_counters(), (1, 0, 0, 0, 1))
+        self.recipe.delete()
+        self.author.refresh_from_db()
+        self.component.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+        self.assertEqual(self.component.recipes_count, 0)
+
+    def test_drifted_counter_does_not_go_negative(self):
+        ProductComponent.objects.update(recipes_count=0)
+        User.objects.update(recipes_count=0)
+        self.recipe.delete()
+        self.component.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.component.recipes_count, 0)
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_reconcile_counters(self):
+        UserSubscription.objects.bulk_create([
+            UserSubscription(subscriber=self.reader, target_user=self.author)
+        ])
+        ProductComponent.objects.update(recipes_count=7)
+        drift = {
+            'user.subscribers_count': 1, 'user.subscriptions_count': 1,
+            'productcomponent.recipes_count': 1,
+        }
+        self.assertEqual(
+            {label: count for label, count in reconcile_counters(dry_run=True).items() if count},
+            drift
+        )
+        self.assertEqual(self.get_counters(), (1, 0, 0, 0, 7))
+        output = io.StringIO()
+        call_command('reconcile_counters', stdout=output)
+        self.assertIn('user.subscribers_count: расхождений 1', output.getvalue())
+        self.assertEqual(self.get_counters(), (1, 1, 1, 0, 1))
+        self.assertFalse(any(reconcile_counters(dry_run=True).values()))
+
+
+class SeedLoadTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        ProductComponent.objects.bulk_create(
+            ProductComponent(title=f'продукт {index}', unit_type='г')
+            for index in range(30)
+        )
+
+    def seed_load(self, *args):
+        call_command(
+            'seed_load', '--users', '20', '--recipes', '40', *args,
+            stdout=io.StringIO()
+        )
+
+    def test_counters_match_generated_rows(self):
+        self.seed_load('--batch-size', '7')
+        self.assertEqual(CookingRecipe.objects.count(), 40)
+        self.assertTrue(0 < FavoriteRecipe.objects.count() <= 200)
+        self.assertFalse(
+            UserSubscription.objects.filter(subscriber=F('target_user')).exists()
+        )
+        self.assertFalse(any(reconcile_counters(dry_run=True).values()))
+        self.assertEqual(MediaBlob.objects.get().references, 40)
+        self.assertTrue(FeedEntry.objects.exists())
+        output = io.StringIO()
+        call_command('rebuild_feeds', '--verify', stdout=output)
+        self.assertIn('Ленты подписок совпадают', output.getvalue())
+
+    def test_rebuild_changes_shopping_list_versions(self):
+        self.seed_load()
+        user_id = ShoppingListItem.objects.values_list('user_id', flat=True)[0]
+        version = get_shopping_list_version(user_id)
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.assertNotEqual(get_shopping_list_version(user_id), version)
+
+    def test_same_seed_gives_same_data(self):
+        runs = []
+        for _run in range(2):
+            with transaction.atomic():
+                self.seed_load('--seed', '3')
+                runs.append(list(
+                    RecipeComponent.objects
+                    .order_by('recipe__title', 'component__title')
+                    .values_list('recipe__title', 'component__title', 'quantity')
+                ))
+                transaction.set_rollback(True)
+        self.assertEqual(runs[0], runs[1])
+
+
+class BenchmarkTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.output = os.path.join(directory, 'result.json')
+        settings_override = override_settings(MEDIA_ROOT=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        ProductComponent.objects.bulk_create(
+            ProductComponent(title=f'продукт {index}', unit_type='г')
+            for index in range(10)
+        )
+        call_command('seed_load', '--users', '5', '--recipes', '10', stdout=io.StringIO())
+
+    def test_reports_latency_and_queries_per_endpoint(self):
+        call_command(
+            'benchmark', '--requests', '4', '--warmup', '1', '--postman', '',
+            '--output', self.output, stdout=io.StringIO()
+        )
+        with open(self.output, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertIn('conn_max_age', report['connections'])
+        endpoints = report['endpoints']
+        self.assertEqual(set(endpoints), {
+            'recipes-list', 'ingredients-list', 'users-subscriptions',
+            'recipes-download-shopping-list'
+        })
+        for summary in endpoints.values():
+            self.assertEqual(summary['errors'], 0)
+            self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+        self.assertGreater(endpoints['recipes-list']['queries_mean'], 0)
+
+    def test_default_postman_collection_optional(self):
+        missing = os.path.join(os.path.dirname(self.output), 'missing.json')
+        with mock.patch(
+            'recipes.management.commands.benchmark.DEFAULT_POSTMAN_PATH',
+            Path(missing)
+        ):
+            call_command(
+                'benchmark', '--requests', '1', '--warmup', '0',
+                '--output', self.output, stdout=io.StringIO()
+            )
+        with self.assertRaisesMessage(CommandError, missing):
+            call_command(
+                'benchmark', '--requests', '1', '--postman', missing,
+                '--output', self.output, stdout=io.StringIO()
+            )
+
+
+class PantryIndexTest(SimpleTestCase):
+    """Подбор по битовым множествам совпадает с подсчётом по рецептам"""
+
+    def setUp(self):
+        self.random = Random(5)
+        self.now = datetime.now(timezone.utc)
+        self.recipes = {
+            recipe_id: self.random.sample(range(40), self.random.randint(1, 12))
+            for recipe_id in range(1, 400)
+        }
+        # Позиция рецепта в индексе: изменённые рецепты переносятся в конец
+        self.order = {recipe_id: recipe_id for recipe_id in self.recipes}
+        self.index = PantryIndex(
+            (
+                (recipe_id, component_id)
+                for recipe_id in sorted(self.recipes)
+                for component_id in self.recipes[recipe_id]
+            ),
+            {RECIPES_VERSION_KEY: 0, DELETED_RECIPES_VERSION_KEY: 0},
+            self.now.timestamp(), self.now.timestamp()
+        )
+
+    def expected_matches(self, pantry):
+        matches = []
+        for recipe_id, components in self.recipes.items():
+            hits = len(set(pantry) & set(components))
+            if hits:
+                matches.append((len(components) - hits, -self.order[recipe_id], recipe_id))
+        return [(recipe_id, missing) for missing, _order, recipe_id in sorted(matches)]
+
+    def test_matches_brute_force(self):
+        for position, recipe_id in enumerate(
+            self.random.sample(sorted(self.recipes), 50), start=len(self.recipes) + 1
+        ):
+            self.recipes[recipe_id] = self.random.sample(range(45), 5)
+            self.order[recipe_id] = position
+            self.index.apply_changes(
+                (recipe_id, self.now + timedelta(seconds=1), component_id)
+                for component_id in self.recipes[recipe_id]
+            )
+        deleted = self.random.sample(sorted(self.recipes), 30)
+        for recipe_id in deleted:
+            del self.recipes[recipe_id]
+        # Удаление части рецептов не записано: их находит сверка id
+        self.index.remove_deleted(
+            (recipe_id, self.now + timedelta(seconds=2)) for recipe_id in deleted[:20]
+        )
+        self.assertEqual(len(self.index), len(self.recipes) + 10)
+        self.assertEqual(
+            self.index.deleted_until, (self.now + timedelta(seconds=2)).timestamp()
+        )
+        self.index.remove_missing(self.recipes)
+        self.assertEqual(len(self.index), len(self.recipes))
+        for _attempt in range(20):
+            pantry = self.random.sample(range(50), self.random.randint(1, 15))
+            expected = self.expected_matches(pantry)
+            matches = self.index.match(pantry)
+            self.assertEqual(matches.count(), len(expected))
+            for start, stop in ((0, 6), (7, 30), (len(expected) - 2, len(expected) + 5)):
+                self.assertEqual(matches[start:stop], expected[start:stop])
+
+    def test_unchanged_recipe_keeps_position(self):
+        for _attempt in range(2):
+            self.index.apply_changes(
+                (1, self.now, component_id) for component_id in self.recipes[1]
+            )
+        self.assertEqual(self.index.dead, 1)
+        self.assertEqual(len(self.index), len(self.recipes))
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+
+    def test_local_memory_cache_warning(self):
+        self.assertEqual(check_shared_cache(None), [])
+        local_cache = {'default': {'BACKEND': LOCAL_CACHE_BACKEND}}
+        with override_settings(CACHES=local_cache):
+            self.assertEqual(
+                [message.id for message in check_shared_cache(None)], ['recipes.W001']
+            )
+            with override_settings(DEBUG=True):
+                self.assertEqual(check_shared_cache(None), [])
+
+    def test_replicas_require_shared_cache(self):
+        local_cache = {'default': {'BACKEND': LOCAL_CACHE_BACKEND}}
+        with override_settings(CACHES=local_cache, DEBUG=True):
+            self.assertEqual(check_replicas_cache(None), [])
+            with override_settings(DB_REPLICAS=['replica1']):
+                self.assertEqual(
+                    [message.id for message in check_replicas_cache(None)],
+                    ['recipes.E001']
+                )
+
+
+class ReplicaLagVersionsTest(SimpleTestCase):
+
+    @override_settings(DB_REPLICAS=['replica1'], DB_REPLICA_LAG_SECONDS=5)
+    def test_version_changes_once_replicas_catch_up(self):
+        key = 'replica_lag_test_version'
+        set_new_versions([key])
+        pending = get_versions([key])[key]
+        with mock.patch('recipes.versions.time.time_ns') as time_ns:
+            time_ns.return_value = pending + 6 * 10 ** 9
+            settled = get_versions([key])[key]
+        self.assertEqual(settled, pending + 1)
@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 
 urlpatterns = [
-    path('<int:recipe_id>/', views.redirect_to_recipe, name='short-link'),
-]
\ No newline at end of file
+    path(
+        '<int:recipe_id>/',
+        views.aredirect_to_recipe if settings.ASYNC_VIEWS else views.redirect_to_recipe,
+        name='short-link'
+    ),
+]
@@ -0,0 +1,64 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+RECIPES_VERSION_KEY = 'recipes_version'
+RECIPE_VERSION_KEY = 'recipe_version:{}'
+USERS_VERSION_KEY = 'users_version'
+AUTHOR_VERSION_KEY = 'author_version:{}'
+VIEWER_VERSION_KEY = 'viewer_version:{}'
+
+
+def get_versions(keys):
+    """Версии данных по ключам кеша, недостающие версии создаются.
+
+    При чтении из реплик версия, изменённая менее DB_REPLICA_LAG_SECONDS
+    назад, читается на единицу меньше: то, что закешировано по данным
+    отстающей реплики, перестаёт совпадать с версией, когда реплики
+    догонят основную БД, во всех процессах и без отдельной смены версий.
+    """
+    versions = cache.get_many(keys)
+    now = time.time_ns()
+    missing = {key: now for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    if settings.DB_REPLICAS:
+        settled = now - settings.DB_REPLICA_LAG_SECONDS * 10 ** 9
+        versions = {
+            key: version if version <= settled else version - 1
+            for key, version in versions.items()
+        }
+    return versions
+
+
+def set_new_versions(keys):
+    version = time.time_ns()
+    cache.set_many({key: version for key in keys}, timeout=None)
+
+
+def bump_versions(keys):
+    """Меняет версии сразу и ещё раз после фиксации транзакции.
+
+    Повторная смена версии отбрасывает то, что конкурирующие запросы
+    успели закешировать по старому содержимому БД до фиксации.
+    """
+    set_new_versions(keys)
+    transaction.on_commit(lambda: set_new_versions(keys))
+
+
+def bump_recipe_version(recipe_id):
+    bump_versions([RECIPE_VERSION_KEY.format(recipe_id), RECIPES_VERSION_KEY])
+
+
+def bump_author_version(user_id):
+    bump_versions([
+        AUTHOR_VERSION_KEY.format(user_id), USERS_VERSION_KEY, RECIPES_VERSION_KEY
+    ])
+
+
+def bump_viewer_version(user_id):
+    """Меняет версию избранного, корзины и подписок пользователя"""
+    bump_versions([VIEWER_VERSION_KEY.format(user_id)])
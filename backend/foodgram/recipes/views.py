@@ -9,3 +9,11 @@ def redirect_to_recipe(request, recipe_id):
         raise Http404(_('Некорректная короткая ссылка: рецепт с id={} не найден').format(recipe_id))
         
     return redirect(f'/recipes/{recipe_id}/')
+
+
+async def aredirect_to_recipe(request, recipe_id):
+    """Асинхронный вариант redirect_to_recipe для работы через ASGI"""
+    if not await CookingRecipe.objects.filter(id=recipe_id).aexists():
+        raise Http404(_('Некорректная короткая ссылка: рецепт с id={} не найден').format(recipe_id))
+
+    return redirect(f'/recipes/{recipe_id}/')